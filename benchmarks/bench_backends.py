@@ -0,0 +1,81 @@
+"""
+Accuracy vs throughput of the ONNX Runtime backends against PyTorch on a held-out image set.
+
+Accuracy is agreement with the PyTorch detections: a box counts as reproduced
+when a box of the same class overlaps it with IoU >= --iou. Run export.py
+(with --int8 for onnx-int8) first.
+
+    python benchmarks/bench_backends.py --image_dir data/images/val --num_images 300
+"""
+import os
+import sys
+import time
+import argparse
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from inference import BACKENDS, IMG_SIZE, backend_model_path, box_iou, detect, list_images, load_forward
+
+
+def run_backend(backend, image_paths, batch_size, imgsz, threads=None):
+    """Detections per image and images/sec, excluding one warm-up batch."""
+    forward = load_forward(backend, threads=threads)
+    list(detect(image_paths[:batch_size], forward, batch_size, imgsz))
+    start = time.perf_counter()
+    dets = [d for _, d in detect(image_paths, forward, batch_size, imgsz)]
+    return dets, len(image_paths) / (time.perf_counter() - start)
+
+
+def agreement(reference, candidate, iou_threshold=0.5):
+    """Precision/recall of candidate detections against the reference ones, plus mean IoU of the matches."""
+    matched, ious = 0, []
+    for ref, cand in zip(reference, candidate):
+        if not len(ref) or not len(cand):
+            continue
+        iou = box_iou(ref[:, :4], cand[:, :4])
+        iou[ref[:, None, 5] != cand[None, :, 5]] = 0
+        used = np.zeros(len(cand), dtype=bool)
+        for i in range(len(ref)):
+            row = np.where(used, 0, iou[i])
+            j = int(row.argmax())
+            if row[j] >= iou_threshold:
+                used[j] = True
+                matched += 1
+                ious.append(row[j])
+    n_ref = sum(len(d) for d in reference)
+    n_cand = sum(len(d) for d in candidate)
+    return {
+        "precision": matched / n_cand if n_cand else 1.0,
+        "recall": matched / n_ref if n_ref else 1.0,
+        "mean_iou": float(np.mean(ious)) if ious else 1.0,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--image_dir', required=True, help='Held-out images')
+    parser.add_argument('--num_images', type=int, default=300)
+    parser.add_argument('--batch_size', type=int, default=8)
+    parser.add_argument('--imgsz', type=int, default=IMG_SIZE)
+    parser.add_argument('--threads', type=int, default=None, help='ONNX Runtime intra-op threads')
+    parser.add_argument('--iou', type=float, default=0.5)
+    parser.add_argument('--backends', nargs='+', default=list(BACKENDS), choices=BACKENDS)
+    args = parser.parse_args()
+
+    image_paths = [os.path.join(args.image_dir, f) for f in list_images(args.image_dir)[:args.num_images]]
+    backends = ["torch"] + [b for b in args.backends if b != "torch" and os.path.exists(backend_model_path(b))]
+    reference, torch_rate = run_backend("torch", image_paths, args.batch_size, args.imgsz)
+
+    print(f"{'backend':<10} {'images/s':>9} {'speedup':>8} {'boxes':>7} {'precision':>10} {'recall':>7} {'mean IoU':>9}")
+    for backend in backends:
+        if backend == "torch":
+            dets, rate = reference, torch_rate
+        else:
+            dets, rate = run_backend(backend, image_paths, args.batch_size, args.imgsz, args.threads)
+        stats = agreement(reference, dets, args.iou)
+        print(f"{backend:<10} {rate:9.2f} {rate / torch_rate:7.2f}x {sum(len(d) for d in dets):7d} "
+              f"{stats['precision']:10.3f} {stats['recall']:7.3f} {stats['mean_iou']:9.3f}")
+    skipped = [b for b in args.backends if b not in backends]
+    if skipped:
+        print(f"Skipped {', '.join(skipped)}: run export.py{' --int8' if 'onnx-int8' in skipped else ''} first")
@@ -0,0 +1,80 @@
+"""
+Rows/sec of csvtojson.process_dataframe_to_coco against the original iterrows loop.
+
+    python benchmarks/bench_csvtojson.py --rows 1000000
+"""
+import os
+import sys
+import time
+import argparse
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from csvtojson import CATEGORIES, CATEGORY_NAME_TO_ID, process_dataframe_to_coco
+
+
+def synthetic_annotations(rows, images=None, seed=0):
+    """Random train_annotations.csv-shaped dataframe, with a few unknown class names mixed in."""
+    rng = np.random.default_rng(seed)
+    images = images or max(1, rows // 20)
+    names = np.array([cat['name'] for cat in CATEGORIES] + [' Sedan ', 'unknown'])
+    x_min = rng.uniform(0, 1800, rows).round(2)
+    y_min = rng.uniform(0, 1000, rows).round(2)
+    return pd.DataFrame({
+        'image_name': np.char.add('frame_', rng.integers(0, images, rows).astype(str)) + '.jpg',
+        'x_min': x_min,
+        'y_min': y_min,
+        'x_max': x_min + rng.uniform(5, 120, rows).round(2),
+        'y_max': y_min + rng.uniform(5, 80, rows).round(2),
+        'class_name': names[rng.integers(0, len(names), rows)],
+    })
+
+
+def iterrows_reference(df, image_list):
+    """The pre-vectorization implementation, kept here only as the benchmark baseline."""
+    coco = {"images": [], "annotations": [], "categories": CATEGORIES}
+    image_id_map = {}
+    for img_id, image_name in enumerate(image_list, start=1):
+        coco['images'].append({"id": img_id, "file_name": image_name, "width": 1920, "height": 1080})
+        image_id_map[image_name] = img_id
+    ann_id = 1
+    for _, row in df.iterrows():
+        cat_name = row['class_name'].strip()
+        if cat_name not in CATEGORY_NAME_TO_ID:
+            continue
+        width = row['x_max'] - row['x_min']
+        height = row['y_max'] - row['y_min']
+        coco['annotations'].append({
+            "id": ann_id,
+            "image_id": image_id_map[row['image_name']],
+            "category_id": CATEGORY_NAME_TO_ID[cat_name],
+            "bbox": [row['x_min'], row['y_min'], width, height],
+            "area": width * height,
+            "iscrowd": 0,
+            "segmentation": []
+        })
+        ann_id += 1
+    return coco
+
+
+def time_rows_per_sec(fn, df, image_list):
+    start = time.perf_counter()
+    result = fn(df, image_list)
+    return result, len(df) / (time.perf_counter() - start)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=200000)
+    args = parser.parse_args()
+
+    df = synthetic_annotations(args.rows)
+    image_list = list(df['image_name'].unique())
+    reference, ref_rate = time_rows_per_sec(iterrows_reference, df, image_list)
+    vectorized, vec_rate = time_rows_per_sec(process_dataframe_to_coco, df, image_list)
+
+    assert vectorized == reference, "vectorized output differs from the iterrows reference"
+    print(f"iterrows:   {ref_rate:12,.0f} rows/s")
+    print(f"vectorized: {vec_rate:12,.0f} rows/s ({vec_rate / ref_rate:.1f}x)")
@@ -0,0 +1,151 @@
+"""
+Time and memory of per-box result handling against the columnar DetectionStore, on dense frames.
+
+Each frame has --boxes detections (default 300, the max_det of the training
+args.yaml). Compared per frame:
+
+    extraction:  box.xyxy[0].tolist() / box.cls[0].item() per ultralytics box, against
+                 one boxes.data transfer appended to the store
+    COCO:        one annotation dict per box + json.dumps, against detection_store.annotation_lines
+    YOLO:        coco2yolo on the COCO dict, against DetectionStore.yolo_label_files
+
+and the memory held by --frames frames of results as dicts or in the store.
+
+    python benchmarks/bench_detection_store.py --boxes 300 --frames 1000
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tracemalloc
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from coco2yolo import yolo_label_files
+from coco_writer import COMPACT_SEPARATORS
+from detection_store import DetectionStore, annotation_lines
+from inference import CATEGORIES, MAX_DET, YOLO_IDX_TO_CAT_ID
+
+
+def synthetic_frame(rng, boxes, width=1920, height=1080):
+    """Nx6 float32 detections spread over a 1920x1080 frame."""
+    xy = rng.uniform(0, [width - 120, height - 80], (boxes, 2))
+    wh = rng.uniform([8, 6], [120, 80], (boxes, 2))
+    conf = rng.uniform(0.25, 1.0, (boxes, 1))
+    cls = rng.integers(0, len(CATEGORIES), (boxes, 1))
+    return np.hstack([xy, xy + wh, conf, cls]).astype(np.float32)
+
+
+def per_box_reference(result_boxes, image_id, first_annotation_id):
+    """The original per-box loop: two tensor-to-Python round trips and one dict per box."""
+    annotations = []
+    for annotation_id, box in enumerate(result_boxes, start=first_annotation_id):
+        x1, y1, x2, y2 = box.xyxy[0].tolist()
+        cls = int(box.cls[0].item())
+        w, h = x2 - x1, y2 - y1
+        annotations.append({"id": annotation_id, "image_id": image_id,
+                            "category_id": YOLO_IDX_TO_CAT_ID.get(cls, 15), "bbox": [x1, y1, w, h],
+                            "area": w * h, "segmentation": [], "iscrowd": 0})
+    return annotations
+
+
+def dict_records(dets, image_id, first_annotation_id):
+    """One annotation dict per box from a numpy array, as main.py built them before the store."""
+    annotations = []
+    for annotation_id, (x1, y1, x2, y2, _, cls) in enumerate(dets.tolist(), start=first_annotation_id):
+        w, h = x2 - x1, y2 - y1
+        annotations.append({"id": annotation_id, "image_id": image_id,
+                            "category_id": YOLO_IDX_TO_CAT_ID.get(int(cls), 15), "bbox": [x1, y1, w, h],
+                            "area": w * h, "segmentation": [], "iscrowd": 0})
+    return annotations
+
+
+def per_frame_ms(fn, frames, repeat=3):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for i, frame in enumerate(frames):
+            fn(i, frame)
+        best = min(best, time.perf_counter() - start)
+    return best / len(frames) * 1000
+
+
+def retained_bytes(build):
+    """Bytes still allocated (tracemalloc) by the object build() returns."""
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    kept = build()
+    size = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    del kept
+    return size
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--boxes', type=int, default=MAX_DET, help='Detections per frame')
+    parser.add_argument('--frames', type=int, default=1000)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    import torch
+    from ultralytics.engine.results import Boxes
+
+    rng = np.random.default_rng(args.seed)
+    frames = [synthetic_frame(rng, args.boxes) for _ in range(args.frames)]
+    results = [Boxes(torch.from_numpy(f), (1080, 1920)) for f in frames[:100]]
+
+    # The store's lines are the dicts' json.dumps, byte for byte
+    reference = [json.dumps(a, separators=COMPACT_SEPARATORS) for a in dict_records(frames[0], 0, 1)]
+    assert annotation_lines(frames[0][:, :4], frames[0][:, 5], 0, 1) == reference
+
+    store = DetectionStore()
+    extraction = {
+        "per-box .tolist()/.item() + dict": per_frame_ms(lambda i, r: per_box_reference(r, i, 1), results, 1),
+        "boxes.data bulk copy into store": per_frame_ms(
+            lambda i, r: store.add(store.add_image(f'{i}.jpg', 1920, 1080), r.data.cpu().numpy()), results),
+    }
+    coco = {
+        "dict per box + json.dumps": per_frame_ms(
+            lambda i, f: [json.dumps(a, separators=COMPACT_SEPARATORS) for a in dict_records(f, i, 1)], frames),
+        "annotation_lines": per_frame_ms(lambda i, f: annotation_lines(f[:, :4], f[:, 5], i, 1), frames),
+    }
+
+    def fill_store():
+        s = DetectionStore()
+        for i, f in enumerate(frames):
+            s.add(s.add_image(f'{i}.jpg', 1920, 1080), f)
+        return s
+
+    def fill_dicts():
+        images, annotations = [], []
+        for i, f in enumerate(frames):
+            images.append({"id": i, "file_name": f'{i}.jpg', "width": 1920, "height": 1080})
+            annotations += dict_records(f, i, len(annotations) + 1)
+        return {"images": images, "annotations": annotations, "categories": CATEGORIES}
+
+    full = fill_store()
+    coco_dict = fill_dicts()
+    start = time.perf_counter()
+    dict_labels = yolo_label_files(coco_dict)
+    yolo_dict_ms = (time.perf_counter() - start) * 1000 / args.frames
+    start = time.perf_counter()
+    store_labels = full.yolo_label_files()
+    yolo_store_ms = (time.perf_counter() - start) * 1000 / args.frames
+    assert store_labels == dict_labels
+    del coco_dict
+
+    dict_bytes = retained_bytes(fill_dicts)
+    store_bytes = retained_bytes(fill_store)
+
+    print(f"{args.boxes} boxes per frame, {args.frames} frames")
+    for title, timings in (("extraction", extraction), ("COCO serialization", coco),
+                           ("YOLO labels", {"coco2yolo on dicts": yolo_dict_ms, "store": yolo_store_ms})):
+        base = next(iter(timings.values()))
+        print(f"{title}:")
+        for name, ms in timings.items():
+            print(f"  {name:<36} {ms:8.3f} ms/frame  {base / ms:6.1f}x")
+    print(f"memory for {args.frames} frames: dicts {dict_bytes / 1e6:8.1f} MB, store {store_bytes / 1e6:6.1f} MB "
+          f"({dict_bytes / store_bytes:.0f}x less); {store_bytes / args.frames / args.boxes:.0f} bytes per box")
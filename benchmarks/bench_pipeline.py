@@ -0,0 +1,386 @@
+"""
+Per-stage timings of main.create_coco_annotations and of the dataset converters, as JSON.
+
+The detection part times decode, preprocess (letterbox), forward (collate + model),
+postprocess (unletterbox), record building (main.image_record and
+detection_store.annotation_lines) and the JSON dump (CocoWriter) one stage at a time on the same images, then the
+whole create_coco_annotations run end to end, where the stages overlap. The
+converter part times csvtojson.py, coco2yolo.py and clean.py on seeded
+synthetic tables.
+
+Without --model a randomly initialised yolov10n with 15 classes stands in for
+the trained weights, and without --image_dir seeded synthetic 1920x1080 frames
+stand in for the images, so the benchmark runs offline on a CPU. The stand-in
+model detects nothing, so --boxes_per_image random boxes replace its output in
+the stages after forward to give them a realistic load.
+
+    python benchmarks/bench_pipeline.py --output bench.json
+    python benchmarks/bench_pipeline.py --output new.json --compare bench.json
+
+--compare exits with status 1 when any throughput (a *_per_s value) dropped by
+more than --tolerance against the earlier result.
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import contextlib
+import subprocess
+from datetime import datetime, timezone
+
+import cv2
+import numpy as np
+import pandas as pd
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+from bench_csvtojson import synthetic_annotations
+from clean import CATEGORY_MAP, build_lookups, clean_annotations_chunk, process_data
+from coco2yolo import coco_to_yolo
+from coco_writer import CocoWriter
+from csvtojson import CATEGORIES, csv_to_coco, process_dataframe_to_coco
+from inference import IMG_SIZE, MODEL_PATH, collate, list_images, load_forward, prepare_frame, unletterbox
+from detection_store import annotation_lines
+from main import create_coco_annotations, image_record
+
+
+class StageTimer:
+    """Wall time of every call of one stage; a call may cover several items (a batch)."""
+
+    def __init__(self):
+        self.calls = []
+        self.items = 0
+
+    @contextlib.contextmanager
+    def time(self, items=1):
+        start = time.perf_counter()
+        yield
+        self.calls.append(time.perf_counter() - start)
+        self.items += items
+
+    def summary(self):
+        calls = np.array(self.calls) * 1000
+        total = calls.sum() / 1000
+        p50, p95, p99 = np.percentile(calls, [50, 95, 99]) if len(calls) else (0.0, 0.0, 0.0)
+        return {"calls": len(calls), "items": self.items, "total_s": round(total, 4),
+                "items_per_s": round(self.items / total, 2) if total else None,
+                "mean_ms": round(calls.mean(), 3) if len(calls) else 0.0,
+                "p50_ms": round(p50, 3), "p95_ms": round(p95, 3), "p99_ms": round(p99, 3)}
+
+
+def synthetic_images(image_dir, count, width=1920, height=1080, seed=0):
+    """Seeded road-like JPEG frames: a smooth background with a few solid rectangles."""
+    rng = np.random.default_rng(seed)
+    base = cv2.GaussianBlur((rng.random((height, width, 3)) * 255).astype(np.uint8), (31, 31), 0)
+    os.makedirs(image_dir, exist_ok=True)
+    for i in range(count):
+        image = base.copy()
+        for _ in range(8):
+            x, y = int(rng.integers(0, width - 200)), int(rng.integers(0, height - 120))
+            color = tuple(int(c) for c in rng.integers(0, 256, 3))
+            cv2.rectangle(image, (x, y), (x + int(rng.integers(40, 200)), y + int(rng.integers(30, 120))), color, -1)
+        cv2.imwrite(os.path.join(image_dir, f'frame_{i:04d}.jpg'), image)
+
+
+def stand_in_model(model_path, seed=0):
+    """Save a randomly initialised 15-class yolov10n at model_path (built from its yaml, no download)."""
+    import torch
+    from ultralytics import YOLO
+    from ultralytics.nn.tasks import DetectionModel
+
+    torch.manual_seed(seed)
+    model = YOLO('yolov10n.yaml')
+    model.model = DetectionModel('yolov10n.yaml', nc=len(CATEGORIES), verbose=False)
+    model.model.names = {i: cat['name'] for i, cat in enumerate(CATEGORIES)}
+    os.makedirs(os.path.dirname(model_path), exist_ok=True)
+    model.save(model_path)
+
+
+def random_dets(rng, count, chw):
+    """count random Nx6 letterbox-space detections inside a letterboxed image."""
+    _, h, w = chw.shape
+    xy = rng.uniform(0, [w - 60, h - 40], (count, 2))
+    wh = rng.uniform([8, 6], [60, 40], (count, 2))
+    conf = rng.uniform(0.25, 1.0, (count, 1))
+    cls = rng.integers(0, len(CATEGORIES), (count, 1))
+    return np.hstack([xy, xy + wh, conf, cls]).astype(np.float32)
+
+
+def bench_stages(image_paths, output_json, batch_size, imgsz, boxes_per_image, seed=0):
+    """Run the detection stages of main.py one after another and time each of them."""
+    timers = {name: StageTimer() for name in
+              ("decode", "preprocess", "forward", "postprocess", "records", "json_dump")}
+    rng = np.random.default_rng(seed)
+    forward = load_forward("torch")
+    # One warm-up batch, so the forward timings exclude lazy initialisation
+    forward(collate([{"chw": np.full((3, imgsz, imgsz), 114, dtype=np.uint8)}]))
+
+    writer = CocoWriter(output_json, CATEGORIES)
+    image_id, annotation_id, boxes = 0, 1, 0
+    for start in range(0, len(image_paths), batch_size):
+        items = []
+        for path in image_paths[start:start + batch_size]:
+            with timers["decode"].time():
+                image = cv2.imread(path, cv2.IMREAD_COLOR)
+            with timers["preprocess"].time():
+                items.append(prepare_frame({"path": path, "image": image}, imgsz))
+        with timers["forward"].time(len(items)):
+            outputs = forward(collate(items))
+        for item, dets in zip(items, outputs):
+            if boxes_per_image:
+                dets = random_dets(rng, boxes_per_image, item["chw"])
+            with timers["postprocess"].time():
+                dets = unletterbox(dets, item["gain"], item["pad"], item["width"], item["height"])
+            with timers["records"].time():
+                image_info = image_record(item, image_id)
+                annotations = annotation_lines(dets[:, :4], dets[:, 5], image_id, annotation_id)
+            with timers["json_dump"].time():
+                writer.add_image(image_info)
+                writer.add_annotation_lines(annotations)
+            image_id += 1
+            annotation_id += len(annotations)
+            boxes += len(annotations)
+    with timers["json_dump"].time(0):
+        writer.close()
+    result = {name: timer.summary() for name, timer in timers.items()}
+    result["boxes"] = boxes
+    return result
+
+
+def bench_end_to_end(image_dir, output_dir, batch_size, imgsz, runs):
+    """Wall time of complete create_coco_annotations runs, with the model already loaded."""
+    count = len(list_images(image_dir))
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(None):
+            create_coco_annotations(image_dir, output_dir, batch_size=batch_size, imgsz=imgsz)
+        times.append(time.perf_counter() - start)
+    best = min(times)
+    return {"runs": runs, "images": count, "best_s": round(best, 4), "mean_s": round(float(np.mean(times)), 4),
+            "images_per_s": round(count / best, 2)}
+
+
+def synthetic_clean_tables(data_dir, rows, seed=0):
+    """
+    Write seeded stand-ins for the three lookup tables of clean.build_lookups to data_dir.
+
+    Returns:
+        (annotations, lookup_rows): a matching annotations frame and the row count of the written tables
+    """
+    rng = np.random.default_rng(seed)
+    users, images = max(rows // 200, 10), max(rows // 20, 1)
+    os.makedirs(data_dir, exist_ok=True)
+    pd.DataFrame({
+        "user_id": np.repeat(np.arange(users), 3),
+        "created_at": pd.date_range("2024-01-01", periods=3 * users, freq="h").astype(str),
+        "ax_percentage_score": rng.uniform(0.5, 1.0, 3 * users).round(3),
+    }).to_csv(os.path.join(data_dir, "phase_2_user_progression_score.csv"), index=False)
+    pd.DataFrame({
+        "id": np.arange(images), "image_name": [f"frame_{i}.jpg" for i in range(images)],
+        "height": 1080, "width": 1920,
+    }).to_csv(os.path.join(data_dir, "phase_2_image.csv"), index=False)
+    pairs = rows // 4
+    user_image = pd.DataFrame({
+        "user_id": rng.integers(0, users, pairs), "image_id": rng.integers(0, images, pairs),
+        "is_submitted": rng.random(pairs) < 0.9,
+    }).drop_duplicates(["user_id", "image_id"])
+    user_image.to_csv(os.path.join(data_dir, "phase_2_user_image_user_annotation.csv"), index=False)
+    annotations = pd.DataFrame({
+        "user_id": rng.integers(0, users, rows), "image_id": rng.integers(0, images, rows),
+        "x": rng.uniform(0, 1800, rows), "y": rng.uniform(0, 1000, rows),
+        "width": rng.uniform(5, 120, rows), "height": rng.uniform(5, 80, rows),
+        "baseline_category_id": rng.integers(1, len(CATEGORY_MAP) + 1, rows),
+        "is_confirmed": rng.random(rows) < 0.9, "is_deleted": rng.random(rows) < 0.05,
+        "is_label_changed": rng.random(rows) < 0.05,
+    })
+    return annotations, 3 * users + images + len(user_image)
+
+
+def timed(fn, *args, **kwargs):
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(None):
+        result = fn(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def rate(seconds, items):
+    return {"seconds": round(seconds, 4), "items": items, "items_per_s": round(items / seconds, 2)}
+
+
+def bench_converters(work_dir, rows, seed=0):
+    """Rows/s of csvtojson (dataframe and whole CSV file), images/s of coco2yolo, rows/s of clean."""
+    df = synthetic_annotations(rows, seed=seed)
+    images = list(df['image_name'].unique())
+    csv_path = os.path.join(work_dir, 'train_annotations.csv')
+    df.to_csv(csv_path, index=False)
+    coco_json = os.path.join(work_dir, 'annotations', 'train.json')
+
+    _, df_seconds = timed(process_dataframe_to_coco, df, images)
+    _, csv_seconds = timed(csv_to_coco, csv_path, coco_json, compact=True)
+    _, yolo_seconds = timed(coco_to_yolo, coco_json, os.path.join(work_dir, 'labels'))
+
+    data_dir = os.path.join(work_dir, 'data')
+    annotations, lookup_rows = synthetic_clean_tables(data_dir, rows, seed)
+    lookups, lookup_seconds = timed(build_lookups, data_dir)
+    (final_df, _, _), clean_seconds = timed(clean_annotations_chunk, annotations, *lookups)
+    whole_seconds, stream_seconds = check_clean_streaming(data_dir, annotations)
+    return {
+        "csvtojson_dataframe": rate(df_seconds, rows),
+        "csvtojson_csv_to_json": rate(csv_seconds, rows),
+        "coco2yolo": rate(yolo_seconds, len(images)),
+        "clean_build_lookups": rate(lookup_seconds, lookup_rows),
+        "clean_annotations": dict(rate(clean_seconds, rows), rows_kept=len(final_df)),
+        "clean_process_data_whole": rate(whole_seconds, rows),
+        "clean_process_data_streaming": rate(stream_seconds, rows),
+    }
+
+
+def check_clean_streaming(data_dir, annotations, chunks=7):
+    """
+    Run clean.process_data whole and streamed over an export with integer pixel
+    coordinates and, in the last rows, a missing category and flag, and check that
+    both write the same train_annotations.csv bytes.
+
+    Returns:
+        (whole_seconds, streaming_seconds)
+    """
+    export = annotations.copy()
+    for column in ("x", "y", "width", "height"):
+        export[column] = export[column].round().astype(np.int64)
+    export = export.astype({"baseline_category_id": "Int64", "is_deleted": "object"})
+    export.loc[export.index[-1], ["baseline_category_id", "is_deleted"]] = None
+    export.to_csv(os.path.join(data_dir, "phase_2_user_annotation.csv"), index=False)
+
+    output_path = os.path.join(data_dir, "train_annotations.csv")
+    _, whole_seconds = timed(process_data, data_dir=data_dir)
+    with open(output_path, 'rb') as f:
+        whole = f.read()
+    _, stream_seconds = timed(process_data, max(len(export) // chunks, 1), data_dir=data_dir)
+    with open(output_path, 'rb') as f:
+        assert f.read() == whole, "clean.py --chunksize wrote a different train_annotations.csv"
+    return whole_seconds, stream_seconds
+
+
+def metadata(args):
+    def git(*cmd):
+        try:
+            return subprocess.run(['git', *cmd], cwd=ROOT, capture_output=True, text=True, check=True).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
+
+    import torch
+    import ultralytics
+    return {
+        "commit": git('rev-parse', 'HEAD'), "dirty": bool(git('status', '--porcelain', '--untracked-files=no')),
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        "python": platform.python_version(), "platform": platform.platform(), "cpus": os.cpu_count(),
+        "numpy": np.__version__, "pandas": pd.__version__, "opencv": cv2.__version__,
+        "torch": torch.__version__, "ultralytics": ultralytics.__version__, "args": vars(args),
+    }
+
+
+def throughputs(result, prefix=""):
+    """Flatten every *_per_s value of a result into {"section.name.key": value}."""
+    found = {}
+    for key, value in result.items():
+        if isinstance(value, dict) and key != "meta":
+            found.update(throughputs(value, f"{prefix}{key}."))
+        elif key.endswith("_per_s") and value is not None:
+            found[prefix + key] = value
+    return found
+
+
+def compare(baseline, result, tolerance):
+    """Print old vs new throughputs; return the metrics that dropped by more than tolerance."""
+    old, new = throughputs(baseline), throughputs(result)
+    regressions = []
+    print(f"\n{'metric':<50} {'baseline':>10} {'current':>10} {'change':>8}")
+    for name in sorted(old.keys() & new.keys()):
+        change = new[name] / old[name] - 1 if old[name] else 0.0
+        flag = "  REGRESSION" if change < -tolerance else ""
+        if flag:
+            regressions.append(name)
+        print(f"{name:<50} {old[name]:10.2f} {new[name]:10.2f} {change:+7.1%}{flag}")
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--image_dir', default=None, help='Images to run on (default: synthetic 1920x1080 frames)')
+    parser.add_argument('--num_images', type=int, default=32)
+    parser.add_argument('--model', default=None, help='Weights to benchmark (default: random yolov10n stand-in)')
+    parser.add_argument('--boxes_per_image', type=int, default=None,
+                        help='Random boxes replacing the model output after forward (default: 20 with the stand-in, '
+                             '0 = real detections with --model)')
+    parser.add_argument('--batch_size', type=int, default=8)
+    parser.add_argument('--imgsz', type=int, default=IMG_SIZE)
+    parser.add_argument('--runs', type=int, default=3, help='End-to-end runs; the best one is reported')
+    parser.add_argument('--rows', type=int, default=200000, help='Annotation rows for the converter benchmarks')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default=None, help='Write the results as JSON to this file')
+    parser.add_argument('--compare', default=None, help='Earlier results JSON to check for regressions')
+    parser.add_argument('--tolerance', type=float, default=0.1, help='Allowed relative throughput drop')
+    args = parser.parse_args()
+    if args.boxes_per_image is None:
+        args.boxes_per_image = 0 if args.model else 20
+
+    work = tempfile.mkdtemp()
+    cwd = os.getcwd()
+    try:
+        image_dir = os.path.abspath(args.image_dir) if args.image_dir else os.path.join(work, 'images')
+        if not args.image_dir:
+            synthetic_images(image_dir, args.num_images, seed=args.seed)
+        names = list_images(image_dir)[:args.num_images]
+        job_dir = os.path.join(work, 'job')
+        os.makedirs(job_dir)
+        for name in names:
+            shutil.copy(os.path.join(image_dir, name), job_dir)
+        image_paths = [os.path.join(job_dir, name) for name in names]
+
+        # main.py loads MODEL_PATH relative to the working directory
+        model_path = os.path.join(work, MODEL_PATH)
+        if args.model:
+            os.makedirs(os.path.dirname(model_path))
+            shutil.copy(args.model, model_path)
+        else:
+            stand_in_model(model_path, args.seed)
+        os.chdir(work)
+
+        result = {"meta": metadata(args)}
+        result["stages"] = bench_stages(image_paths, os.path.join(work, 'stages', 'output.json'), args.batch_size,
+                                        args.imgsz, args.boxes_per_image, args.seed)
+        result["end_to_end"] = bench_end_to_end(job_dir, os.path.join(work, 'out'), args.batch_size, args.imgsz,
+                                                args.runs)
+        result["converters"] = bench_converters(work, args.rows, args.seed)
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(work, ignore_errors=True)
+
+    stages = {k: v for k, v in result["stages"].items() if isinstance(v, dict)}
+    stage_total = sum(s["total_s"] for s in stages.values())
+    print(f"{len(image_paths)} images, batch {args.batch_size}, {result['stages']['boxes']} boxes")
+    print(f"{'stage':<14} {'share':>6} {'items/s':>9} {'mean':>9} {'p50':>9} {'p95':>9} {'p99':>9}  (ms per call)")
+    for name, s in stages.items():
+        print(f"{name:<14} {s['total_s'] / stage_total:6.1%} {s['items_per_s'] or 0:9.1f} {s['mean_ms']:9.2f} "
+              f"{s['p50_ms']:9.2f} {s['p95_ms']:9.2f} {s['p99_ms']:9.2f}")
+    e2e = result["end_to_end"]
+    print(f"end to end: {e2e['images_per_s']:.2f} images/s (best of {e2e['runs']}, "
+          f"stages in sequence: {len(image_paths) / stage_total:.2f} images/s)")
+    for name, c in result["converters"].items():
+        print(f"{name:<24} {c['items_per_s']:12.0f} items/s  ({c['seconds']:.3f}s)")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(result, f, indent=2)
+        print(f"Results written to {args.output}")
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(json.load(f), result, args.tolerance)
+        if regressions:
+            print(f"{len(regressions)} throughput regression(s) beyond {args.tolerance:.0%}")
+            sys.exit(1)
@@ -0,0 +1,82 @@
+"""
+Cold vs warm wall-clock latency of a small main.py job.
+
+Cold runs start a fresh `python main.py` that imports torch/ultralytics and loads
+the weights itself; warm runs submit the same images to daemon.py, which this
+script starts (and stops) on a private socket. Run from the repository root.
+
+    python benchmarks/bench_startup.py --image_dir data/images/val --num_images 16 --runs 3
+"""
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+import subprocess
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+from daemon import ping
+from inference import BACKENDS, list_images
+
+
+def time_main(image_dir, output_dir, extra_args):
+    start = time.perf_counter()
+    subprocess.run([sys.executable, os.path.join(ROOT, 'main.py'), '--image_dir', image_dir,
+                    '--output_dir', output_dir, *extra_args], check=True, stdout=subprocess.DEVNULL)
+    return time.perf_counter() - start
+
+
+def start_daemon(socket_path, backend, timeout=300):
+    proc = subprocess.Popen([sys.executable, os.path.join(ROOT, 'daemon.py'), 'start', '--socket', socket_path,
+                             '--backend', backend])
+    start = time.perf_counter()
+    while not ping(socket_path):
+        if proc.poll() is not None or time.perf_counter() - start > timeout:
+            proc.kill()
+            raise RuntimeError("daemon did not come up")
+        time.sleep(0.1)
+    return proc, time.perf_counter() - start
+
+
+def summary(times):
+    return f"mean {np.mean(times):6.2f}s  min {np.min(times):6.2f}s  max {np.max(times):6.2f}s"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--image_dir', required=True)
+    parser.add_argument('--num_images', type=int, default=16, help='Images per job, as in a per-camera batch')
+    parser.add_argument('--runs', type=int, default=3)
+    parser.add_argument('--backend', default='torch', choices=BACKENDS)
+    args = parser.parse_args()
+
+    work = tempfile.mkdtemp()
+    try:
+        # A per-camera sized job
+        job_dir = os.path.join(work, 'images')
+        os.makedirs(job_dir)
+        for name in list_images(args.image_dir)[:args.num_images]:
+            shutil.copy(os.path.join(args.image_dir, name), job_dir)
+        output_dir = os.path.join(work, 'out')
+        backend_args = ['--backend', args.backend]
+
+        cold = [time_main(job_dir, output_dir, backend_args) for _ in range(args.runs)]
+
+        socket_path = os.path.join(work, 'detector.sock')
+        proc, startup = start_daemon(socket_path, args.backend)
+        try:
+            warm = [time_main(job_dir, output_dir, backend_args + ['--daemon', socket_path]) for _ in range(args.runs)]
+        finally:
+            proc.terminate()
+            proc.wait()
+
+        print(f"{args.num_images} images per job, {args.runs} runs, backend {args.backend}")
+        print(f"cold (fresh process): {summary(cold)}")
+        print(f"warm (daemon):        {summary(warm)}  ({np.mean(cold) / np.mean(warm):.1f}x)")
+        print(f"daemon startup (one-off): {startup:.2f}s")
+    finally:
+        shutil.rmtree(work, ignore_errors=True)
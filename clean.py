@@ -1,21 +1,124 @@
 import pandas as pd
 from sklearn.model_selection import train_test_split
 import os
+import sys
 
-def process_data():
-    # Define paths relative to the script location
-    base_dir = os.path.dirname(os.path.abspath(__file__))
-    data_dir = os.path.join(base_dir, 'data')
+from columnar import TableWriter
 
-    # === Step 1: Load CSVs ===
-    print("Loading data...")
-    annotations = pd.read_csv(os.path.join(data_dir, "phase_2_user_annotation.csv"))
-    user_image = pd.read_csv(os.path.join(data_dir, "phase_2_user_image_user_annotation.csv"))
-    image_meta = pd.read_csv(os.path.join(data_dir, "phase_2_image.csv")).rename(columns={"id": "image_id"})
-    user_scores = pd.read_csv(os.path.join(data_dir, "phase_2_user_progression_score.csv"))
+SCORE_THRESHOLD = 0.8
+
+# Only these columns of the large annotations export are needed
+ANNOTATION_COLUMNS = [
+    "user_id", "image_id", "x", "y", "width", "height", "baseline_category_id",
+    "is_confirmed", "is_deleted", "is_label_changed"
+]
+# Numeric columns whose dtype is pinned for every chunk when streaming (see iter_annotation_chunks)
+NUMERIC_COLUMNS = ["user_id", "image_id", "x", "y", "width", "height", "baseline_category_id"]
+
+CATEGORY_MAP = {
+    1: "Hatchback", 2: "Sedan", 3: "SUV", 4: "MUV", 5: "Bus",
+    6: "Truck", 7: "Three-wheeler", 8: "Two-wheeler", 9: "LCV",
+    10: "Mini-bus", 11: "Mini-truck", 12: "tempo-traveller",
+    13: "bicycle", 14: "Van", 15: "Others"
+}
+
+def peak_rss_mb():
+    """Peak resident set size of this process in MB, or None where the OS does not report it."""
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is KB on Linux and bytes on macOS
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+class DtypeWidened(Exception):
+    """A chunk widened the dtype of a column that earlier chunks were already written with."""
+
+def whole_file_dtypes(kinds):
+    """
+    Dtypes a whole-file read infers for numeric columns, from the dtype kinds their chunks were inferred as.
+
+    Columns that are integer in every chunk stay int64, integer and float chunks
+    resolve to float64 as a whole-file read would; any other mix (e.g. text) is
+    left to per-chunk inference.
+    """
+    dtypes = {}
+    for column, seen in kinds.items():
+        if seen == {"i"}:
+            dtypes[column] = "int64"
+        elif seen <= {"i", "f"}:
+            dtypes[column] = "float64"
+    return dtypes
+
+def iter_annotation_chunks(annotations_path, chunksize, usecols, kinds):
+    """
+    Yield chunks of the annotations file cast to the dtypes a whole-file read infers, in a single pass.
+
+    Inferring per chunk could turn the same column into int64 in one chunk and
+    float64 (a NaN, or a fractional value) in the next, and the CSV would then
+    print 1051 in some rows and 1051.0 in others. The dtypes are taken from the
+    chunks read so far, so an integer chunk after float ones is cast to float64
+    as it arrives. Only when a chunk widens a column that already written
+    chunks were cast with (an int64 column meets a NaN) is DtypeWidened raised
+    and the caller starts over; kinds keeps the dtype kinds seen per column, so
+    the next pass casts from its first chunk on. Consistent files are read once.
+
+    Args:
+        annotations_path: phase_2_user_annotation.csv
+        chunksize: Rows per chunk
+        usecols: Annotation columns to read
+        kinds: Dtype kinds seen per numeric column, shared across passes
+    """
+    columns = [c for c in NUMERIC_COLUMNS if c in usecols]
+    for column in columns:
+        kinds.setdefault(column, set())
+    applied = None
+    for chunk in pd.read_csv(annotations_path, usecols=usecols, chunksize=chunksize):
+        for column in columns:
+            kinds[column].add(chunk[column].dtype.kind)
+        dtypes = whole_file_dtypes(kinds)
+        if applied is not None and dtypes != applied:
+            changed = sorted(c for c in columns if dtypes.get(c) != applied.get(c))
+            raise DtypeWidened(f"Columns {', '.join(changed)} need a wider dtype than the first chunks")
+        applied = dtypes
+        yield chunk.astype(dtypes)
+
+def build_lookups(data_dir):
+    """
+    Load the three small tables once and reduce them to the lookups applied to every annotation chunk.
+
+    Returns:
+        (users_to_keep, submitted_pairs, image_meta): user ids above SCORE_THRESHOLD,
+        submitted (user_id, image_id) pairs and per-image name/size metadata
+    """
+    user_image = pd.read_csv(os.path.join(data_dir, "phase_2_user_image_user_annotation.csv"),
+                             usecols=["user_id", "image_id", "is_submitted"])
+    image_meta = pd.read_csv(os.path.join(data_dir, "phase_2_image.csv"),
+                             usecols=["id", "image_name", "height", "width"]).rename(columns={"id": "image_id"})
+    user_scores = pd.read_csv(os.path.join(data_dir, "phase_2_user_progression_score.csv"),
+                              usecols=["user_id", "created_at", "ax_percentage_score"])
+
+    latest_scores = user_scores.sort_values("created_at", ascending=False).drop_duplicates("user_id")
+    users_to_keep = latest_scores[latest_scores["ax_percentage_score"] >= SCORE_THRESHOLD]["user_id"]
+
+    submitted_pairs = user_image[user_image["is_submitted"] == True][["user_id", "image_id"]]
+
+    image_meta_renamed = image_meta.rename(columns={"image_name": "original_image_name"})
+    image_meta_renamed = image_meta_renamed[["image_id", "original_image_name", "height", "width"]]
+    return users_to_keep, submitted_pairs, image_meta_renamed
+
+def clean_annotations_chunk(annotations, users_to_keep, submitted_pairs, image_meta):
+    """
+    Apply steps 2-7 to one block of annotation rows.
 
+    Every step is row-local (filters and merges that keep left order), so running it
+    per chunk and concatenating gives the same rows as running it on the whole table.
+
+    Returns:
+        (final_df, annotations_before, annotations_after) where the counts are around the score filter
+    """
     # === Step 2: Initial annotation cleaning ===
-    print("Cleaning annotations...")
     clean_annotations = annotations[
         (annotations["is_confirmed"] == True) &
         (annotations["is_deleted"] == False) &
@@ -23,60 +126,126 @@ def process_data():
     ]
 
     # === Step 2.5: Filter users by progression score ===
-    print("Filtering users by score...")
-    SCORE_THRESHOLD = 0.8
-    latest_scores = user_scores.sort_values("created_at", ascending=False).drop_duplicates("user_id")
-    users_to_keep = latest_scores[latest_scores["ax_percentage_score"] >= SCORE_THRESHOLD]["user_id"]
     annotations_before = len(clean_annotations)
     clean_annotations = clean_annotations[clean_annotations["user_id"].isin(users_to_keep)]
     annotations_after = len(clean_annotations)
 
-    print(f"Kept {len(users_to_keep.unique())} high-quality users.")
-    print(f"Annotations before: {annotations_before}, after: {annotations_after}")
-
     # === Step 3: Filter for submitted images only ===
-    print("Filtering for submitted images...")
-    submitted_pairs = user_image[user_image["is_submitted"] == True][["user_id", "image_id"]]
     clean_annotations = clean_annotations.merge(submitted_pairs, on=["user_id", "image_id"], how="inner")
 
     # === Step 4: Merge with image metadata ===
-    print("Merging with image metadata...")
-    image_meta_renamed = image_meta.rename(columns={"image_name": "original_image_name"})
-    merged_df = clean_annotations.merge(
-        image_meta_renamed[["image_id", "original_image_name", "height", "width"]],
-        on="image_id",
-        how="left"
-    )
+    merged_df = clean_annotations.merge(image_meta, on="image_id", how="left")
 
     # === Step 5: Convert bounding boxes ===
-    print("Converting bounding boxes...")
     merged_df["x_min"] = merged_df["x"]
     merged_df["y_min"] = merged_df["y"]
     merged_df["x_max"] = merged_df["x"] + merged_df["width_x"]
     merged_df["y_max"] = merged_df["y"] + merged_df["height_x"]
 
     # === Step 6: Map category IDs ===
-    print("Mapping class names...")
-    category_map = {
-        1: "Hatchback", 2: "Sedan", 3: "SUV", 4: "MUV", 5: "Bus",
-        6: "Truck", 7: "Three-wheeler", 8: "Two-wheeler", 9: "LCV",
-        10: "Mini-bus", 11: "Mini-truck", 12: "tempo-traveller",
-        13: "bicycle", 14: "Van", 15: "Others"
-    }
-    merged_df["class_name"] = merged_df["baseline_category_id"].map(category_map)
+    merged_df["class_name"] = merged_df["baseline_category_id"].map(CATEGORY_MAP)
 
     # === Step 7: Final clean format ===
-    print("Creating final dataframe...")
     final_df = merged_df[[
         "original_image_name", "x_min", "y_min", "x_max", "y_max",
         "baseline_category_id", "class_name"
     ]].rename(columns={"original_image_name": "image_name"})
+    return final_df, annotations_before, annotations_after
+
+def write_cleaned(chunks, lookups, output_path=None, table_path=None):
+    """
+    Clean every chunk and write it to the CSV and/or the columnar table, replacing earlier output.
+
+    Returns:
+        (annotations_before, annotations_after) summed over the chunks
+    """
+    annotations_before = annotations_after = 0
+    out = open(output_path, 'w', newline='') if output_path else None
+    table = TableWriter(table_path) if table_path else None
+    try:
+        for i, chunk in enumerate(chunks):
+            final_df, before, after = clean_annotations_chunk(chunk, *lookups)
+            annotations_before += before
+            annotations_after += after
+            # === Step 8: Save to CSV and/or the columnar table ===
+            if out is not None:
+                final_df.to_csv(out, index=False, header=(i == 0))
+            if table is not None:
+                table.append(final_df)
+    finally:
+        if out is not None:
+            out.close()
+        if table is not None:
+            table.close()
+    return annotations_before, annotations_after
+
+def process_data(chunksize=None, dtype=None, usecols=None, output_format="csv", data_dir=None):
+    """
+    Clean the phase 2 exports into data/train_annotations.csv.
 
-    # === Step 8: Save to CSV ===
-    print("Saving annotations for training...")
-    final_df.to_csv(os.path.join(data_dir, "train_annotations.csv"), index=False)
+    Streaming writes the same bytes as loading the file whole.
+
+    Args:
+        chunksize: Stream phase_2_user_annotation.csv in blocks of this many rows
+            against pre-built lookups of the smaller tables; None loads it whole
+        dtype: Column dtypes for the annotations file (when streaming, defaults to
+            the dtypes a whole-file read infers, see iter_annotation_chunks)
+        usecols: Annotation columns to read (defaults to all when loading whole,
+            ANNOTATION_COLUMNS when streaming)
+        output_format: "csv" for train_annotations.csv, "columnar" for the typed
+            train_annotations.cols table read by csvtojson.py, or "both"
+        data_dir: Directory of the exports and outputs (defaults to data/ next to this script)
+    """
+    # Define paths relative to the script location
+    if data_dir is None:
+        data_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+    annotations_path = os.path.join(data_dir, "phase_2_user_annotation.csv")
+    output_path = os.path.join(data_dir, "train_annotations.csv")
+    table_path = os.path.join(data_dir, "train_annotations.cols")
+    if output_format not in ("csv", "both"):
+        output_path = None
+    if output_format not in ("columnar", "both"):
+        table_path = None
+
+    # === Step 1: Load CSVs ===
+    print("Loading data...")
+    lookups = build_lookups(data_dir)
+    users_to_keep = lookups[0]
+
+    if chunksize:
+        usecols = usecols or ANNOTATION_COLUMNS
+    kinds = {}  # dtype kinds seen per numeric column, kept across passes
+
+    def read_chunks():
+        if not chunksize:
+            return [pd.read_csv(annotations_path, usecols=usecols, dtype=dtype)]
+        if dtype is None:
+            return iter_annotation_chunks(annotations_path, chunksize, usecols, kinds)
+        return pd.read_csv(annotations_path, usecols=usecols, dtype=dtype, chunksize=chunksize)
+
+    print("Cleaning annotations, filtering users by score and submitted images, merging metadata...")
+    while True:
+        try:
+            annotations_before, annotations_after = write_cleaned(read_chunks(), lookups, output_path, table_path)
+            break
+        except DtypeWidened as e:
+            # Rare: the file changes dtype after its first chunks; the next pass knows the final dtypes
+            print(f"{e}; starting over")
+
+    print(f"Kept {len(users_to_keep.unique())} high-quality users.")
+    print(f"Annotations before: {annotations_before}, after: {annotations_after}")
+    peak = peak_rss_mb()
+    if peak is not None:
+        print(f"Peak memory: {peak:.1f} MB")
 
     print("✅ Done! Training annotations saved.")
 
 if __name__ == "__main__":
-    process_data()
\ No newline at end of file
+    import argparse
+    parser = argparse.ArgumentParser(description='Clean phase 2 annotation exports into train_annotations.csv')
+    parser.add_argument('--chunksize', type=int, default=None,
+                        help='Stream the annotations file in blocks of this many rows')
+    parser.add_argument('--format', choices=['csv', 'columnar', 'both'], default='csv',
+                        help='Write train_annotations.csv, the train_annotations.cols table, or both')
+    args = parser.parse_args()
+    process_data(args.chunksize, output_format=args.format)
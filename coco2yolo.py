@@ -1,54 +1,147 @@
 import os
 import json
-from collections import defaultdict
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
 
-def coco_to_yolo(coco_json_path, labels_dir):
-    with open(coco_json_path, 'r') as f:
-        coco = json.load(f)
+import numpy as np
+
+from columnar import is_table, read_coco_columns
+
+WRITE_CHUNK = 256  # label files per thread-pool task
+
+def _write_label_files(labels_dir, items):
+    for txt_name, text in items:
+        with open(os.path.join(labels_dir, txt_name), 'w') as f:
+            f.write(text)
+
+def _positions(image_ids, ids):
+    """Position of each of ids in image_ids (-1 if absent); with duplicate image ids the last one wins."""
+    order = np.argsort(image_ids, kind='stable')
+    sorted_ids = image_ids[order]
+    idx = np.searchsorted(sorted_ids, ids, side='right') - 1
+    found = (idx >= 0) & (sorted_ids[idx.clip(0)] == ids) if len(sorted_ids) else np.zeros(len(ids), dtype=bool)
+    return np.where(found, order[idx.clip(0)] if len(order) else -1, -1)
+
+def label_files_from_arrays(image_ids, file_names, sizes, cat_ids, ann_image_ids, ann_cats, bbox):
+    """
+    Convert COCO arrays to (txt_name, label_text) pairs, one per image.
+
+    Annotations are normalized as whole NumPy arrays and grouped per image with a
+    stable sort, so lines keep their order in the COCO file.
+
+    Args:
+        image_ids, file_names, sizes: Per-image ids, file names and Nx2 (width, height)
+        cat_ids: COCO category ids; their sorted order gives the 0-based YOLO class
+        ann_image_ids, ann_cats, bbox: Per-annotation image ids, category ids and Mx4 xywh boxes
+    """
+    image_ids = np.asarray(image_ids, dtype=np.int64)
+    sizes = np.asarray(sizes, dtype=np.float64).reshape(-1, 2)
+    cat_ids = np.sort(np.asarray(cat_ids, dtype=np.int64))
+    ann_cats = np.asarray(ann_cats, dtype=np.int64)
+    bbox = np.asarray(bbox, dtype=np.float64).reshape(-1, 4)
+    pos = _positions(image_ids, np.asarray(ann_image_ids, dtype=np.int64))
 
-    # Map image_id to file_name and image size
-    image_id_to_info = {img['id']: img for img in coco['images']}
     # Map category_id to 0-based index for YOLO
-    categories = sorted(coco['categories'], key=lambda x: x['id'])
-    cat_id_to_yolo = {cat['id']: i for i, cat in enumerate(categories)}
+    yolo_cats = np.searchsorted(cat_ids, ann_cats).clip(0, max(len(cat_ids) - 1, 0))
+    unknown = (cat_ids[yolo_cats] != ann_cats) if len(cat_ids) else pos >= 0
+    if (unknown & (pos >= 0)).any():
+        raise KeyError(int(ann_cats[unknown & (pos >= 0)][0]))
 
-    # Prepare output directory
-    os.makedirs(labels_dir, exist_ok=True)
+    # Drop annotations of unknown images, then group by image keeping file order
+    keep = pos >= 0
+    pos, yolo_cats, bbox = pos[keep], yolo_cats[keep], bbox[keep]
+    order = np.argsort(pos, kind='stable')
+    pos, yolo_cats, bbox = pos[order], yolo_cats[order], bbox[order]
+
+    # Convert to YOLO format (normalized center x, center y, width, height)
+    width, height = sizes[pos, 0], sizes[pos, 1]
+    x, y, w, h = bbox.T
+    normalized = np.stack([(x + w / 2) / width, (y + h / 2) / height, w / width, h / height], axis=1)
 
-    # Group annotations by image
-    image_to_anns = defaultdict(list)
-    for ann in coco['annotations']:
-        image_to_anns[ann['image_id']].append(ann)
-
-    for image_id, image_info in image_id_to_info.items():
-        file_name = image_info['file_name']
-        width = image_info['width']
-        height = image_info['height']
-        label_lines = []
-        for ann in image_to_anns.get(image_id, []):
-            cat_id = ann['category_id']
-            yolo_cat = cat_id_to_yolo[cat_id]
-            x, y, w, h = ann['bbox']
-            # Convert to YOLO format (normalized center x, center y, width, height)
-            x_center = (x + w / 2) / width
-            y_center = (y + h / 2) / height
-            w_norm = w / width
-            h_norm = h / height
-            label_lines.append(f"{yolo_cat} {x_center:.6f} {y_center:.6f} {w_norm:.6f} {h_norm:.6f}")
+    lines = ['%d %.6f %.6f %.6f %.6f' % (c, *row) for c, row in zip(yolo_cats.tolist(), normalized.tolist())]
+    bounds = np.searchsorted(pos, np.arange(len(image_ids) + 1)).tolist()
+    is_last = (_positions(image_ids, image_ids) == np.arange(len(image_ids))).tolist()
 
+    files = {}
+    for i, file_name in enumerate(file_names):
+        if not is_last[i]:
+            continue
         # Sanitize filename to be valid on Windows by replacing colons
         sanitized_file_name = file_name.replace(':', '_')
-
-        # Write label file
         txt_name = os.path.splitext(sanitized_file_name)[0] + '.txt'
-        with open(os.path.join(labels_dir, txt_name), 'w') as f:
-            f.write('\n'.join(label_lines))
+        files.pop(txt_name, None)  # the last image writing a name wins, as with sequential writes
+        files[txt_name] = '\n'.join(lines[bounds[i]:bounds[i + 1]])
+    return list(files.items())
+
+def yolo_label_files(coco):
+    """Convert a loaded COCO dict to (txt_name, label_text) pairs, one per image."""
+    images = coco['images']
+    anns = coco['annotations']
+    return label_files_from_arrays(
+        [img['id'] for img in images],
+        [img['file_name'] for img in images],
+        [(img['width'], img['height']) for img in images],
+        [cat['id'] for cat in coco['categories']],
+        [ann['image_id'] for ann in anns],
+        [ann['category_id'] for ann in anns],
+        [ann['bbox'] for ann in anns]
+    )
+
+def columnar_label_files(coco_dir):
+    """Same as yolo_label_files, reading the memory-mapped COCO tables written by csvtojson.py."""
+    images, anns, categories = read_coco_columns(coco_dir)
+    return label_files_from_arrays(
+        images['id'],
+        images.decode('file_name').astype(str).tolist(),
+        np.stack([images['width'], images['height']], axis=1),
+        [cat['id'] for cat in categories],
+        anns['image_id'],
+        anns['category_id'],
+        np.stack([anns['x'], anns['y'], anns['width'], anns['height']], axis=1)
+    )
+
+def write_label_files(label_files, labels_dir, workers=None, archive_path=None):
+    """Write (txt_name, label_text) pairs as files of labels_dir on a thread pool, or into one zip at archive_path."""
+    if archive_path:
+        os.makedirs(os.path.dirname(archive_path) or '.', exist_ok=True)
+        with zipfile.ZipFile(archive_path, 'w', zipfile.ZIP_STORED) as zf:
+            for txt_name, text in label_files:
+                zf.writestr(txt_name, text)
+        print(f"YOLO labels written to {archive_path}")
+        return
+
+    # Prepare output directory
+    os.makedirs(labels_dir, exist_ok=True)
+
+    chunks = [label_files[i:i + WRITE_CHUNK] for i in range(0, len(label_files), WRITE_CHUNK)]
+    with ThreadPoolExecutor(max_workers=workers or os.cpu_count() or 1) as pool:
+        list(pool.map(lambda chunk: _write_label_files(labels_dir, chunk), chunks))
 
     print(f"YOLO labels written to {labels_dir}")
 
+def coco_to_yolo(coco_json_path, labels_dir, workers=None, archive_path=None):
+    """
+    Write YOLO label files for every image of a COCO JSON file.
+
+    Args:
+        coco_json_path: COCO annotations to convert, either JSON or the columnar
+            tables written by csvtojson.py (read memory-mapped, no JSON parsing)
+        labels_dir: Directory receiving one .txt per image (byte-identical to the per-image loop)
+        workers: Threads writing label files (defaults to the CPU count)
+        archive_path: Write all labels into this single uncompressed zip instead of
+            labels_dir, for filesystems where millions of tiny files are the bottleneck
+    """
+    if is_table(coco_json_path):
+        label_files = columnar_label_files(coco_json_path)
+    else:
+        with open(coco_json_path, 'r') as f:
+            coco = json.load(f)
+        label_files = yolo_label_files(coco)
+    write_label_files(label_files, labels_dir, workers, archive_path)
+
 if __name__ == "__main__":
-    # For train set:
+    # For train set (data/annotations/train.cols, if written by csvtojson.py --columnar, skips JSON parsing):
     coco_to_yolo(
-        coco_json_path='data/annotations/train.json',
+        coco_json_path='data/annotations/train.cols' if is_table('data/annotations/train.cols') else 'data/annotations/train.json',
         labels_dir='data/labels/train'
-    ) 
\ No newline at end of file
+    )
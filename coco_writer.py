@@ -0,0 +1,181 @@
+import os
+import re
+import sys
+import json
+import shutil
+
+COMPACT_SEPARATORS = (',', ':')
+# Tokens of a compact JSON record that json.dump's indented layout changes: strings
+# (copied as they are), empty containers, brackets, commas and colons
+_JSON_TOKEN = re.compile(r'"(?:[^"\\]|\\.)*"|[{\[][}\]]|[{}\[\],:]')
+
+
+def parts_dir(output_json):
+    """Directory holding the in-progress parts of output_json."""
+    return output_json + '.parts'
+
+
+def _read_records(path):
+    """Yield the JSON Lines records of a part file, skipping a torn last line left by a crash."""
+    if not os.path.exists(path):
+        return
+    with open(path, 'r') as f:
+        for line in f:
+            if not line.endswith('\n'):
+                break
+            yield line.rstrip('\n')
+
+
+def _indent_record(record, indent, level):
+    """Re-lay a compact JSON record out as json.dumps(..., indent=indent) nested level deep, without parsing it."""
+    pad = ' ' * indent
+    depth = level
+
+    def relay(match):
+        nonlocal depth
+        token = match.group()
+        if token[0] == '"' or len(token) == 2:
+            return token
+        if token in '{[':
+            depth += 1
+            return token + '\n' + pad * depth
+        if token in '}]':
+            depth -= 1
+            return '\n' + pad * depth + token
+        return ',\n' + pad * depth if token == ',' else ': '
+
+    return _JSON_TOKEN.sub(relay, record)
+
+
+def _write_array(out, key, records, indent):
+    """Stream one top-level COCO array; matches json.dump's layout for the same indent."""
+    if indent is None:
+        out.write(f'"{key}":[')
+        for i, record in enumerate(records):
+            if i:
+                out.write(',')
+            out.write(record)  # parts are already compact JSON
+        out.write(']')
+        return
+
+    pad = ' ' * indent
+    out.write(f'{pad}"{key}": [')
+    empty = True
+    for record in records:
+        out.write('\n' if empty else ',\n')
+        empty = False
+        out.write(pad * 2 + _indent_record(record, indent, 2))
+    out.write(']' if empty else '\n' + pad + ']')
+
+
+def finalize_coco(output_json, indent=2):
+    """
+    Assemble output_json from its parts directory and remove the parts.
+
+    Also used to recover a valid COCO document from the parts of a run that
+    crashed before closing its writer.
+
+    Args:
+        output_json: Path of the final COCO JSON file
+        indent: Indent of the final document, or None for compact output
+    """
+    parts = parts_dir(output_json)
+    with open(os.path.join(parts, 'categories.json'), 'r') as f:
+        categories = json.load(f)
+
+    tmp_path = output_json + '.tmp'
+    with open(tmp_path, 'w') as out:
+        out.write('{' if indent is None else '{\n')
+        for key in ('images', 'annotations'):
+            _write_array(out, key, _read_records(os.path.join(parts, f'{key}.jsonl')), indent)
+            out.write(',' if indent is None else ',\n')
+        _write_array(out, 'categories', (json.dumps(c, separators=COMPACT_SEPARATORS) for c in categories), indent)
+        out.write('}' if indent is None else '\n}')
+    os.replace(tmp_path, output_json)
+    shutil.rmtree(parts)
+
+
+class CocoWriter:
+    """
+    Incrementally write a COCO document with bounded memory.
+
+    Images and annotations are appended as JSON Lines to a `<output_json>.parts`
+    directory and flushed every `flush_every` records, so a crashed run keeps
+    everything up to the last flush (see finalize_coco). close() streams the
+    parts into the final file.
+
+    Args:
+        output_json: Path of the final COCO JSON file
+        categories: COCO categories list
+        indent: Indent of the final document, or None for compact output
+        flush_every: Records buffered before the parts are flushed to disk
+    """
+
+    def __init__(self, output_json, categories, indent=2, flush_every=1000):
+        self.output_json = output_json
+        self.indent = indent
+        self.flush_every = flush_every
+        self.num_images = 0
+        self.num_annotations = 0
+        self._pending = 0
+
+        parts = parts_dir(output_json)
+        os.makedirs(parts, exist_ok=True)
+        with open(os.path.join(parts, 'categories.json'), 'w') as f:
+            json.dump(categories, f)
+        self._images = open(os.path.join(parts, 'images.jsonl'), 'w')
+        self._annotations = open(os.path.join(parts, 'annotations.jsonl'), 'w')
+
+    def add_image(self, image):
+        self._images.write(json.dumps(image, separators=COMPACT_SEPARATORS) + '\n')
+        self.num_images += 1
+        self._tick(1)
+
+    def add_annotations(self, annotations):
+        if not annotations:
+            return
+        self._annotations.write(''.join(json.dumps(a, separators=COMPACT_SEPARATORS) + '\n' for a in annotations))
+        self.num_annotations += len(annotations)
+        self._tick(len(annotations))
+
+    def add_annotation_lines(self, lines):
+        """Append annotations already serialized as compact JSON, one string per annotation."""
+        if not lines:
+            return
+        self._annotations.write('\n'.join(lines) + '\n')
+        self.num_annotations += len(lines)
+        self._tick(len(lines))
+
+    def add_annotation(self, annotation):
+        self.add_annotations([annotation])
+
+    def _tick(self, n):
+        self._pending += n
+        if self._pending >= self.flush_every:
+            self.flush()
+
+    def flush(self):
+        self._images.flush()
+        self._annotations.flush()
+        self._pending = 0
+
+    def close(self):
+        if self._images.closed:
+            return
+        self._images.close()
+        self._annotations.close()
+        finalize_coco(self.output_json, self.indent)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        # Finalize even on error so whatever was processed is a valid document
+        self.close()
+
+
+if __name__ == "__main__":
+    # Recover a valid COCO file from the parts of an interrupted run:
+    #   python coco_writer.py output/output.json [--compact]
+    finalize_coco(sys.argv[1], indent=None if '--compact' in sys.argv[2:] else 2)
+    print(f"Recovered {sys.argv[1]}")
@@ -0,0 +1,160 @@
+import os
+import json
+
+import numpy as np
+import pandas as pd
+
+SCHEMA_FILE = 'schema.json'
+
+
+def is_table(path):
+    """True when path is a columnar table or COCO directory rather than a CSV/JSON file."""
+    return os.path.isdir(path)
+
+
+class TableWriter:
+    """
+    Append-only writer for a typed columnar table.
+
+    A table is a directory with one raw little-endian `<column>.bin` file per column
+    and a schema.json holding the length, dtypes and, for string columns, the
+    dictionary of distinct values. Strings are stored as int32 codes into that
+    dictionary in order of first appearance (-1 for missing), so every column can
+    be memory-mapped and no floats are ever re-parsed from text.
+
+    Args:
+        path: Table directory to create
+    """
+
+    def __init__(self, path):
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.length = 0
+        self.dtypes = {}
+        self.dictionaries = {}
+        self._files = {}
+
+    def append(self, columns):
+        """Append equal-length columns (name -> array-like or Series); the first call fixes the schema."""
+        lengths = set()
+        for name, values in columns.items():
+            values = values.to_numpy() if isinstance(values, pd.Series) else np.asarray(values)
+            if values.dtype.kind in 'OUS':
+                values = self._encode(name, values)
+            values = values.astype(values.dtype.newbyteorder('<'), copy=False)
+
+            if name not in self._files:
+                if self.length:
+                    raise ValueError(f"Column '{name}' was not in the first appended block")
+                self._files[name] = open(os.path.join(self.path, f'{name}.bin'), 'wb')
+                self.dtypes[name] = values.dtype.str
+            self._files[name].write(values.astype(self.dtypes[name], copy=False).tobytes())
+            lengths.add(len(values))
+
+        if set(columns) != set(self._files):
+            raise ValueError(f"Expected columns {sorted(self._files)}, got {sorted(columns)}")
+        if len(lengths) > 1:
+            raise ValueError(f"Columns have different lengths: {sorted(lengths)}")
+        self.length += lengths.pop() if lengths else 0
+
+    def _encode(self, name, values):
+        mapping = self.dictionaries.setdefault(name, {})
+        codes, uniques = pd.factorize(values)
+        remap = np.array([mapping.setdefault(value, len(mapping)) for value in uniques], dtype=np.int32)
+        return np.where(codes < 0, -1, remap[codes] if len(remap) else -1).astype(np.int32)
+
+    def close(self):
+        for f in self._files.values():
+            f.close()
+        schema = {
+            "length": self.length,
+            "columns": [
+                {"name": name, "dtype": dtype, "dictionary": list(self.dictionaries[name]) if name in self.dictionaries else None}
+                for name, dtype in self.dtypes.items()
+            ]
+        }
+        with open(os.path.join(self.path, SCHEMA_FILE), 'w') as f:
+            json.dump(schema, f)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+def write_table(path, columns):
+    """Write a whole table in one block."""
+    with TableWriter(path) as writer:
+        writer.append(columns)
+
+
+class Table:
+    """
+    Read-only view of a table written by TableWriter.
+
+    Columns are memory-mapped by default, so opening a table costs only the
+    schema read. String columns come back as int32 codes; use decode() or
+    dictionaries[name] to get the values.
+
+    Args:
+        path: Table directory
+        mmap: Memory-map the column files instead of reading them into memory
+    """
+
+    def __init__(self, path, mmap=True):
+        with open(os.path.join(path, SCHEMA_FILE), 'r') as f:
+            schema = json.load(f)
+        self.path = path
+        self.length = schema["length"]
+        self.columns = {}
+        self.dictionaries = {}
+        for column in schema["columns"]:
+            name, dtype = column["name"], np.dtype(column["dtype"])
+            file_path = os.path.join(path, f'{name}.bin')
+            if self.length == 0:
+                values = np.empty(0, dtype=dtype)
+            elif mmap:
+                values = np.memmap(file_path, dtype=dtype, mode='r', shape=(self.length,))
+            else:
+                values = np.fromfile(file_path, dtype=dtype, count=self.length)
+            self.columns[name] = values
+            if column["dictionary"] is not None:
+                self.dictionaries[name] = column["dictionary"]
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+    def decode(self, name):
+        """Values of a string column as a pandas Categorical (missing values are NaN)."""
+        return pd.Categorical.from_codes(np.asarray(self.columns[name]), categories=self.dictionaries[name])
+
+    def to_dataframe(self):
+        return pd.DataFrame({
+            name: self.decode(name) if name in self.dictionaries else values
+            for name, values in self.columns.items()
+        })
+
+
+def write_coco_columns(path, images, annotations, categories):
+    """
+    Write a COCO dataset as columnar tables: `images/`, `annotations/` and categories.json.
+
+    Args:
+        path: Output directory
+        images: Columns id, file_name, width, height
+        annotations: Columns id, image_id, category_id, x, y, width, height, area
+        categories: COCO categories list
+    """
+    os.makedirs(path, exist_ok=True)
+    write_table(os.path.join(path, 'images'), images)
+    write_table(os.path.join(path, 'annotations'), annotations)
+    with open(os.path.join(path, 'categories.json'), 'w') as f:
+        json.dump(categories, f)
+
+
+def read_coco_columns(path, mmap=True):
+    """Return (images Table, annotations Table, categories) from write_coco_columns output."""
+    with open(os.path.join(path, 'categories.json'), 'r') as f:
+        categories = json.load(f)
+    return Table(os.path.join(path, 'images'), mmap), Table(os.path.join(path, 'annotations'), mmap), categories
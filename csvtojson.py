@@ -1,9 +1,12 @@
 import os
 import json
 import pandas as pd
-from tqdm import tqdm
+import numpy as np
 import yaml
 
+from columnar import Table, is_table, write_coco_columns
+from image_meta import DEFAULT_SIZE, image_index
+
 
 # Define categories with supercategory
 CATEGORIES = [
@@ -40,61 +43,175 @@ def create_yolo_yaml(output_path, train_path, class_names, val_path=None):
         yaml.dump(data, f, sort_keys=False)
     print(f"YOLO YAML config created at: {output_path}")
 
-def process_dataframe_to_coco(df, image_list):
-    coco = {
-        "images": [],
-        "annotations": [],
-        "categories": CATEGORIES
+def annotation_columns(df, image_list):
+    """
+    Convert an annotations dataframe to COCO annotation columns with whole-column operations.
+
+    Rows whose stripped class_name is not a known category are dropped; the rest keep
+    their order and get ids 1..n, and image ids are the 1-based positions in image_list.
+
+    Returns:
+        dict of equal-length Series/arrays: id, image_id, category_id, x, y, width, height, area
+    """
+    category_ids = df['class_name'].str.strip().map(CATEGORY_NAME_TO_ID)
+    keep = category_ids.notna().to_numpy()
+    kept = df[keep]
+
+    image_codes = pd.Categorical(kept['image_name'], categories=image_list).codes
+    if (image_codes < 0).any():
+        raise KeyError(kept['image_name'].iloc[int(np.argmax(image_codes < 0))])
+
+    width = kept['x_max'] - kept['x_min']
+    height = kept['y_max'] - kept['y_min']
+    return {
+        "id": np.arange(1, len(kept) + 1),
+        "image_id": image_codes.astype(np.int64) + 1,
+        "category_id": category_ids[keep].astype(np.int64),
+        "x": kept['x_min'],
+        "y": kept['y_min'],
+        "width": width,
+        "height": height,
+        "area": width * height
     }
-    image_id_map = {}
-    ann_id = 1
-    img_id = 1
-
-    for image_name in image_list:
-        image_info = {
-            "id": img_id,
-            "file_name": image_name,
-            "width": 1920,
-            "height": 1080
-        }
-        coco['images'].append(image_info)
-        image_id_map[image_name] = img_id
-        img_id += 1
-    
-    for _, row in tqdm(df.iterrows(), total=len(df)):
-        image_name = row['image_name']
-        cat_name = row['class_name'].strip()
-
-        if cat_name not in CATEGORY_NAME_TO_ID:
-            continue
-        
-        width = row['x_max'] - row['x_min']
-        height = row['y_max'] - row['y_min']
 
-        coco['annotations'].append({
+def table_annotation_columns(table):
+    """
+    Same as annotation_columns, but straight from a columnar train_annotations table.
+
+    Category names are resolved once per distinct name rather than per row, and the
+    image list is the table's image_name dictionary, which is in first-appearance
+    order just like df['image_name'].unique().
+    """
+    names = table.dictionaries['class_name']
+    # The extra trailing 0 catches missing values (code -1)
+    lookup = np.array([CATEGORY_NAME_TO_ID.get(name.strip(), 0) for name in names] + [0], dtype=np.int64)
+    category_ids = lookup[table['class_name']]
+    keep = category_ids > 0
+
+    image_codes = np.asarray(table['image_name'])[keep]
+    if (image_codes < 0).any():
+        raise KeyError("annotation without image_name")
+
+    x_min, y_min = table['x_min'][keep], table['y_min'][keep]
+    width = table['x_max'][keep] - x_min
+    height = table['y_max'][keep] - y_min
+    return {
+        "id": np.arange(1, int(keep.sum()) + 1),
+        "image_id": image_codes.astype(np.int64) + 1,
+        "category_id": category_ids[keep],
+        "x": x_min,
+        "y": y_min,
+        "width": width,
+        "height": height,
+        "area": width * height
+    }
+
+def image_columns(image_list, image_dir=None):
+    """
+    COCO image columns for image_list with 1-based ids.
+
+    Image sizes are read from the file headers in image_dir when given; otherwise
+    (or for files that cannot be found) DEFAULT_SIZE is assumed.
+    """
+    sizes = image_index(image_dir) if image_dir else None
+    size_list = [sizes.get(name) if sizes else DEFAULT_SIZE for name in image_list]
+    return {
+        "id": np.arange(1, len(image_list) + 1),
+        "file_name": list(image_list),
+        "width": np.array([w for w, _ in size_list], dtype=np.int64),
+        "height": np.array([h for _, h in size_list], dtype=np.int64)
+    }
+
+def annotations_from_columns(columns):
+    """Build COCO annotation dicts from annotation_columns output in one pass."""
+    keys = ("id", "image_id", "category_id", "x", "y", "width", "height", "area")
+    return [
+        {
             "id": ann_id,
-            "image_id": image_id_map[image_name],
-            "category_id": CATEGORY_NAME_TO_ID[cat_name],
-            "bbox": [row['x_min'], row['y_min'], width, height],
-            "area": width * height,
+            "image_id": image_id,
+            "category_id": category_id,
+            "bbox": [x, y, width, height],
+            "area": area,
             "iscrowd": 0,
             "segmentation": []
-        })
-        ann_id += 1
-        
-    return coco
+        }
+        for ann_id, image_id, category_id, x, y, width, height, area
+        in zip(*(columns[key].tolist() for key in keys))
+    ]
+
+def coco_from_columns(images, annotations):
+    """Build the COCO dict from image_columns and annotation_columns output."""
+    return {
+        "images": [
+            {"id": img_id, "file_name": file_name, "width": width, "height": height}
+            for img_id, file_name, width, height in zip(
+                images["id"].tolist(), images["file_name"], images["width"].tolist(), images["height"].tolist()
+            )
+        ],
+        "annotations": annotations_from_columns(annotations),
+        "categories": CATEGORIES
+    }
 
-def csv_to_coco(csv_path, output_json):
-    df = pd.read_csv(csv_path)
-    images = list(df['image_name'].unique())
-    coco = process_dataframe_to_coco(df, images)
+def process_dataframe_to_coco(df, image_list, image_dir=None):
+    """
+    Build a COCO dict from an annotations dataframe.
+
+    Image sizes are read from the file headers in image_dir when given; otherwise
+    (or for files that cannot be found) DEFAULT_SIZE is assumed.
+    """
+    return coco_from_columns(image_columns(image_list, image_dir), annotation_columns(df, image_list))
+
+def csv_to_coco(csv_path, output_json, image_dir=None, compact=False, columnar_output=None):
+    """
+    Convert train annotations to COCO.
+
+    Args:
+        csv_path: train_annotations.csv, or the train_annotations.cols table written by clean.py
+        output_json: COCO JSON to write, or None to skip the JSON output
+        image_dir: Directory to read real image sizes from
+        compact: Write the JSON without indentation
+        columnar_output: Also write the COCO columnar tables that coco2yolo.py reads directly
+    """
+    if is_table(csv_path):
+        table = Table(csv_path)
+        images = table.dictionaries['image_name']
+        annotations = table_annotation_columns(table)
+    else:
+        df = pd.read_csv(csv_path)
+        images = list(df['image_name'].unique())
+        annotations = annotation_columns(df, images)
+    image_cols = image_columns(images, image_dir)
+
+    if columnar_output:
+        write_coco_columns(columnar_output, image_cols, annotations, CATEGORIES)
+        print(f"{columnar_output} created.")
+    if not output_json:
+        return
+
+    coco = coco_from_columns(image_cols, annotations)
     os.makedirs(os.path.dirname(output_json), exist_ok=True)
     with open(output_json, 'w') as f:
-        json.dump(coco, f, indent=2)
+        if compact:
+            # Without indent json uses its C encoder, several times faster on large files
+            json.dump(coco, f, separators=(',', ':'))
+        else:
+            json.dump(coco, f, indent=2)
     print(f"{output_json} created.")
 
 if __name__ == "__main__":
-    csv_to_coco('data/train_annotations.csv', 'data/annotations/train.json')
+    import argparse
+    parser = argparse.ArgumentParser(description='Convert train annotations to COCO and write the YOLO dataset yaml')
+    parser.add_argument('--columnar', action='store_true',
+                        help='Read data/train_annotations.cols and also write the data/annotations/train.cols tables')
+    parser.add_argument('--no_json', action='store_true', help='Skip data/annotations/train.json')
+    args = parser.parse_args()
+
+    csv_to_coco(
+        'data/train_annotations.cols' if args.columnar else 'data/train_annotations.csv',
+        None if args.no_json else 'data/annotations/train.json',
+        image_dir='data/images/train',
+        columnar_output='data/annotations/train.cols' if args.columnar else None
+    )
     create_yolo_yaml(
         output_path='data/dataset.yaml',
         train_path='../images/train',
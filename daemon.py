@@ -0,0 +1,192 @@
+import os
+import sys
+import json
+import time
+import signal
+import socket
+import argparse
+import tempfile
+import threading
+import socketserver
+
+import numpy as np
+
+from inference import BACKENDS, IMG_SIZE, MODEL_PATH, collate, detect, load_forward
+
+DEFAULT_SOCKET = os.path.join(tempfile.gettempdir(), 'vehicle_detector.sock')
+CONNECT_TIMEOUT = 2.0  # seconds to wait for the daemon to accept a connection
+# Unix sockets are missing on Windows (socketserver.UnixStreamServer is not defined);
+# there ping() finds no daemon and callers detect in-process
+UNIX_SOCKETS = hasattr(socket, "AF_UNIX")
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    """One JSON request line in, one JSON line per result out."""
+
+    def handle(self):
+        server = self.server
+        try:
+            request = json.loads(self.rfile.readline())
+            command = request.get("command", "detect")
+            if command == "ping":
+                self._send(server.status())
+            elif command == "shutdown":
+                self._send({"ok": True})
+                threading.Thread(target=server.shutdown, daemon=True).start()
+            elif command == "detect":
+                self._detect(request)
+            else:
+                raise ValueError(f"Unknown command '{command}'")
+        except BrokenPipeError:
+            pass  # client went away
+        except Exception as e:
+            self._send({"error": f"{type(e).__name__}: {e}"})
+
+    def _detect(self, request):
+        server = self.server
+        start = time.perf_counter()
+        forward = server.forward(request.get("backend", server.backend))
+        count = 0
+        # One request at a time owns the model; its batches still prefetch on the decode pool
+        with server.lock:
+            for item, dets in detect(request["image_paths"], forward, request.get("batch_size", 8),
+                                     request.get("imgsz", IMG_SIZE), server.workers):
+                self._send({"width": item["width"], "height": item["height"], "dets": dets.tolist()})
+                count += 1
+        elapsed = time.perf_counter() - start
+        server.requests += 1
+        self._send({"done": True, "seconds": elapsed})
+        print(f"Request {server.requests}: {count} images in {elapsed:.2f}s")
+
+    def _send(self, message):
+        self.wfile.write((json.dumps(message) + "\n").encode())
+
+
+if UNIX_SOCKETS:
+    class DetectorServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+        """
+        Resident process holding the detector in memory, serving detection over a Unix socket.
+
+        Args:
+            socket_path: Unix socket to listen on
+            backend: Backend loaded and warmed up at startup; requests may ask for another
+            model_path: Weights, resolved relative to the daemon's working directory
+            workers: Image decode threads per request
+        """
+
+        daemon_threads = True
+
+        def __init__(self, socket_path=DEFAULT_SOCKET, backend="torch", model_path=MODEL_PATH, workers=None):
+            if os.path.exists(socket_path):
+                if ping(socket_path):
+                    raise RuntimeError(f"A daemon is already listening on {socket_path}")
+                os.remove(socket_path)  # stale socket of a daemon that died
+            super().__init__(socket_path, _Handler)
+            self.socket_path = socket_path
+            self.backend = backend
+            self.model_path = model_path
+            self.workers = workers
+            self.lock = threading.Lock()
+            self.requests = 0
+            self.started = time.time()
+
+        def forward(self, backend):
+            return load_forward(backend, self.model_path)
+
+        def warm_up(self, imgsz=IMG_SIZE):
+            """Load the default backend and run one dummy batch, so the first request pays neither."""
+            start = time.perf_counter()
+            forward = self.forward(self.backend)
+            loaded = time.perf_counter()
+            forward(collate([{"chw": np.full((3, imgsz, imgsz), 114, dtype=np.uint8)}]))
+            print(f"Loaded {self.backend} model in {loaded - start:.2f}s, warm-up batch {time.perf_counter() - loaded:.2f}s")
+
+        def status(self):
+            return {"ok": True, "backend": self.backend, "requests": self.requests,
+                    "uptime": round(time.time() - self.started, 1), "pid": os.getpid()}
+
+        def server_close(self):
+            super().server_close()
+            if os.path.exists(self.socket_path):
+                os.remove(self.socket_path)
+
+
+def _request(socket_path, payload):
+    """Send one request and yield the reply lines as dicts."""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(CONNECT_TIMEOUT)
+        sock.connect(socket_path)
+        sock.settimeout(None)
+        sock.sendall((json.dumps(payload) + "\n").encode())
+        with sock.makefile('r') as replies:
+            for line in replies:
+                reply = json.loads(line)
+                if "error" in reply:
+                    raise RuntimeError(f"Daemon error: {reply['error']}")
+                yield reply
+
+
+def ping(socket_path=DEFAULT_SOCKET):
+    """Status dict of the daemon on socket_path, or None when none is answering."""
+    if not UNIX_SOCKETS or not os.path.exists(socket_path):
+        return None
+    try:
+        return next(_request(socket_path, {"command": "ping"}))
+    except (OSError, StopIteration):
+        return None
+
+
+def detect_remote(image_paths, socket_path=DEFAULT_SOCKET, batch_size=8, imgsz=IMG_SIZE, backend="torch"):
+    """
+    Same as inference.detect, but run by the warm daemon listening on socket_path.
+
+    Paths are sent as absolute paths, so the daemon must see the same filesystem.
+
+    Yields:
+        (item, dets) with item = {"path", "width", "height"}, in the order of image_paths
+    """
+    image_paths = list(image_paths)
+    payload = {"command": "detect", "image_paths": [os.path.abspath(p) for p in image_paths],
+               "batch_size": batch_size, "imgsz": imgsz, "backend": backend}
+    paths = iter(image_paths)
+    for reply in _request(socket_path, payload):
+        if reply.get("done"):
+            return
+        item = {"path": next(paths), "width": reply["width"], "height": reply["height"]}
+        yield item, np.array(reply["dets"], dtype=np.float32).reshape(-1, 6)
+    raise RuntimeError("Daemon closed the connection before finishing the request")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Keep the detector loaded and serve detection over a Unix socket')
+    parser.add_argument('command', nargs='?', default='start', choices=['start', 'stop', 'status'])
+    parser.add_argument('--socket', default=DEFAULT_SOCKET, help='Unix socket path')
+    parser.add_argument('--backend', default='torch', choices=BACKENDS, help='Backend to keep warm')
+    parser.add_argument('--workers', type=int, default=None, help='Image decode threads per request')
+    args = parser.parse_args()
+
+    if not UNIX_SOCKETS:
+        sys.exit("daemon.py needs Unix sockets, which this platform does not provide; "
+                 "main.py detects in-process without it")
+    if args.command == 'status':
+        print(ping(args.socket) or f"No daemon on {args.socket}")
+    elif args.command == 'stop':
+        if ping(args.socket):
+            list(_request(args.socket, {"command": "shutdown"}))
+            print(f"Stopped daemon on {args.socket}")
+        else:
+            print(f"No daemon on {args.socket}")
+    else:
+        # Exit cleanly on SIGTERM so the socket file is removed
+        signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+        with DetectorServer(args.socket, args.backend, workers=args.workers) as server:
+            server.warm_up()
+            print(f"Listening on {args.socket}")
+            try:
+                server.serve_forever()
+            except KeyboardInterrupt:
+                pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,173 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'urban-vision', 'detections')
+COMMIT_EVERY = 64  # puts between commits; at most this many images are re-run after a crash
+HASH_CHUNK = 1 << 20
+
+_WEIGHTS_DIGESTS = {}
+
+
+def file_digest(path):
+    """SHA-256 of a file's bytes, read without decoding."""
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def weights_digest(path):
+    """SHA-256 of a weights file, memoized on (path, size, mtime) so it is hashed once per process."""
+    st = os.stat(path)
+    memo_key = (os.path.abspath(path), st.st_size, st.st_mtime_ns)
+    if memo_key not in _WEIGHTS_DIGESTS:
+        _WEIGHTS_DIGESTS[memo_key] = file_digest(path)
+    return _WEIGHTS_DIGESTS[memo_key]
+
+
+def cache_key(image_digest, model_digest, settings):
+    """Combine image content, model weights and inference settings into one cache key."""
+    payload = json.dumps([image_digest, model_digest, settings], sort_keys=True)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+class DetectionCache:
+    """
+    Content-addressed on-disk store of per-image detections.
+
+    Entries live in a SQLite database under cache_dir and hold the image size and
+    the Nx6 float32 [x1, y1, x2, y2, conf, cls] detections. Writes are committed
+    every COMMIT_EVERY images, so an interrupted run resumes from the cache.
+    On close, entries older than max_age_days are dropped, then the least recently
+    used entries until the cache fits in max_bytes.
+
+    Args:
+        cache_dir: Directory holding the cache database
+        max_bytes: Size bound for stored detections (None for unbounded)
+        max_age_days: Drop entries not used for this many days (None to keep)
+    """
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_bytes=None, max_age_days=None):
+        os.makedirs(cache_dir, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.max_age_days = max_age_days
+        self.hits = 0
+        self.misses = 0
+        self._uncommitted = 0
+        self._touched = []
+        self.db = sqlite3.connect(os.path.join(cache_dir, 'detections.sqlite'))
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.execute(
+            'CREATE TABLE IF NOT EXISTS detections ('
+            'key TEXT PRIMARY KEY, width INTEGER, height INTEGER, dets BLOB, '
+            'nbytes INTEGER, accessed REAL)'
+        )
+
+    def lookup(self, key):
+        """Check whether key is cached, counting the hit or miss."""
+        found = self.db.execute('SELECT 1 FROM detections WHERE key = ?', (key,)).fetchone() is not None
+        if found:
+            self.hits += 1
+            self._touched.append((time.time(), key))
+        else:
+            self.misses += 1
+        return found
+
+    def load(self, key):
+        """Return (width, height, dets) for a cached key."""
+        width, height, blob = self.db.execute(
+            'SELECT width, height, dets FROM detections WHERE key = ?', (key,)).fetchone()
+        return width, height, np.frombuffer(blob, dtype=np.float32).reshape(-1, 6).copy()
+
+    def put(self, key, width, height, dets):
+        blob = np.ascontiguousarray(dets, dtype=np.float32).tobytes()
+        self.db.execute('INSERT OR REPLACE INTO detections VALUES (?, ?, ?, ?, ?, ?)',
+                        (key, width, height, blob, len(blob), time.time()))
+        self._uncommitted += 1
+        if self._uncommitted >= COMMIT_EVERY:
+            self.commit()
+
+    def commit(self):
+        if self._touched:
+            self.db.executemany('UPDATE detections SET accessed = ? WHERE key = ?', self._touched)
+            self._touched = []
+        self.db.commit()
+        self._uncommitted = 0
+
+    def evict(self):
+        """Apply the age and size bounds; returns the number of entries removed."""
+        removed = 0
+        if self.max_age_days is not None:
+            cutoff = time.time() - self.max_age_days * 86400
+            removed += self.db.execute('DELETE FROM detections WHERE accessed < ?', (cutoff,)).rowcount
+        if self.max_bytes is not None:
+            total = self.db.execute('SELECT COALESCE(SUM(nbytes), 0) FROM detections').fetchone()[0]
+            if total > self.max_bytes:
+                stale = []
+                for key, nbytes in self.db.execute('SELECT key, nbytes FROM detections ORDER BY accessed'):
+                    if total <= self.max_bytes:
+                        break
+                    stale.append((key,))
+                    total -= nbytes
+                self.db.executemany('DELETE FROM detections WHERE key = ?', stale)
+                removed += len(stale)
+        return removed
+
+    def close(self):
+        self.commit()
+        self.evict()
+        self.db.commit()
+        self.db.close()
+
+    def report(self):
+        total = self.hits + self.misses
+        rate = 100.0 * self.hits / total if total else 0.0
+        print(f"Detection cache: {self.hits} hits, {self.misses} misses ({rate:.1f}% hit rate)")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+def detect_cached(image_paths, cache, detect_fn, model_path, settings, workers=None):
+    """
+    Serve detections from cache where possible and run detect_fn only on the misses.
+
+    Args:
+        image_paths: Paths of the images to run on
+        cache: DetectionCache to read from and fill
+        detect_fn: Callable taking a list of paths and yielding (item, dets) in order
+        model_path: Weights file, hashed into every key
+        settings: JSON-serializable inference settings, hashed into every key
+        workers: Threads used to hash the image files
+
+    Yields:
+        (item, dets) pairs in the order of image_paths
+    """
+    model_digest = weights_digest(model_path)
+    with ThreadPoolExecutor(max_workers=workers or os.cpu_count() or 1) as pool:
+        digests = list(pool.map(file_digest, image_paths))
+    keys = [cache_key(d, model_digest, settings) for d in digests]
+
+    hit = [cache.lookup(key) for key in keys]
+    misses = [path for path, is_hit in zip(image_paths, hit) if not is_hit]
+
+    fresh = detect_fn(misses) if misses else iter(())
+    for path, key, is_hit in zip(image_paths, keys, hit):
+        if is_hit:
+            width, height, dets = cache.load(key)
+            yield {"path": path, "width": width, "height": height}, dets
+        else:
+            item, dets = next(fresh)
+            cache.put(key, item["width"], item["height"], dets)
+            yield item, dets
@@ -0,0 +1,147 @@
+import numpy as np
+
+from coco_writer import CocoWriter
+from inference import CATEGORIES, YOLO_IDX_TO_CAT_ID
+
+OTHERS_CATEGORY_ID = 15  # category of class indices the model should not produce
+# The COCO annotation layout of main.py; %r formats floats exactly as json.dumps does
+COCO_ANNOTATION = ('{"id":%d,"image_id":%d,"category_id":%d,"bbox":[%r,%r,%r,%r],"area":%r,'
+                   '"segmentation":[],"iscrowd":0}')
+COCO_ANNOTATION_SCORE = COCO_ANNOTATION[:-1] + ',"score":%r}'
+
+_CATEGORY_LOOKUP = np.array([YOLO_IDX_TO_CAT_ID[i] for i in range(len(YOLO_IDX_TO_CAT_ID))], dtype=np.int64)
+
+
+def category_ids(classes):
+    """COCO category ids of YOLO class indices, as YOLO_IDX_TO_CAT_ID.get(int(cls), 15) for a whole array."""
+    idx = np.asarray(classes).astype(np.int64)
+    known = (idx >= 0) & (idx < len(_CATEGORY_LOOKUP))
+    return np.where(known, _CATEGORY_LOOKUP[idx.clip(0, len(_CATEGORY_LOOKUP) - 1)], OTHERS_CATEGORY_ID)
+
+
+def annotation_lines(boxes, classes, image_ids, first_annotation_id, scores=None):
+    """
+    Compact COCO annotation JSON, one string per box, without building a dict per box.
+
+    Byte-identical to json.dumps of main.py's annotation dicts: bbox, area and
+    the float64 arithmetic behind them are computed for all boxes at once.
+
+    Args:
+        boxes: Nx4 [x1, y1, x2, y2] boxes
+        classes: N YOLO class indices
+        image_ids: COCO image id of every box, or one id for all of them
+        first_annotation_id: Id of the first box; the others follow consecutively
+        scores: N confidences to append as "score", or None to leave them out
+    """
+    n = len(boxes)
+    if not n:
+        return []
+    xyxy = np.asarray(boxes, dtype=np.float32).astype(np.float64)
+    wh = xyxy[:, 2:] - xyxy[:, :2]
+    values = np.column_stack([xyxy[:, :2], wh, wh[:, 0] * wh[:, 1]]).tolist()
+    ids = range(first_annotation_id, first_annotation_id + n)
+    image_ids = np.broadcast_to(image_ids, (n,)).tolist()
+    cats = category_ids(classes).tolist()
+    if scores is None:
+        return [COCO_ANNOTATION % (i, image_id, cat, *v) for i, image_id, cat, v in zip(ids, image_ids, cats, values)]
+    scores = np.asarray(scores, dtype=np.float32).tolist()
+    return [COCO_ANNOTATION_SCORE % (i, image_id, cat, *v, score)
+            for i, image_id, cat, v, score in zip(ids, image_ids, cats, values, scores)]
+
+
+class DetectionStore:
+    """
+    Columnar store of detection results.
+
+    Boxes (float32 Nx4 xyxy), scores (float32), YOLO classes (int16) and image
+    positions (int32) live in contiguous arrays that grow by doubling; each
+    image's Nx6 detections are appended with one slice copy per column. The
+    store serializes straight to COCO (see annotation_lines) or YOLO label files.
+
+    Args:
+        capacity: Initial number of boxes
+    """
+
+    def __init__(self, capacity=4096):
+        self.boxes = np.empty((capacity, 4), dtype=np.float32)
+        self.scores = np.empty(capacity, dtype=np.float32)
+        self.classes = np.empty(capacity, dtype=np.int16)
+        self.image_index = np.empty(capacity, dtype=np.int32)
+        self.count = 0
+        self.file_names = []
+        self.sizes = np.empty((64, 2), dtype=np.int32)  # (width, height) per image
+
+    def __len__(self):
+        return self.count
+
+    @property
+    def num_images(self):
+        return len(self.file_names)
+
+    @property
+    def nbytes(self):
+        columns = (self.boxes, self.scores, self.classes, self.image_index, self.sizes)
+        return sum(column.nbytes for column in columns)
+
+    def add_image(self, file_name, width, height):
+        """Register an image and return its position, which add() takes."""
+        index = len(self.file_names)
+        if index == len(self.sizes):
+            self.sizes = np.concatenate([self.sizes, np.empty_like(self.sizes)])
+        self.sizes[index] = width, height
+        self.file_names.append(file_name)
+        return index
+
+    def add(self, image_index, dets):
+        """Append one image's Nx6 [x1, y1, x2, y2, conf, cls] detections."""
+        n = len(dets)
+        start, end = self.count, self.count + n
+        if end > len(self.scores):
+            self._grow(end)
+        self.boxes[start:end] = dets[:, :4]
+        self.scores[start:end] = dets[:, 4]
+        self.classes[start:end] = dets[:, 5]
+        self.image_index[start:end] = image_index
+        self.count = end
+
+    def _grow(self, needed):
+        capacity = max(needed, 2 * len(self.scores))
+        for name in ("boxes", "scores", "classes", "image_index"):
+            old = getattr(self, name)
+            new = np.empty((capacity,) + old.shape[1:], dtype=old.dtype)
+            new[:self.count] = old[:self.count]
+            setattr(self, name, new)
+
+    def coco_images(self, first_image_id=0):
+        return [{"id": first_image_id + i, "file_name": name, "width": int(w), "height": int(h)}
+                for i, (name, (w, h)) in enumerate(zip(self.file_names, self.sizes.tolist()))]
+
+    def coco_annotation_lines(self, first_annotation_id=1, first_image_id=0, scores=False):
+        n = self.count
+        return annotation_lines(self.boxes[:n], self.classes[:n], self.image_index[:n] + first_image_id,
+                                first_annotation_id, self.scores[:n] if scores else None)
+
+    def write_coco(self, output_json, categories=CATEGORIES, indent=2, scores=False, first_image_id=0,
+                   first_annotation_id=1):
+        """Write a COCO document in main.py's layout, with each detection's score when scores is set."""
+        with CocoWriter(output_json, categories, indent=indent) as writer:
+            for image in self.coco_images(first_image_id):
+                writer.add_image(image)
+            writer.add_annotation_lines(self.coco_annotation_lines(first_annotation_id, first_image_id, scores))
+
+    def yolo_label_files(self):
+        """(txt_name, label_text) pairs, one per image, as coco2yolo.py would write for the COCO output."""
+        # Imported here: coco2yolo pulls in pandas, which main.py's annotation_lines import should not pay for
+        from coco2yolo import label_files_from_arrays
+
+        n = self.count
+        xywh = self.boxes[:n].astype(np.float64)
+        xywh[:, 2:] -= xywh[:, :2]
+        return label_files_from_arrays(np.arange(self.num_images), self.file_names, self.sizes[:self.num_images],
+                                       [cat["id"] for cat in CATEGORIES], self.image_index[:n],
+                                       category_ids(self.classes[:n]), xywh)
+
+    def write_yolo(self, labels_dir, workers=None, archive_path=None):
+        from coco2yolo import write_label_files
+
+        write_label_files(self.yolo_label_files(), labels_dir, workers, archive_path)
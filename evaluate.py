@@ -0,0 +1,277 @@
+"""
+COCO box mAP of a predictions file against a ground-truth file, per category.
+
+Follows the pycocotools bbox evaluation (10 IoU thresholds 0.50:0.95, 101-point
+interpolated precision, at most 100 detections per image and category, crowd
+ground truth and boxes outside the area range ignored) for the "all" area range,
+with the IoU matrices and the matching vectorized in numpy and the images split
+across worker processes.
+
+Images are matched by file_name, so predictions written by main.py or
+predict_and_save_json.py can be scored against csvtojson.csv_to_coco output
+despite their different image ids. Detections without a "score" are ranked in
+file order.
+
+    python evaluate.py --gt data/annotations/val.json --pred results/output.json
+    python evaluate.py --gt data/annotations/val.json --weights best.pt --image_dir data/images/val
+"""
+import os
+import json
+import time
+import argparse
+import multiprocessing as mp
+
+import numpy as np
+
+IOU_THRESHOLDS = np.linspace(0.5, 0.95, 10)
+RECALL_THRESHOLDS = np.linspace(0.0, 1.0, 101)
+MAX_DETS = 100
+AREA_RANGE = (0, 1e10)  # pycocotools' "all"; boxes outside it (e.g. degenerate ones) are ignored
+CHUNK_IMAGES = 64  # images per worker task
+
+
+def coco_iou(dt, gt, crowd):
+    """DxG IoU between [x, y, w, h] boxes; for crowd ground truth the union is the detection's area."""
+    dt_x2, dt_y2 = dt[:, 0] + dt[:, 2], dt[:, 1] + dt[:, 3]
+    gt_x2, gt_y2 = gt[:, 0] + gt[:, 2], gt[:, 1] + gt[:, 3]
+    iw = (np.minimum(dt_x2[:, None], gt_x2[None]) - np.maximum(dt[:, None, 0], gt[None, :, 0])).clip(0)
+    ih = (np.minimum(dt_y2[:, None], gt_y2[None]) - np.maximum(dt[:, None, 1], gt[None, :, 1])).clip(0)
+    inter = iw * ih
+    dt_area = (dt[:, 2] * dt[:, 3])[:, None]
+    union = np.where(crowd[None], dt_area, dt_area + (gt[:, 2] * gt[:, 3])[None] - inter)
+    return inter / np.maximum(union, np.finfo(np.float64).eps)
+
+
+def match(iou, gt_ignore, gt_crowd, thresholds=IOU_THRESHOLDS):
+    """
+    Greedy matching of score-sorted detections to ground truth at every IoU threshold at once.
+
+    As in pycocotools, each detection takes the unmatched (or crowd) ground truth
+    of highest IoU above the threshold, preferring regular over ignored ground
+    truth; a detection matched to ignored ground truth is ignored itself.
+
+    Returns:
+        (matched, ignored): TxD boolean arrays
+    """
+    t, (d, g) = len(thresholds), iou.shape
+    matched = np.zeros((t, d), dtype=bool)
+    ignored = np.zeros((t, d), dtype=bool)
+    if not g:
+        return matched, ignored
+    taken = np.zeros((t, g), dtype=bool)
+    rows = np.arange(t)
+    for i in range(d):
+        candidates = np.where((iou[i] >= thresholds[:, None]) & (~taken | gt_crowd), iou[i], -1.0)
+        # Among equal IoUs pycocotools keeps the last ground truth, hence the reversed argmax
+        regular = np.where(gt_ignore, -1.0, candidates)[:, ::-1]
+        fallback = np.where(gt_ignore, candidates, -1.0)[:, ::-1]
+        has_regular = regular.max(axis=1) >= 0
+        best = g - 1 - np.where(has_regular, regular.argmax(axis=1), fallback.argmax(axis=1))
+        hit = has_regular | (fallback.max(axis=1) >= 0)
+        matched[:, i] = hit
+        ignored[:, i] = hit & gt_ignore[best]
+        taken[rows[hit], best[hit]] = True
+    return matched, ignored
+
+
+def evaluate_image(gt_boxes, gt_cats, gt_crowd, gt_areas, dt_boxes, dt_cats, dt_scores, category_ids,
+                   max_dets=MAX_DETS):
+    """
+    Match one image's detections per category.
+
+    Returns:
+        {category_id: (scores, matched TxD, ignored TxD, regular ground-truth count)}
+        for every category present in the ground truth or the detections
+    """
+    results = {}
+    for cat in category_ids:
+        g = gt_cats == cat
+        d = np.flatnonzero(dt_cats == cat)
+        if not g.any() and not len(d):
+            continue
+        d = d[np.argsort(-dt_scores[d], kind='mergesort')][:max_dets]
+        area = gt_areas[g]
+        ignore = gt_crowd[g] | (area < AREA_RANGE[0]) | (area > AREA_RANGE[1])
+        order = np.argsort(ignore, kind='mergesort')  # ignored ground truth last
+        crowd, ignore = gt_crowd[g][order], ignore[order]
+        iou = coco_iou(dt_boxes[d], gt_boxes[g][order], crowd)
+        matched, ignored = match(iou, ignore, crowd)
+        # Unmatched detections outside the area range do not count as false positives
+        dt_area = dt_boxes[d, 2] * dt_boxes[d, 3]
+        ignored |= ~matched & ((dt_area < AREA_RANGE[0]) | (dt_area > AREA_RANGE[1]))
+        results[cat] = (dt_scores[d], matched, ignored, int((~ignore).sum()))
+    return results
+
+
+def _evaluate_chunk(args):
+    images, category_ids = args
+    return [evaluate_image(*image, category_ids) for image in images]
+
+
+def accumulate(scores, matched, ignored, num_gt):
+    """Precision at the 101 recall thresholds and final recall, per IoU threshold, of one category."""
+    t = len(IOU_THRESHOLDS)
+    precision = np.zeros((t, len(RECALL_THRESHOLDS)))
+    recall = np.zeros(t)
+    order = np.argsort(-scores, kind='mergesort')
+    tp = np.cumsum(matched[:, order] & ~ignored[:, order], axis=1, dtype=np.float64)
+    fp = np.cumsum(~matched[:, order] & ~ignored[:, order], axis=1, dtype=np.float64)
+    if not tp.shape[1]:
+        return precision, recall
+    rc = tp / num_gt
+    pr = tp / (tp + fp + np.spacing(1))
+    # Precision envelope: the best precision at any higher recall
+    pr = np.maximum.accumulate(pr[:, ::-1], axis=1)[:, ::-1]
+    recall[:] = rc[:, -1]
+    for i in range(t):
+        idx = np.searchsorted(rc[i], RECALL_THRESHOLDS, side='left')
+        valid = idx < len(pr[i])
+        precision[i, valid] = pr[i, idx[valid]]
+    return precision, recall
+
+
+def _group(annotations, image_index):
+    """Per-image arrays of boxes, categories, crowd flags, areas and scores, for annotations keyed by image position."""
+    n = len(image_index)
+    rows = [(image_index[a['image_id']], a) for a in annotations if a['image_id'] in image_index]
+    positions = np.array([p for p, _ in rows], dtype=np.int64)
+    boxes = np.array([a['bbox'] for _, a in rows], dtype=np.float64).reshape(-1, 4)
+    cats = np.array([a['category_id'] for _, a in rows], dtype=np.int64)
+    crowd = np.array([bool(a.get('iscrowd', 0)) for _, a in rows], dtype=bool)
+    areas = np.array([a.get('area', a['bbox'][2] * a['bbox'][3]) for _, a in rows], dtype=np.float64)
+    scores = np.array([a.get('score', 1.0) for _, a in rows], dtype=np.float64)
+    order = np.argsort(positions, kind='mergesort')
+    bounds = np.searchsorted(positions[order], np.arange(n + 1))
+    columns = [col[order] for col in (boxes, cats, crowd, areas, scores)]
+    return [tuple(col[bounds[i]:bounds[i + 1]] for col in columns) for i in range(n)]
+
+
+def evaluate(gt, predictions, workers=None):
+    """
+    Per-category and mean AP / AP50 / AP75 / AR100 of predictions against ground truth.
+
+    Args:
+        gt: Ground-truth COCO dict
+        predictions: Predicted COCO dict (with "images" to match by file_name) or a list
+            of result annotations whose image_id are ground-truth ids
+        workers: Worker processes (default: CPU count; 1 evaluates in this process)
+    """
+    categories = sorted(gt['categories'], key=lambda c: c['id'])
+    category_ids = [c['id'] for c in categories]
+    gt_index = {image['id']: i for i, image in enumerate(gt['images'])}
+    if isinstance(predictions, dict):
+        by_name = {image['file_name']: gt_index[image['id']] for image in gt['images']}
+        pred_index = {image['id']: by_name[image['file_name']] for image in predictions['images']
+                      if image['file_name'] in by_name}
+        unmatched = len(predictions['images']) - len(pred_index)
+        if unmatched:
+            print(f"Ignoring {unmatched} predicted images not in the ground truth")
+        pred_annotations = predictions['annotations']
+    else:
+        pred_index, pred_annotations = gt_index, predictions
+    if pred_annotations and 'score' not in pred_annotations[0]:
+        print("Predictions have no scores; detections are ranked in file order")
+
+    gt_images = _group(gt['annotations'], gt_index)
+    pred_images = _group(pred_annotations, pred_index)
+    images = [(g[0], g[1], g[2], g[3], p[0], p[1], p[4]) for g, p in zip(gt_images, pred_images)]
+    chunks = [(images[i:i + CHUNK_IMAGES], category_ids) for i in range(0, len(images), CHUNK_IMAGES)]
+
+    workers = min(workers or os.cpu_count() or 1, len(chunks))
+    if workers > 1:
+        # spawn: safe also inside a training process that has started torch threads
+        with mp.get_context("spawn").Pool(workers) as pool:
+            per_image = [r for results in pool.imap(_evaluate_chunk, chunks) for r in results]
+    else:
+        per_image = [r for chunk in chunks for r in _evaluate_chunk(chunk)]
+
+    per_class = []
+    t = len(IOU_THRESHOLDS)
+    for cat in categories:
+        parts = [r[cat['id']] for r in per_image if cat['id'] in r]
+        num_gt = sum(p[3] for p in parts)
+        scores = np.concatenate([p[0] for p in parts]) if parts else np.zeros(0)
+        entry = {"id": cat['id'], "name": cat['name'], "gt": num_gt, "detections": len(scores)}
+        if num_gt:
+            matched = np.concatenate([p[1] for p in parts], axis=1) if parts else np.zeros((t, 0), dtype=bool)
+            ignored = np.concatenate([p[2] for p in parts], axis=1) if parts else np.zeros((t, 0), dtype=bool)
+            precision, recall = accumulate(scores, matched, ignored, num_gt)
+            ap = precision.mean(axis=1)
+            entry.update(AP=float(ap.mean()), AP50=float(ap[0]), AP75=float(ap[5]), AR=float(recall.mean()))
+        per_class.append(entry)
+
+    scored = [c for c in per_class if c['gt']]
+    summary = {key: float(np.mean([c[key] for c in scored])) if scored else 0.0 for key in ("AP", "AP50", "AP75", "AR")}
+    summary.update(images=len(images), categories=len(scored))
+    return {"summary": summary, "per_class": per_class}
+
+
+def evaluate_files(gt_json, pred_json, workers=None):
+    with open(gt_json) as f:
+        gt = json.load(f)
+    with open(pred_json) as f:
+        predictions = json.load(f)
+    return evaluate(gt, predictions, workers)
+
+
+def evaluate_weights(weights, image_dir, gt_json, batch_size=8, workers=None):
+    """
+    Detect on the ground-truth images found in image_dir with a checkpoint and evaluate, without writing files.
+
+    The model is loaded outside inference.load_forward's cache, so evaluating a new
+    checkpoint after every epoch does not keep the earlier ones in memory.
+    """
+    from ultralytics import YOLO
+    from inference import YOLO_IDX_TO_CAT_ID, UltralyticsForward, detect
+
+    with open(gt_json) as f:
+        gt = json.load(f)
+    images = [image for image in gt['images'] if os.path.exists(os.path.join(image_dir, image['file_name']))]
+    paths = [os.path.join(image_dir, image['file_name']) for image in images]
+    results = []
+    for image, (_, dets) in zip(images, detect(paths, UltralyticsForward(YOLO(weights)), batch_size)):
+        for x1, y1, x2, y2, score, cls in dets.tolist():
+            results.append({"image_id": image['id'], "category_id": YOLO_IDX_TO_CAT_ID.get(int(cls), 15),
+                            "bbox": [x1, y1, x2 - x1, y2 - y1], "score": score})
+    gt = dict(gt, images=images)
+    return evaluate(gt, results, workers)
+
+
+def print_report(report):
+    print(f"{'category':<18} {'gt':>6} {'dets':>7} {'AP':>6} {'AP50':>6} {'AP75':>6} {'AR':>6}")
+    for c in report['per_class']:
+        if c['gt']:
+            print(f"{c['name']:<18} {c['gt']:6d} {c['detections']:7d} "
+                  f"{c['AP']:6.3f} {c['AP50']:6.3f} {c['AP75']:6.3f} {c['AR']:6.3f}")
+        else:
+            print(f"{c['name']:<18} {c['gt']:6d} {c['detections']:7d} {'-':>6} {'-':>6} {'-':>6} {'-':>6}")
+    s = report['summary']
+    print(f"{'all':<18} {'':6} {'':7} {s['AP']:6.3f} {s['AP50']:6.3f} {s['AP75']:6.3f} {s['AR']:6.3f}"
+          f"  ({s['images']} images, {s['categories']} categories with ground truth)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--gt', required=True, help='Ground-truth COCO JSON (e.g. from csvtojson.py)')
+    parser.add_argument('--pred', default=None, help='Predicted COCO JSON (main.py / predict_and_save_json.py output)')
+    parser.add_argument('--weights', default=None, help='Checkpoint to run on --image_dir instead of --pred')
+    parser.add_argument('--image_dir', default=None, help='Images of the ground truth, for --weights')
+    parser.add_argument('--batch_size', type=int, default=8)
+    parser.add_argument('--workers', type=int, default=None, help='Evaluation processes (default: CPU count)')
+    parser.add_argument('--output', default=None, help='Also write the report as JSON')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    if args.weights:
+        if not args.image_dir:
+            parser.error("--weights needs --image_dir")
+        report = evaluate_weights(args.weights, args.image_dir, args.gt, args.batch_size, args.workers)
+    elif args.pred:
+        report = evaluate_files(args.gt, args.pred, args.workers)
+    else:
+        parser.error("pass --pred or --weights")
+    print_report(report)
+    print(f"Evaluated in {time.perf_counter() - start:.2f}s")
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
@@ -0,0 +1,57 @@
+import os
+import argparse
+
+from inference import IMG_SIZE, MODEL_PATH, backend_model_path
+
+
+def export_onnx(model_path=MODEL_PATH, imgsz=IMG_SIZE, opset=None, end2end=False):
+    """
+    Export the trained detector to ONNX next to its weights (best.pt -> best.onnx).
+
+    The graph is exported with dynamic batch and image axes so the rectangular
+    letterbox batches built by inference.detect run unchanged. By default the
+    head matches what `YOLO.predict` runs, so detections match the PyTorch
+    backend; end2end exports the NMS-free YOLOv10 head instead (no NMS, but
+    different detections).
+    """
+    from ultralytics import YOLO
+
+    exported = YOLO(model_path).export(format='onnx', imgsz=imgsz, dynamic=True, opset=opset,
+                                          nms=False if end2end else None)
+    output_path = backend_model_path("onnx", model_path)
+    if os.path.abspath(exported) != os.path.abspath(output_path):
+        os.replace(exported, output_path)
+    print(f"Exported {model_path} to {output_path}")
+    return output_path
+
+
+def quantize_int8(onnx_path, output_path):
+    """
+    Quantize the weights of an ONNX model to INT8 with dynamic (calibration-free) quantization.
+
+    Activations stay float and are quantized on the fly, so no calibration images
+    are needed; check the accuracy cost with benchmarks/bench_backends.py.
+    """
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    quantize_dynamic(onnx_path, output_path, weight_type=QuantType.QInt8)
+    print(f"Quantized {onnx_path} to {output_path}")
+    return output_path
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Export the detector to ONNX for the ONNX Runtime CPU backend')
+    parser.add_argument('--weights', default=MODEL_PATH, help='Trained .pt weights')
+    parser.add_argument('--imgsz', type=int, default=IMG_SIZE, help='Inference size of the long image side')
+    parser.add_argument('--opset', type=int, default=None, help='ONNX opset (default: ultralytics default)')
+    parser.add_argument('--end2end', action='store_true', help='Export the NMS-free YOLOv10 head')
+    parser.add_argument('--int8', action='store_true', help='Also write an INT8 dynamically quantized model')
+    args = parser.parse_args()
+
+    onnx_path = export_onnx(args.weights, args.imgsz, args.opset, args.end2end)
+    if args.int8:
+        quantize_int8(onnx_path, backend_model_path("onnx-int8", args.weights))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+import cv2
+import numpy as np
+
+from inference import IMG_SIZE, collate, iter_prepared, prepare_image, unletterbox
+
+SIGNATURE_SIZE = 32  # frames are compared as SIGNATURE_SIZE x SIGNATURE_SIZE grids of mean brightness
+SKIP_THRESHOLD = 6.0  # largest cell change, in grey levels, of a frame that reuses the last detections
+MAX_REUSE = 10  # consecutive frames that may reuse one inferred frame's detections
+
+
+def frame_signature(chw, size=SIGNATURE_SIZE):
+    """
+    Downscaled brightness grid of a letterboxed 3xHxW image.
+
+    Each cell averages a block of a few hundred pixels (the green channel stands
+    in for luminance), which smooths sensor noise and compression artefacts while
+    a vehicle entering or leaving a block still shifts its mean.
+    """
+    return cv2.resize(chw[1], (size, size), interpolation=cv2.INTER_AREA).astype(np.float32)
+
+
+def signature_difference(a, b):
+    """Largest cell change between two signatures, after removing a global brightness shift."""
+    diff = a - b
+    return float(np.abs(diff - np.median(diff)).max())
+
+
+class FrameSkipper:
+    """
+    Decide per frame whether it can reuse the detections of the last inferred frame.
+
+    Every frame is compared with the last frame that went through the model, not
+    with its predecessor, so a slow drift still adds up to a fresh inference. A
+    frame reuses detections when it has the same size and its signature is within
+    threshold, and at most max_reuse frames in a row do, which bounds how stale
+    reused detections can get.
+
+    Args:
+        threshold: Largest cell change in grey levels (see signature_difference)
+        max_reuse: Consecutive frames allowed to reuse one inferred frame's detections
+    """
+
+    def __init__(self, threshold=SKIP_THRESHOLD, max_reuse=MAX_REUSE):
+        self.threshold = threshold
+        self.max_reuse = max_reuse
+        self.reference = None  # (width, height, signature) of the last inferred frame
+        self.run = 0
+        self.frames = 0
+        self.skipped = 0
+
+    def should_reuse(self, item):
+        """Consume item["signature"] and decide; a frame that does not reuse becomes the new reference."""
+        signature = item.pop("signature")
+        self.frames += 1
+        if self.reference is not None and self.run < self.max_reuse:
+            width, height, reference = self.reference
+            if (width, height) == (item["width"], item["height"]) and \
+                    signature_difference(signature, reference) <= self.threshold:
+                self.run += 1
+                self.skipped += 1
+                return True
+        self.reference = item["width"], item["height"], signature
+        self.run = 0
+        return False
+
+    def report(self):
+        ratio = self.skipped / self.frames if self.frames else 0.0
+        print(f"Reused detections for {self.skipped}/{self.frames} frames ({ratio:.1%} skipped), "
+              f"{self.frames - self.skipped} inferred")
+
+
+def detect_skipping(sources, forward, batch_size=8, imgsz=IMG_SIZE, workers=None, prepare=prepare_image,
+                    skipper=None):
+    """
+    inference.detect that skips the model for frames nearly identical to the last inferred one.
+
+    Signatures are computed on the decode pool next to the letterbox. Frames the
+    skipper lets through are batched as in detect; the others yield a copy of
+    their reference frame's detections, still in input order.
+
+    Args:
+        sources: Image paths, or decoded frame dicts with prepare=prepare_frame
+        forward: Callable mapping a uint8 Bx3xHxW batch to a list of Nx6 detection arrays
+        batch_size: Inferred frames per forward call
+        imgsz: Letterbox size
+        workers: Decode threads
+        prepare: Function turning one source into a prepared item
+        skipper: FrameSkipper deciding which frames reuse detections (default: FrameSkipper())
+
+    Yields:
+        (item, dets) as inference.detect does
+    """
+    skipper = skipper or FrameSkipper()
+    items = []  # frames waiting for the model
+    pending = []  # (item, slot, reused) in input order; slot[0] receives the detections
+    slot = None
+
+    def prepare_signed(source, imgsz):
+        item = prepare(source, imgsz)
+        item["signature"] = frame_signature(item["chw"])
+        return item
+
+    def drain():
+        for item, dets_slot, reused in pending:
+            yield item, dets_slot[0].copy() if reused else dets_slot[0]
+        pending.clear()
+
+    def flush():
+        outputs = forward(collate([item for item, _ in items]))
+        for (item, dets_slot), dets in zip(items, outputs):
+            item.pop("chw")
+            dets_slot[0] = unletterbox(dets, item["gain"], item["pad"], item["width"], item["height"])
+        items.clear()
+        yield from drain()
+
+    for item in iter_prepared(sources, imgsz, workers, 2 * batch_size, prepare_signed):
+        if skipper.should_reuse(item):
+            item.pop("chw")
+            pending.append((item, slot, True))
+        else:
+            slot = [None]
+            items.append((item, slot))
+            pending.append((item, slot, False))
+        if len(items) == batch_size:
+            yield from flush()
+        elif not items:
+            # Everything pending reuses frames that were already inferred
+            yield from drain()
+    if items:
+        yield from flush()
+    yield from drain()
@@ -0,0 +1,134 @@
+import os
+import json
+import struct
+
+# Size assumed by the original converters when an image cannot be probed
+DEFAULT_SIZE = (1920, 1080)
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+# SOFn markers carry the frame size; C4 (DHT), C8 (JPG) and CC (DAC) share the range but do not
+JPEG_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+
+def _jpeg_size(f):
+    f.seek(2)
+    while True:
+        byte = f.read(1)
+        while byte and byte != b'\xff':
+            byte = f.read(1)
+        while byte == b'\xff':  # markers may be padded with fill bytes
+            byte = f.read(1)
+        if not byte:
+            return None
+        marker = byte[0]
+        if marker in (0xD8, 0x01) or 0xD0 <= marker <= 0xD7:  # standalone markers have no length
+            continue
+        header = f.read(2)
+        if len(header) < 2:
+            return None
+        length = struct.unpack('>H', header)[0]
+        if marker in JPEG_SOF_MARKERS:
+            sof = f.read(5)
+            if len(sof) < 5:
+                return None
+            height, width = struct.unpack('>xHH', sof)
+            return width, height
+        f.seek(length - 2, os.SEEK_CUR)
+
+
+def _png_size(head):
+    if len(head) >= 24 and head[12:16] == b'IHDR':
+        return struct.unpack('>II', head[16:24])
+    return None
+
+
+def _bmp_size(head):
+    if len(head) < 26:
+        return None
+    dib_size = struct.unpack('<I', head[14:18])[0]
+    if dib_size == 12:  # BITMAPCOREHEADER
+        return struct.unpack('<HH', head[18:22])
+    width, height = struct.unpack('<ii', head[18:26])
+    return width, abs(height)  # negative height means top-down rows
+
+
+def probe_size(path):
+    """
+    Read (width, height) from a JPEG, PNG or BMP header without decoding pixels.
+
+    Only the header bytes are read, which matters on network storage. Falls back to
+    PIL for other formats. Like PIL's im.size, EXIF orientation is not applied.
+    """
+    with open(path, 'rb') as f:
+        head = f.read(32)
+        if head.startswith(b'\xff\xd8'):
+            size = _jpeg_size(f)
+        elif head.startswith(PNG_SIGNATURE):
+            size = _png_size(head)
+        elif head.startswith(b'BM'):
+            size = _bmp_size(head)
+        else:
+            size = None
+    if size is None:
+        from PIL import Image
+        with Image.open(path) as im:
+            size = im.size
+    return tuple(int(v) for v in size)
+
+
+class ImageIndex:
+    """
+    Memoized file_name -> (width, height) index for one image directory.
+
+    Sizes are probed on first use and remembered with the file's size and mtime,
+    so changed files are re-probed. With index_path the index persists between
+    runs as a small JSON file.
+
+    Args:
+        image_dir: Directory the file names are relative to
+        index_path: Optional JSON file to load the index from and save it to
+    """
+
+    def __init__(self, image_dir, index_path=None):
+        self.image_dir = image_dir
+        self.index_path = index_path
+        self.entries = {}
+        self._dirty = False
+        if index_path and os.path.exists(index_path):
+            with open(index_path, 'r') as f:
+                self.entries = json.load(f)
+
+    def size(self, file_name):
+        """Return (width, height) of file_name, probing its header if it is new or changed."""
+        st = os.stat(os.path.join(self.image_dir, file_name))
+        stamp = [st.st_size, st.st_mtime_ns]
+        entry = self.entries.get(file_name)
+        if entry is None or entry[2:] != stamp:
+            width, height = probe_size(os.path.join(self.image_dir, file_name))
+            entry = self.entries[file_name] = [width, height] + stamp
+            self._dirty = True
+        return entry[0], entry[1]
+
+    def get(self, file_name, default=DEFAULT_SIZE):
+        """Like size(), but returns default for files that are missing or unreadable."""
+        try:
+            return self.size(file_name)
+        except (OSError, ValueError, struct.error):
+            return default
+
+    def save(self):
+        if self.index_path and self._dirty:
+            with open(self.index_path, 'w') as f:
+                json.dump(self.entries, f)
+            self._dirty = False
+
+
+_INDEXES = {}
+
+
+def image_index(image_dir):
+    """Process-wide ImageIndex for image_dir, shared by every caller."""
+    key = os.path.abspath(image_dir)
+    if key not in _INDEXES:
+        _INDEXES[key] = ImageIndex(image_dir)
+    return _INDEXES[key]
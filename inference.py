@@ -0,0 +1,339 @@
+import os
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+MODEL_PATH = 'vehicle_yolov10/yolov10m2/weights/best.pt'
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+IMG_SIZE = 640  # matches imgsz in vehicle_yolov10/yolov10m2/args.yaml
+STRIDE = 32
+PAD_VALUE = 114  # same grey ultralytics pads with
+CONF_THRESHOLD = 0.25  # ultralytics' default predict conf
+NMS_IOU = 0.7  # ultralytics' default predict iou
+MAX_DET = 300
+MAX_WH = 7680  # class offset so boxes of different classes never overlap in NMS
+BACKENDS = ("torch", "onnx", "onnx-int8")
+
+# COCO categories (id starts from 1)
+CATEGORIES = [
+    {"id": 1, "name": "Hatchback", "supercategory": "Defect"},
+    {"id": 2, "name": "Sedan", "supercategory": "Defect"},
+    {"id": 3, "name": "SUV", "supercategory": "Defect"},
+    {"id": 4, "name": "MUV", "supercategory": "Defect"},
+    {"id": 5, "name": "Bus", "supercategory": "Defect"},
+    {"id": 6, "name": "Truck", "supercategory": "Defect"},
+    {"id": 7, "name": "Three Wheeler", "supercategory": "Defect"},
+    {"id": 8, "name": "Two Wheeler", "supercategory": "Defect"},
+    {"id": 9, "name": "LCV", "supercategory": "Defect"},
+    {"id": 10, "name": "Mini Bus", "supercategory": "Defect"},
+    {"id": 11, "name": "Mini-truck", "supercategory": "Defect"},
+    {"id": 12, "name": "Tempo-Traveller", "supercategory": "Defect"},
+    {"id": 13, "name": "Bicycle", "supercategory": "Defect"},
+    {"id": 14, "name": "Vans", "supercategory": "Defect"},
+    {"id": 15, "name": "Others", "supercategory": "Defect"}
+]
+
+# Map YOLO class index to COCO category id (YOLO: 0-based, COCO: 1-based)
+YOLO_IDX_TO_CAT_ID = {i: cat["id"] for i, cat in enumerate(CATEGORIES)}
+
+# Models loaded by load_forward in this process
+_FORWARDS = {}
+
+
+def list_images(image_dir):
+    """Return the image file names in image_dir, sorted so ids are reproducible."""
+    return sorted(f for f in os.listdir(image_dir) if f.lower().endswith(IMAGE_EXTENSIONS))
+
+
+def letterbox(image, imgsz=IMG_SIZE, stride=STRIDE):
+    """
+    Resize a BGR image so its long side is imgsz and pad each side to a multiple of stride.
+
+    Mirrors the rectangular letterbox ultralytics applies to a single image, so a
+    1920x1080 frame becomes 640x384 rather than a padded 640x640 square.
+
+    Args:
+        image: HxWx3 BGR uint8 array as returned by cv2.imread
+        imgsz: Target size of the long side
+        stride: Model stride the padded size must be divisible by
+
+    Returns:
+        (chw, gain, pad): 3xHxW RGB uint8 array, (gain_x, gain_y) and (pad_x, pad_y)
+    """
+    height, width = image.shape[:2]
+    r = min(imgsz / height, imgsz / width)
+    new_w, new_h = round(width * r), round(height * r)
+    if (new_w, new_h) != (width, height):
+        image = cv2.resize(image, (new_w, new_h), interpolation=cv2.INTER_LINEAR)
+
+    dw = (imgsz - new_w) % stride / 2
+    dh = (imgsz - new_h) % stride / 2
+    top, bottom = round(dh - 0.1), round(dh + 0.1)
+    left, right = round(dw - 0.1), round(dw + 0.1)
+    if top or bottom or left or right:
+        image = cv2.copyMakeBorder(image, top, bottom, left, right, cv2.BORDER_CONSTANT,
+                                   value=(PAD_VALUE, PAD_VALUE, PAD_VALUE))
+
+    chw = np.ascontiguousarray(image[..., ::-1].transpose(2, 0, 1))  # BGR HWC -> RGB CHW
+    return chw, (new_w / width, new_h / height), (left, top)
+
+
+def prepare_image(image_path, imgsz=IMG_SIZE):
+    """Decode and letterbox one image. Runs on the prefetch pool; cv2 releases the GIL."""
+    image = cv2.imread(image_path, cv2.IMREAD_COLOR)
+    if image is None:
+        raise ValueError(f"Could not decode image: {image_path}")
+    height, width = image.shape[:2]
+    chw, gain, pad = letterbox(image, imgsz)
+    return {"path": image_path, "width": width, "height": height, "chw": chw, "gain": gain, "pad": pad}
+
+
+def prepare_frame(frame, imgsz=IMG_SIZE):
+    """Letterbox an already decoded frame dict ({"image": BGR array, ...metadata}); metadata is kept."""
+    item = dict(frame)
+    image = item.pop("image")
+    item["height"], item["width"] = image.shape[:2]
+    item["chw"], item["gain"], item["pad"] = letterbox(image, imgsz)
+    return item
+
+
+def iter_prepared(sources, imgsz=IMG_SIZE, workers=None, prefetch=64, prepare=prepare_image):
+    """
+    Yield prepared images in input order while up to `prefetch` further images decode in the background.
+
+    Args:
+        sources: Image paths, or any iterable `prepare` accepts (consumed lazily)
+        imgsz: Letterbox size
+        workers: Decode threads (defaults to the CPU count)
+        prefetch: Maximum number of images in flight ahead of the consumer
+        prepare: prepare_image for paths, prepare_frame for decoded frames
+    """
+    workers = workers or os.cpu_count() or 1
+    sources = iter(sources)
+    pending = deque()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        def submit_next():
+            source = next(sources, None)
+            if source is not None:
+                pending.append(pool.submit(prepare, source, imgsz))
+
+        for _ in range(max(prefetch, 1)):
+            submit_next()
+        while pending:
+            item = pending.popleft().result()
+            submit_next()
+            yield item
+
+
+def collate(items):
+    """Stack letterboxed images into one Bx3xHxW batch, padding bottom/right when sizes differ."""
+    h = max(item["chw"].shape[1] for item in items)
+    w = max(item["chw"].shape[2] for item in items)
+    batch = np.full((len(items), 3, h, w), PAD_VALUE, dtype=np.uint8)
+    for i, item in enumerate(items):
+        _, ih, iw = item["chw"].shape
+        batch[i, :, :ih, :iw] = item["chw"]
+    return batch
+
+
+def unletterbox(dets, gain, pad, width, height):
+    """Map Nx6 [x1, y1, x2, y2, conf, cls] detections from letterbox space back to the original image."""
+    boxes = dets[:, :4]
+    boxes[:, [0, 2]] = ((boxes[:, [0, 2]] - pad[0]) / gain[0]).clip(0, width)
+    boxes[:, [1, 3]] = ((boxes[:, [1, 3]] - pad[1]) / gain[1]).clip(0, height)
+    return dets
+
+
+def box_iou(a, b, smaller=False):
+    """
+    IoU matrix between Nx4 and Mx4 [x1, y1, x2, y2] boxes, computed with broadcasting.
+
+    With smaller=True the intersection is divided by the smaller box's area
+    instead (IoS), which is 1 when one box lies inside the other.
+    """
+    a = np.asarray(a, dtype=np.float32).reshape(-1, 4)
+    b = np.asarray(b, dtype=np.float32).reshape(-1, 4)
+    iw = (np.minimum(a[:, None, 2], b[None, :, 2]) - np.maximum(a[:, None, 0], b[None, :, 0])).clip(0)
+    ih = (np.minimum(a[:, None, 3], b[None, :, 3]) - np.maximum(a[:, None, 1], b[None, :, 1])).clip(0)
+    inter = iw * ih
+    area_a = (a[:, 2] - a[:, 0]) * (a[:, 3] - a[:, 1])
+    area_b = (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1])
+    if smaller:
+        union = np.minimum(area_a[:, None], area_b[None, :])
+    else:
+        union = area_a[:, None] + area_b[None, :] - inter
+    return np.divide(inter, union, out=np.zeros_like(inter), where=union > 0)
+
+
+def nms(dets, iou_threshold=NMS_IOU, max_det=MAX_DET, smaller=False):
+    """
+    Class-aware non-maximum suppression of Nx6 [x1, y1, x2, y2, conf, cls] detections.
+
+    The IoU matrix of all candidates is computed once; the greedy pass then only
+    ORs precomputed rows, so the Python loop runs once per kept box. smaller=True
+    suppresses by IoS (see box_iou), which also removes partial boxes lying
+    inside a better one.
+    """
+    dets = dets[np.argsort(-dets[:, 4], kind='stable')]
+    offset = dets[:, 5:6] * MAX_WH
+    iou = box_iou(dets[:, :4] + offset, dets[:, :4] + offset, smaller)
+    suppressed = np.zeros(len(dets), dtype=bool)
+    keep = []
+    for i in range(len(dets)):
+        if suppressed[i]:
+            continue
+        keep.append(i)
+        if len(keep) == max_det:
+            break
+        suppressed |= iou[i] > iou_threshold
+    return dets[keep]
+
+
+class UltralyticsForward:
+    """Run a uint8 Bx3xHxW batch through an ultralytics YOLO model in a single call."""
+
+    def __init__(self, model):
+        self.model = model
+
+    def __call__(self, batch):
+        import torch
+
+        tensor = torch.from_numpy(batch).float().div_(255)
+        results = self.model(tensor, verbose=False)
+        # One device-to-host transfer per image instead of one per box
+        return [r.boxes.data.cpu().numpy().astype(np.float32) for r in results]
+
+
+class OnnxForward:
+    """
+    Run a uint8 Bx3xHxW batch through an exported ONNX graph with ONNX Runtime on CPU.
+
+    Handles both export heads: the default one, whose Bx(4 + classes)xN output
+    gets the same confidence filter and class-aware NMS ultralytics applies, and
+    the NMS-free YOLOv10 head (Bx300x6). Exported with dynamic axes, so the
+    rectangular letterbox sizes work as they do with PyTorch.
+
+    Args:
+        onnx_path: Exported model (see export.py)
+        conf: Drop detections below this confidence, as ultralytics does
+        threads: Intra-op threads (defaults to ONNX Runtime's choice)
+    """
+
+    def __init__(self, onnx_path, conf=CONF_THRESHOLD, threads=None):
+        import onnxruntime as ort
+
+        options = ort.SessionOptions()
+        if threads:
+            options.intra_op_num_threads = threads
+        self.session = ort.InferenceSession(onnx_path, options, providers=["CPUExecutionProvider"])
+        self.input_name = self.session.get_inputs()[0].name
+        self.conf = conf
+
+    def __call__(self, batch):
+        output = self.session.run(None, {self.input_name: batch.astype(np.float32) / 255})[0]
+        if output.shape[2] == 6:
+            # NMS-free head: Bx300x6 [x1, y1, x2, y2, conf, cls]
+            return [dets[dets[:, 4] > self.conf] for dets in output]
+        return [self._postprocess(pred.T) for pred in output]
+
+    def _postprocess(self, pred):
+        """Nx(4 + classes) [cx, cy, w, h, scores...] predictions to Nx6 detections, as ultralytics does."""
+        scores = pred[:, 4:]
+        cls = scores.argmax(axis=1)
+        conf = scores[np.arange(len(pred)), cls]
+        candidates = conf > self.conf
+        xywh, conf, cls = pred[candidates, :4], conf[candidates], cls[candidates]
+        xyxy = np.concatenate([xywh[:, :2] - xywh[:, 2:] / 2, xywh[:, :2] + xywh[:, 2:] / 2], axis=1)
+        return nms(np.concatenate([xyxy, conf[:, None], cls[:, None]], axis=1).astype(np.float32))
+
+
+def backend_model_path(backend="torch", model_path=MODEL_PATH):
+    """Weights file a backend loads: the .pt itself or the ONNX export written next to it."""
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown backend '{backend}', expected one of {BACKENDS}")
+    if backend == "torch":
+        return model_path
+    stem = os.path.splitext(model_path)[0]
+    return f"{stem}-int8.onnx" if backend == "onnx-int8" else f"{stem}.onnx"
+
+
+def load_forward(backend="torch", model_path=MODEL_PATH, threads=None):
+    """
+    Load the detector for a backend and return its batch forward callable.
+
+    This is the one model loader every script goes through. Heavy imports
+    (ultralytics/torch, onnxruntime) happen here rather than at module import, and
+    loaded models are cached per process, keyed by the weights file and its mtime,
+    so repeated calls (and the warm daemon in daemon.py) reuse the same model.
+
+    Args:
+        backend: "torch" (ultralytics), "onnx" or "onnx-int8" (ONNX Runtime, run export.py first)
+        model_path: The .pt weights; ONNX backends load the export next to it
+        threads: CPU threads for the ONNX Runtime session
+    """
+    path = backend_model_path(backend, model_path)
+    if backend != "torch" and not os.path.exists(path):
+        raise FileNotFoundError(f"{path} not found; export it with: python export.py{' --int8' if backend == 'onnx-int8' else ''}")
+
+    key = (backend, os.path.abspath(path), os.path.getmtime(path) if os.path.exists(path) else None, threads)
+    if key not in _FORWARDS:
+        if backend == "torch":
+            from ultralytics import YOLO
+
+            _FORWARDS[key] = UltralyticsForward(YOLO(path))
+        else:
+            _FORWARDS[key] = OnnxForward(path, threads=threads)
+    return _FORWARDS[key]
+
+
+def detect(image_paths, forward, batch_size=8, imgsz=IMG_SIZE, workers=None, prefetch=None, prepare=prepare_image):
+    """
+    Run batched detection over image_paths with decode and letterbox prefetched on a thread pool.
+
+    Args:
+        image_paths: Paths of the images to run on (or decoded frames with prepare=prepare_frame)
+        forward: Callable mapping a uint8 Bx3xHxW batch to a list of Nx6 detection arrays
+        batch_size: Number of images per forward call
+        imgsz: Letterbox size
+        workers: Decode threads (defaults to the CPU count)
+        prefetch: Images decoded ahead of the model (defaults to two batches)
+        prepare: Function turning one entry of image_paths into a prepared item
+
+    Yields:
+        (item, dets): the prepared image dict (without pixels) and its Nx6
+        [x1, y1, x2, y2, conf, cls] detections in original image coordinates
+    """
+    prefetch = prefetch or 2 * batch_size
+    items = []
+
+    def flush():
+        for item, dets in zip(items, forward(collate(items))):
+            item.pop("chw")
+            yield item, unletterbox(dets, item["gain"], item["pad"], item["width"], item["height"])
+        items.clear()
+
+    for item in iter_prepared(image_paths, imgsz, workers, prefetch, prepare):
+        items.append(item)
+        if len(items) == batch_size:
+            yield from flush()
+    if items:
+        yield from flush()
+
+
+class Throughput:
+    """Tiny wall-clock counter for images/sec reporting."""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.count = 0
+
+    def update(self, n=1):
+        self.count += n
+
+    def report(self, label="images"):
+        elapsed = time.perf_counter() - self.start
+        rate = self.count / elapsed if elapsed > 0 else 0.0
+        print(f"Processed {self.count} {label} in {elapsed:.1f}s ({rate:.2f} {label}/s)")
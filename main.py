@@ -1,111 +1,191 @@
 import os
-import json
 import argparse
-from ultralytics import YOLO
-from PIL import Image
 
-def create_coco_annotations(image_dir: str, output_dir: str) -> None:
+from inference import (
+    BACKENDS,
+    CATEGORIES,
+    IMG_SIZE,
+    Throughput,
+    backend_model_path,
+    detect,
+    list_images,
+    load_forward,
+    prepare_frame,
+)
+from coco_writer import CocoWriter
+from detection_cache import DetectionCache, detect_cached
+from detection_store import annotation_lines
+from frame_skip import MAX_REUSE, SKIP_THRESHOLD, FrameSkipper, detect_skipping
+from sharding import detect_sharded
+from tiling import TILE_MODES, TILE_OVERLAP, TILE_SIZE, TilingCostModel, detect_tiled
+from video import is_video, iter_video_frames
+
+def image_record(item, image_id):
+    """COCO image entry for one detected image or video frame."""
+    image_info = {
+        "id": image_id,
+        "file_name": os.path.basename(item["path"]),
+        "width": item["width"],
+        "height": item["height"]
+    }
+    if "frame_index" in item:
+        image_info["frame_index"] = item["frame_index"]
+        image_info["timestamp_ms"] = item["timestamp_ms"]
+    return image_info
+
+def create_coco_annotations(image_dir: str, output_dir: str, batch_size: int = 8,
+                            workers: int = None, imgsz: int = IMG_SIZE, num_shards: int = 1,
+                            compact: bool = False, cache_dir: str = None, cache_max_mb: float = None,
+                            cache_max_age_days: float = None, video_stride: int = 1,
+                            keyframes_only: bool = False, backend: str = "torch",
+                            daemon_socket: str = None, tile: str = "off", tile_size: int = TILE_SIZE,
+                            tile_overlap: float = TILE_OVERLAP, skip_similar: float = None,
+                            max_reuse: int = MAX_REUSE) -> None:
     """
     Create and save COCO format annotations from object detection results.
     
     Args:
-        image_dir: Directory containing the images
+        image_dir: Directory containing the images, or a video file whose frames are annotated
         output_dir: Directory to save the JSON output
+        batch_size: Number of images per forward pass
+        workers: Threads decoding and letterboxing images ahead of the model (defaults to the CPU count)
+        imgsz: Inference size of the long image side
+        num_shards: Worker processes to split the images across; ids match a single-process run
+        compact: Write output.json without indentation
+        cache_dir: Directory of the detection cache; None disables caching
+        cache_max_mb: Evict least recently used cache entries beyond this size
+        cache_max_age_days: Evict cache entries unused for this many days
+        video_stride: For a video, annotate every video_stride-th frame
+        keyframes_only: For a video, only decode and annotate keyframes
+        backend: "torch", or "onnx"/"onnx-int8" for ONNX Runtime on CPU (run export.py first)
+        daemon_socket: Socket of a running daemon.py to submit images to instead of loading
+            the model here (True for daemon.DEFAULT_SOCKET); falls back to in-process
+            detection when no daemon answers
+        tile: Sliced inference for small objects: "off", "on", or "auto" to tile only
+            while the extra detections justify the extra compute (see tiling.TilingCostModel)
+        tile_size: Tile side in frame pixels
+        tile_overlap: Minimum overlap of neighbouring tiles, as a fraction of tile_size
+        skip_similar: Reuse the detections of the last inferred frame for frames whose
+            brightness grid changed by at most this many grey levels (see frame_skip); None runs every frame
+        max_reuse: With skip_similar, frames in a row that may reuse one inferred frame's detections
     """
-    # Initialize COCO format dictionary
-    coco_format = {
-        "images": [],
-        "annotations": [],
-        "categories": []
-    }
-    
-    # Get list of image files
-    image_files = [f for f in os.listdir(image_dir) if f.lower().endswith(('.png', '.jpg', '.jpeg'))]
-    
-    # Load YOLO model only once
-    if image_id == 0:
-        MODEL_PATH = 'vehicle_yolov10/yolov10m2/weights/best.pt'
-        model = YOLO(MODEL_PATH)
-        # COCO categories (id starts from 1)
-        CATEGORIES = [
-            {"id": 1, "name": "Hatchback", "supercategory": "Defect"},
-            {"id": 2, "name": "Sedan", "supercategory": "Defect"},
-            {"id": 3, "name": "SUV", "supercategory": "Defect"},
-            {"id": 4, "name": "MUV", "supercategory": "Defect"},
-            {"id": 5, "name": "Bus", "supercategory": "Defect"},
-            {"id": 6, "name": "Truck", "supercategory": "Defect"},
-            {"id": 7, "name": "Three Wheeler", "supercategory": "Defect"},
-            {"id": 8, "name": "Two Wheeler", "supercategory": "Defect"},
-            {"id": 9, "name": "LCV", "supercategory": "Defect"},
-            {"id": 10, "name": "Mini Bus", "supercategory": "Defect"},
-            {"id": 11, "name": "Mini-truck", "supercategory": "Defect"},
-            {"id": 12, "name": "Tempo-Traveller", "supercategory": "Defect"},
-            {"id": 13, "name": "Bicycle", "supercategory": "Defect"},
-            {"id": 14, "name": "Vans", "supercategory": "Defect"},
-            {"id": 15, "name": "Others", "supercategory": "Defect"}
-        ]
-        YOLO_IDX_TO_CAT_ID = {i: cat["id"] for i, cat in enumerate(CATEGORIES)}
+    if daemon_socket:
+        # Imported only when asked for: the daemon needs Unix sockets, which Windows lacks
+        from daemon import DEFAULT_SOCKET, detect_remote, ping
 
-    # Define your categories here
-    coco_format["categories"] = CATEGORIES
+        daemon_socket = DEFAULT_SOCKET if daemon_socket is True else daemon_socket
+        if not ping(daemon_socket):
+            print(f"No daemon on {daemon_socket}; loading the model in-process")
+            daemon_socket = None
+    cost_model = TilingCostModel(tile)
+    if tile != "off" and (daemon_socket or num_shards > 1):
+        print("Tiling runs in-process; ignoring --daemon/--num_shards")
+    skipper = FrameSkipper(skip_similar, max_reuse) if skip_similar is not None else None
+    if skipper and (tile != "off" or daemon_socket or num_shards > 1):
+        print("Frame skipping needs one in-process stream without tiling; ignoring --skip_similar")
+        skipper = None
+
+    def run_detection(paths):
+        if tile != "off":
+            return detect_tiled(paths, load_forward(backend), batch_size, imgsz, workers, tile_size, tile_overlap,
+                                cost_model)
+        if daemon_socket:
+            # The daemon already has the model loaded and warm
+            return detect_remote(paths, daemon_socket, batch_size, imgsz, backend)
+        if num_shards > 1:
+            # Each worker process loads the model once
+            return detect_sharded(paths, num_shards, batch_size, imgsz, backend=backend)
+        if skipper:
+            return detect_skipping(paths, load_forward(backend), batch_size, imgsz, workers, skipper=skipper)
+        # Load the model only once
+        return detect(paths, load_forward(backend), batch_size, imgsz, workers)
+    
+    cache = None
+    if is_video(image_dir):
+        # Frames decode on a background thread and go straight to the model without
+        # being written out; sharding and the per-file cache do not apply to one stream
+        frames = iter_video_frames(image_dir, video_stride, keyframes_only)
+        if tile != "off":
+            detections = detect_tiled(frames, load_forward(backend), batch_size, imgsz, workers, tile_size,
+                                      tile_overlap, cost_model)
+        elif skipper:
+            detections = detect_skipping(frames, load_forward(backend), batch_size, imgsz, workers, prepare_frame,
+                                         skipper)
+        else:
+            detections = detect(frames, load_forward(backend), batch_size, imgsz, workers, prepare=prepare_frame)
+    else:
+        # Get list of image files
+        image_files = list_images(image_dir)
+        image_paths = [os.path.join(image_dir, f) for f in image_files]
+        if cache_dir:
+            # Cache hits skip decode and inference; an interrupted run resumes from the cache
+            max_bytes = cache_max_mb * 1024 * 1024 if cache_max_mb else None
+            cache = DetectionCache(cache_dir, max_bytes, cache_max_age_days)
+            settings = {"imgsz": imgsz, "backend": backend}
+            if tile != "off":
+                settings.update(tile=tile, tile_size=tile_size, tile_overlap=tile_overlap)
+            if skipper:
+                settings.update(skip_similar=skip_similar, max_reuse=max_reuse)
+            detections = detect_cached(image_paths, cache, run_detection, backend_model_path(backend), settings, workers)
+        else:
+            detections = run_detection(image_paths)
     
     image_id = 0
     annotation_id = 0
+    throughput = Throughput()
     
-    for image_file in image_files:
-        image_path = os.path.join(image_dir, image_file)
-        
-        # Add image info
-        image_info = {
-            "id": image_id,
-            "file_name": image_file,
-            "width": 1920,
-            "height": 1080
-        }
-        coco_format["images"].append(image_info)
-        
-        # Get image size
-        with Image.open(image_path) as im:
-            width, height = im.size
-        # Run inference
-        results = model(image_path)
-        for r in results:
-            boxes = r.boxes
-            for box in boxes:
-                x1, y1, x2, y2 = box.xyxy[0].tolist()
-                w = x2 - x1
-                h = y2 - y1
-                area = w * h
-                class_idx = int(box.cls[0].item())
-                category_id = YOLO_IDX_TO_CAT_ID.get(class_idx, 15)  # fallback to 'Others'
-                annotation = {
-                    "id": annotation_id,
-                    "image_id": image_id,
-                    "category_id": category_id,
-                    "bbox": [x1, y1, w, h],
-                    "area": area,
-                    "segmentation": [],
-                    "iscrowd": 0
-                }
-                coco_format["annotations"].append(annotation)
-                annotation_id += 1
-        
-        image_id += 1
-    
-    # Save annotations to JSON file
+    # Stream images and annotations to disk as results arrive
     output_file = os.path.join(output_dir, 'output.json')
     try:
-        with open(output_file, 'w') as f:
-            json.dump(coco_format, f, indent=2)
-    except Exception as e:
-        print(f"Error saving JSON file: {str(e)}")
+        with CocoWriter(output_file, CATEGORIES, indent=None if compact else 2) as writer:
+            for item, dets in detections:
+                # Add image info
+                writer.add_image(image_record(item, image_id))
+
+                # Serialized straight from the detection arrays, no dict per box
+                writer.add_annotation_lines(annotation_lines(dets[:, :4], dets[:, 5], image_id, annotation_id))
+                annotation_id += len(dets)
+            
+                image_id += 1
+                throughput.update()
+    finally:
+        if cache is not None:
+            # Commit what was processed so a rerun resumes from here
+            cache.close()
+
+    throughput.report()
+    cost_model.report()
+    if skipper:
+        skipper.report()
+    if cache is not None:
+        cache.report()
 
 
 # NOTE: Please do not change the code below!
 def main():
     parser = argparse.ArgumentParser(description='Create COCO format annotations from object detection results')
-    parser.add_argument('--image_dir', required=True, help='Directory containing input images')
+    parser.add_argument('--image_dir', required=True, help='Directory containing input images, or a video file')
     parser.add_argument('--output_dir', required=True, help='Directory to save the COCO format JSON file')
+    parser.add_argument('--batch_size', type=int, default=8, help='Images per forward pass')
+    parser.add_argument('--workers', type=int, default=None, help='Image decode threads (default: CPU count)')
+    parser.add_argument('--imgsz', type=int, default=IMG_SIZE, help='Inference size of the long image side')
+    parser.add_argument('--num_shards', type=int, default=1, help='Worker processes, each loading the model once')
+    parser.add_argument('--compact', action='store_true', help='Write output.json without indentation')
+    parser.add_argument('--cache_dir', default=None, help='Detection cache directory (enables caching and resume)')
+    parser.add_argument('--cache_max_mb', type=float, default=None, help='Size bound of the detection cache')
+    parser.add_argument('--cache_max_age_days', type=float, default=None, help='Age bound of the detection cache')
+    parser.add_argument('--video_stride', type=int, default=1, help='Annotate every Nth video frame')
+    parser.add_argument('--keyframes_only', action='store_true', help='Only annotate video keyframes')
+    parser.add_argument('--backend', default='torch', choices=BACKENDS, help='Inference backend (onnx*: run export.py first)')
+    parser.add_argument('--tile', default='off', choices=TILE_MODES, help='Sliced inference for small objects')
+    parser.add_argument('--tile_size', type=int, default=TILE_SIZE, help='Tile side in frame pixels')
+    parser.add_argument('--tile_overlap', type=float, default=TILE_OVERLAP, help='Overlap of neighbouring tiles')
+    parser.add_argument('--daemon', nargs='?', const=True, default=None,
+                        help='Submit images to a warm daemon.py on this socket (default socket if no path given)')
+    parser.add_argument('--skip_similar', type=float, nargs='?', const=SKIP_THRESHOLD, default=None,
+                        help=f'Reuse detections for near-identical frames within this many grey levels '
+                             f'(default {SKIP_THRESHOLD} if no value given)')
+    parser.add_argument('--max_reuse', type=int, default=MAX_REUSE, help='Frames in a row reusing one inference')
 
     args = parser.parse_args()
 
@@ -113,7 +193,13 @@ def main():
     os.makedirs(args.output_dir, exist_ok=True)
 
     # Generate and save COCO format annotations
-    create_coco_annotations(args.image_dir, args.output_dir)
+    create_coco_annotations(args.image_dir, args.output_dir, batch_size=args.batch_size, workers=args.workers,
+                            imgsz=args.imgsz, num_shards=args.num_shards, compact=args.compact,
+                            cache_dir=args.cache_dir, cache_max_mb=args.cache_max_mb,
+                            cache_max_age_days=args.cache_max_age_days, video_stride=args.video_stride,
+                            keyframes_only=args.keyframes_only, backend=args.backend, daemon_socket=args.daemon,
+                            tile=args.tile, tile_size=args.tile_size, tile_overlap=args.tile_overlap,
+                            skip_similar=args.skip_similar, max_reuse=args.max_reuse)
 
 if __name__ == "__main__":
     main() 
\ No newline at end of file
@@ -1,13 +1,18 @@
 import os
-import json
-from ultralytics import YOLO
-from PIL import Image
+
+from detection_store import DetectionStore
+from inference import detect, load_forward
 
 # Model and data paths
 MODEL_PATH = 'vehicle_yolov10/yolov10m2/weights/best.pt'
 IMAGE_DIR = r"C:\Users\Rohit\Videos\testing\val\images\val-images-300"
 OUTPUT_JSON = 'output.json'
 NUM_IMAGES = 300
+COMPACT_JSON = False  # set True to write OUTPUT_JSON without indentation
+BACKEND = 'torch'  # 'onnx' / 'onnx-int8' run ONNX Runtime on CPU (python export.py [--int8] first)
+BATCH_SIZE = 8
+DAEMON_SOCKET = None  # socket of a running daemon.py to reuse its warm model, e.g. daemon.DEFAULT_SOCKET
+YOLO_LABELS_DIR = None  # also write the detections as YOLO label files here, e.g. for pseudo-labelling
 
 # COCO categories (id starts from 1)
 CATEGORIES = [
@@ -28,57 +33,31 @@ CATEGORIES = [
     {"id": 15, "name": "Others", "supercategory": "Defect"}
 ]
 
-# Map YOLO class index to COCO category id (YOLO: 0-based, COCO: 1-based)
-YOLO_IDX_TO_CAT_ID = {i: cat["id"] for i, cat in enumerate(CATEGORIES)}
-
 # Get first 300 image filenames (sorted)
 image_files = sorted([f for f in os.listdir(IMAGE_DIR) if f.lower().endswith((".png", ".jpg", ".jpeg"))])[:NUM_IMAGES]
 
-# Load YOLO model
-model = YOLO(MODEL_PATH)
-
-# Prepare COCO output structure
-coco = {
-    "images": [],
-    "categories": CATEGORIES,
-    "annotations": []
-}
-
-annotation_id = 1
-for img_id, img_name in enumerate(image_files):
-    img_path = os.path.join(IMAGE_DIR, img_name)
-    # Get image size
-    with Image.open(img_path) as im:
-        width, height = im.size
-    # Add image info
-    coco["images"].append({
-        "file_name": img_name,
-        "height": height,
-        "width": width,
-        "id": img_id
-    })
-    # Run inference
-    results = model(img_path)
-    for r in results:
-        boxes = r.boxes
-        for box in boxes:
-            x1, y1, x2, y2 = box.xyxy[0].tolist()
-            w = x2 - x1
-            h = y2 - y1
-            area = w * h
-            class_idx = int(box.cls[0].item())
-            category_id = YOLO_IDX_TO_CAT_ID.get(class_idx, 15)  # fallback to 'Others'
-            coco["annotations"].append({
-                "id": annotation_id,
-                "image_id": img_id,
-                "bbox": [x1, y1, w, h],
-                "area": area,
-                "category_id": category_id
-            })
-            annotation_id += 1
-
-# Save to JSON
-with open(OUTPUT_JSON, "w") as f:
-    json.dump(coco, f, indent=2)
+image_paths = [os.path.join(IMAGE_DIR, f) for f in image_files]
+detections = None
+if DAEMON_SOCKET:
+    # Imported only when configured: the daemon needs Unix sockets, which Windows lacks
+    from daemon import detect_remote, ping
+
+    if ping(DAEMON_SOCKET):
+        # The daemon already has the model loaded; skip the import and load here
+        detections = detect_remote(image_paths, DAEMON_SOCKET, BATCH_SIZE, backend=BACKEND)
+if detections is None:
+    # Load the model for the selected backend
+    detections = detect(image_paths, load_forward(BACKEND, MODEL_PATH), BATCH_SIZE)
+
+# Collect the results in columnar arrays: one bulk copy per image, no dict per box
+store = DetectionStore()
+# Run batched inference; image sizes come from the decoded images
+for (item, dets), img_name in zip(detections, image_files):
+    store.add(store.add_image(img_name, item["width"], item["height"]), dets)
+
+# Image ids from 0, annotation ids from 1; the score ranks the detections for evaluate.py
+store.write_coco(OUTPUT_JSON, CATEGORIES, indent=None if COMPACT_JSON else 2, scores=True)
+if YOLO_LABELS_DIR:
+    store.write_yolo(YOLO_LABELS_DIR)
 
 print(f"Saved results to {OUTPUT_JSON}")
@@ -0,0 +1,303 @@
+import os
+import json
+import time
+import queue
+import argparse
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeout
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import cv2
+import numpy as np
+
+from detection_store import annotation_lines
+from inference import BACKENDS, IMG_SIZE, collate, load_forward, prepare_frame, unletterbox
+from stream import StageStats
+
+MAX_BATCH = 8
+MAX_WAIT_MS = 10.0  # how long the first request of a batch waits for company
+REQUEST_TIMEOUT = 30.0  # seconds before a request is answered with 504
+MAX_BODY_BYTES = 50 * 1024 * 1024
+
+
+class MicroBatcher:
+    """
+    Coalesce concurrent single-image requests into batches for one forward call.
+
+    A dispatcher thread takes the first waiting image, then keeps collecting until
+    max_batch images are queued or max_wait_ms has passed since the first one,
+    and hands the batch to a pool of worker threads. It only starts a batch once
+    a worker is free, so under load requests pile up into full batches instead of
+    queueing many small ones. A request whose future was cancelled (its HTTP
+    request timed out) while queued is skipped.
+
+    Args:
+        forward: Callable mapping a uint8 Bx3xHxW batch to a list of Nx6 detection arrays
+        max_batch: Largest batch sent to the model
+        max_wait_ms: Longest a queued image waits for the batch to fill
+        workers: Batches processed concurrently; the forward call itself is
+            serialized when the model is not thread-safe (PyTorch)
+        serialize: Run one forward call at a time
+    """
+
+    def __init__(self, forward, max_batch=MAX_BATCH, max_wait_ms=MAX_WAIT_MS, workers=1, serialize=True):
+        self.forward = forward
+        self.max_batch = max(max_batch, 1)
+        self.max_wait = max_wait_ms / 1000
+        self.pending = queue.Queue()
+        self.pool = ThreadPoolExecutor(max_workers=max(workers, 1))
+        self.free_workers = threading.Semaphore(max(workers, 1))
+        self.forward_lock = threading.Lock() if serialize else None
+        self.stats = {name: StageStats(name) for name in ("queue_wait", "batch_inference")}
+        self.batches = 0
+        self.batched_images = 0
+        self.skipped = 0
+        self.closed = False
+        self.thread = threading.Thread(target=self._dispatch, daemon=True)
+        self.thread.start()
+
+    def submit(self, item):
+        """Queue one prepared image (see inference.prepare_frame); the future resolves to its Nx6 detections."""
+        future = Future()
+        self.pending.put((item, future, time.perf_counter()))
+        return future
+
+    def _dispatch(self):
+        while not self.closed:
+            if not self.free_workers.acquire(timeout=0.1):
+                continue
+            try:
+                batch = [self.pending.get(timeout=0.1)]
+            except queue.Empty:
+                self.free_workers.release()
+                continue
+            # Take what is already queued, then wait for more only until the deadline
+            deadline = batch[0][2] + self.max_wait
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.perf_counter()
+                try:
+                    batch.append(self.pending.get(timeout=remaining) if remaining > 0 else self.pending.get_nowait())
+                except queue.Empty:
+                    break
+            # Drop requests that timed out while queued
+            live = [entry for entry in batch if entry[1].set_running_or_notify_cancel()]
+            self.skipped += len(batch) - len(live)
+            if live:
+                self.pool.submit(self._run, live)
+            else:
+                self.free_workers.release()
+
+    def _run(self, batch):
+        started = time.perf_counter()
+        for _, _, queued in batch:
+            self.stats["queue_wait"].record(started - queued)
+        try:
+            images = collate([item for item, _, _ in batch])
+            if self.forward_lock:
+                with self.forward_lock:
+                    outputs = self.forward(images)
+            else:
+                outputs = self.forward(images)
+            self.stats["batch_inference"].record(time.perf_counter() - started)
+            self.batches += 1
+            self.batched_images += len(batch)
+            for (item, future, _), dets in zip(batch, outputs):
+                future.set_result(unletterbox(dets, item["gain"], item["pad"], item["width"], item["height"]))
+        except Exception as e:
+            for _, future, _ in batch:
+                future.set_exception(e)
+        finally:
+            self.free_workers.release()
+
+    def depth(self):
+        return self.pending.qsize()
+
+    def close(self):
+        self.closed = True
+        self.thread.join()
+        self.pool.shutdown()
+
+
+def coco_annotations(dets, image_id=0, first_annotation_id=0):
+    """Nx6 detections as a JSON array of the annotations main.py writes, plus the detection score."""
+    return "[" + ",".join(annotation_lines(dets[:, :4], dets[:, 5], image_id, first_annotation_id,
+                                           scores=dets[:, 4])) + "]"
+
+
+def _int_param(params, name):
+    try:
+        return int(params.get(name, 0))
+    except ValueError:
+        raise ValueError(f"{name} must be an integer, got {params[name]!r}") from None
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass  # one line per request is too much at batch rates; see /metrics
+
+    def do_GET(self):
+        path = urlparse(self.path).path
+        if path == "/metrics":
+            self._reply(200, self.server.metrics().encode(), "text/plain; version=0.0.4")
+        elif path == "/health":
+            self._json(200, {"ok": True})
+        else:
+            self._json(404, {"error": "not found"})
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        if url.path != "/detect":
+            self._json(404, {"error": "not found"})
+            return
+        server = self.server
+        start = time.perf_counter()
+        server.count("requests")
+        try:
+            params = {k: v[-1] for k, v in parse_qs(url.query).items()}
+            body = self._read_body()
+            # Everything that can make a request invalid is checked before it costs a forward pass
+            image_id = _int_param(params, "image_id")
+            first_annotation_id = _int_param(params, "first_annotation_id")
+            image, file_name = self._read_image(body, params)
+            future = server.batcher.submit(prepare_frame({"image": image}, server.imgsz))
+            try:
+                dets = future.result(timeout=server.request_timeout)
+            except FutureTimeout:
+                future.cancel()
+                server.count("timeouts")
+                self._json(504, {"error": f"timed out after {server.request_timeout}s"})
+                return
+            height, width = image.shape[:2]
+            image_info = {"id": image_id, "file_name": file_name, "width": width, "height": height}
+            # The annotations are already JSON; splice them in rather than building a dict per box
+            body = '{"image":%s,"annotations":%s}' % (
+                json.dumps(image_info, separators=(",", ":")),
+                coco_annotations(dets, image_id, first_annotation_id))
+            self._reply(200, body.encode(), "application/json")
+            server.latency.record(time.perf_counter() - start)
+        except ValueError as e:
+            server.count("errors")
+            self._json(400, {"error": str(e)})
+        except Exception as e:
+            server.count("errors")
+            self._json(500, {"error": f"{type(e).__name__}: {e}"})
+
+    def _read_body(self):
+        length = int(self.headers.get("Content-Length", 0))
+        if length == 0:
+            raise ValueError("empty body")
+        if length > MAX_BODY_BYTES:
+            raise ValueError(f"body larger than {MAX_BODY_BYTES} bytes")
+        return self.rfile.read(length)
+
+    def _read_image(self, body, params):
+        """Decode the posted image: raw JPEG/PNG bytes, or JSON {"image_path": ...} for a local file."""
+        if self.headers.get("Content-Type", "").startswith("application/json"):
+            try:
+                path = json.loads(body)["image_path"]
+            except (KeyError, TypeError, ValueError) as e:  # ValueError covers json.JSONDecodeError
+                raise ValueError(f'expected a JSON object with "image_path": {type(e).__name__}: {e}') from e
+            if not isinstance(path, str):
+                raise ValueError('"image_path" must be a string')
+            image = cv2.imread(path, cv2.IMREAD_COLOR)
+            file_name = os.path.basename(path)
+        else:
+            image = cv2.imdecode(np.frombuffer(body, dtype=np.uint8), cv2.IMREAD_COLOR)
+            file_name = params.get("file_name", "")
+        if image is None:
+            raise ValueError("could not decode image")
+        return image, file_name
+
+    def _json(self, status, payload):
+        self._reply(status, json.dumps(payload).encode(), "application/json")
+
+    def _reply(self, status, body, content_type):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class DetectionServer(ThreadingHTTPServer):
+    """
+    HTTP front end of a MicroBatcher.
+
+    POST /detect with raw image bytes (or JSON {"image_path": ...}) returns
+    {"image": ..., "annotations": [...]} in main.py's COCO format; GET /metrics
+    serves Prometheus-style counters and latency quantiles.
+
+    Args:
+        address: (host, port) to listen on
+        batcher: MicroBatcher running the model
+        imgsz: Letterbox size
+        request_timeout: Seconds a request may wait for its detections before a 504
+    """
+
+    daemon_threads = True
+
+    def __init__(self, address, batcher, imgsz=IMG_SIZE, request_timeout=REQUEST_TIMEOUT):
+        super().__init__(address, _Handler)
+        self.batcher = batcher
+        self.imgsz = imgsz
+        self.request_timeout = request_timeout
+        self.counters = {"requests": 0, "errors": 0, "timeouts": 0}
+        self.counter_lock = threading.Lock()
+        self.latency = StageStats("request")
+
+    def count(self, name):
+        with self.counter_lock:
+            self.counters[name] += 1
+
+    def metrics(self):
+        batcher = self.batcher
+        lines = [f"detector_{name}_total {value}" for name, value in self.counters.items()]
+        lines += [
+            f"detector_batches_total {batcher.batches}",
+            f"detector_batched_images_total {batcher.batched_images}",
+            f"detector_mean_batch_size {batcher.batched_images / batcher.batches if batcher.batches else 0:.3f}",
+            f"detector_skipped_total {batcher.skipped}",
+            f"detector_queue_depth {batcher.depth()}",
+        ]
+        for stats in [self.latency, *batcher.stats.values()]:
+            with stats.lock:
+                samples = np.array(stats.samples)
+            for q in (0.5, 0.95, 0.99):
+                value = np.quantile(samples, q) if len(samples) else float("nan")
+                lines.append(f'detector_{stats.name}_seconds{{quantile="{q}"}} {value:.6f}')
+            lines.append(f"detector_{stats.name}_seconds_count {stats.count}")
+        return "\n".join(lines) + "\n"
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve vehicle detection over HTTP with dynamic micro-batching')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--backend', default='torch', choices=BACKENDS, help='Inference backend (onnx*: run export.py first)')
+    parser.add_argument('--imgsz', type=int, default=IMG_SIZE, help='Inference size of the long image side')
+    parser.add_argument('--max_batch', type=int, default=MAX_BATCH, help='Largest micro-batch')
+    parser.add_argument('--max_wait_ms', type=float, default=MAX_WAIT_MS, help='Longest wait for a batch to fill')
+    parser.add_argument('--workers', type=int, default=2, help='Batches processed concurrently')
+    parser.add_argument('--timeout', type=float, default=REQUEST_TIMEOUT, help='Request timeout in seconds')
+    args = parser.parse_args()
+
+    forward = load_forward(args.backend)
+    # ONNX Runtime sessions can run concurrently; the ultralytics model cannot
+    batcher = MicroBatcher(forward, args.max_batch, args.max_wait_ms, args.workers, serialize=args.backend == "torch")
+    server = DetectionServer((args.host, args.port), batcher, args.imgsz, args.timeout)
+    print(f"Serving on http://{args.host}:{args.port} (POST /detect, GET /metrics)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        batcher.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+import os
+import multiprocessing as mp
+
+from inference import IMG_SIZE, MODEL_PATH, detect, load_forward
+
+# Per-process state, populated once by _init_worker
+_FORWARD = None
+_SETTINGS = {}
+
+
+def _init_worker(model_path, backend, batch_size, imgsz, threads):
+    """Load the model once per worker process and split the CPU between shards."""
+    global _FORWARD
+    if backend == "torch":
+        # ONNX Runtime gets its thread count from load_forward; ONNX workers must not need torch
+        import torch
+
+        torch.set_num_threads(threads)
+    _FORWARD = load_forward(backend, model_path, threads)
+    _SETTINGS.update(batch_size=batch_size, imgsz=imgsz, workers=threads)
+
+
+def _run_chunk(image_paths):
+    """Detect on one chunk of images inside a worker and return picklable results."""
+    return list(detect(image_paths, _FORWARD, _SETTINGS["batch_size"], _SETTINGS["imgsz"], _SETTINGS["workers"]))
+
+
+def chunk_paths(image_paths, chunk_size):
+    """Split image_paths into consecutive chunks of at most chunk_size paths."""
+    return [image_paths[i:i + chunk_size] for i in range(0, len(image_paths), chunk_size)]
+
+
+def detect_sharded(image_paths, num_shards, batch_size=8, imgsz=IMG_SIZE, model_path=MODEL_PATH, chunk_size=None,
+                   backend="torch"):
+    """
+    Run detection across num_shards worker processes, yielding results in input order.
+
+    Images are handed out in consecutive chunks so faster workers pick up more of
+    them, and results are re-sequenced with an ordered imap so the caller can assign
+    image and annotation ids exactly as a single-process run would.
+
+    Args:
+        image_paths: Paths of the images to run on
+        num_shards: Number of worker processes, each with its own model copy
+        batch_size: Number of images per forward pass inside a worker
+        imgsz: Letterbox size
+        model_path: Weights every worker loads
+        chunk_size: Images per task (defaults to four batches)
+        backend: Inference backend every worker loads (see inference.load_forward)
+
+    Yields:
+        (item, dets) pairs, as inference.detect does
+    """
+    chunk_size = chunk_size or 4 * batch_size
+    threads = max(1, (os.cpu_count() or 1) // num_shards)
+    # spawn: forking a parent that already initialised torch threads can deadlock
+    ctx = mp.get_context("spawn")
+    with ctx.Pool(num_shards, initializer=_init_worker,
+                  initargs=(model_path, backend, batch_size, imgsz, threads)) as pool:
+        for results in pool.imap(_run_chunk, chunk_paths(image_paths, chunk_size)):
+            yield from results
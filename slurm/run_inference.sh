@@ -0,0 +1,22 @@
+#!/bin/bash
+#SBATCH --job-name=vehicle_infer
+#SBATCH --array=0-7
+#SBATCH --cpus-per-task=6
+#SBATCH --mem=16G
+#SBATCH --time=04:00:00
+#SBATCH --output=logs/%x-%A_%a.out
+
+# Activate your conda environment
+
+
+# One array task per node, all claiming chunks from the same queue on the shared
+# filesystem. Create the queue once beforehand and reduce it after the array:
+#   python work_queue.py init --image_dir /shared/images --queue_dir /shared/queue
+#   sbatch slurm/run_inference.sh
+#   python work_queue.py reduce --queue_dir /shared/queue --output_dir results/
+# Resubmitting the array resumes: finished chunks are kept, expired claims re-queued.
+# Chunks that raised are listed by `work_queue.py status`; move queue/failed/*.json
+# back to queue/todo/ to retry them.
+QUEUE_DIR=${QUEUE_DIR:-/shared/queue}
+
+python work_queue.py work --queue_dir "$QUEUE_DIR" --workers "$SLURM_CPUS_PER_TASK"
@@ -9,5 +9,9 @@
 # Activate your conda environment
 
 
+# Decode and resize the dataset once into the shared cache (a no-op when it is
+# up to date), so every epoch and every job of a sweep reads the memory map
+python train_cache.py
+
 # Run YOLOv10m training
 python train.py
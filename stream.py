@@ -0,0 +1,326 @@
+import os
+import time
+import queue
+import argparse
+import threading
+from collections import deque
+
+import cv2
+import numpy as np
+
+from inference import (
+    BACKENDS,
+    CATEGORIES,
+    IMG_SIZE,
+    collate,
+    load_forward,
+    prepare_frame,
+    unletterbox,
+)
+from coco_writer import CocoWriter
+from detection_store import annotation_lines
+
+QUEUE_SIZE = 4  # frames buffered between stages; small so a slow model sees fresh frames
+LATENCY_WINDOW = 10000  # latency samples kept per stage for the percentiles
+RECONNECT_DELAY = 2.0  # seconds to wait before reopening a dropped stream
+
+
+class DropOldestQueue:
+    """
+    Bounded FIFO between two stages that never blocks the producer.
+
+    When the queue is full the oldest item is discarded and counted, so a consumer
+    that falls behind always works on the most recent frames instead of building
+    up unbounded latency.
+    """
+
+    def __init__(self, maxsize=QUEUE_SIZE):
+        self.maxsize = max(maxsize, 1)
+        self.items = deque()
+        self.cond = threading.Condition()
+        self.dropped = 0
+        self.closed = False
+
+    def put(self, item):
+        with self.cond:
+            if len(self.items) >= self.maxsize:
+                self.items.popleft()
+                self.dropped += 1
+            self.items.append(item)
+            self.cond.notify()
+
+    def get_batch(self, max_items=1):
+        """Wait for at least one item and return up to max_items; an empty list means closed and drained."""
+        with self.cond:
+            while not self.items and not self.closed:
+                self.cond.wait()
+            return [self.items.popleft() for _ in range(min(max_items, len(self.items)))]
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+
+
+class StageStats:
+    """Count and latency percentiles of one pipeline stage."""
+
+    def __init__(self, name):
+        self.name = name
+        self.count = 0
+        self.samples = deque(maxlen=LATENCY_WINDOW)
+        self.lock = threading.Lock()
+
+    def record(self, seconds, n=1):
+        with self.lock:
+            self.count += n
+            self.samples.extend([seconds] * n)
+
+    def summary(self):
+        with self.lock:
+            samples = np.array(self.samples) * 1000
+        if not len(samples):
+            return f"{self.name}: no samples"
+        p50, p95, p99 = np.percentile(samples, [50, 95, 99])
+        return (f"{self.name}: n={self.count} p50={p50:.1f}ms p95={p95:.1f}ms "
+                f"p99={p99:.1f}ms max={samples.max():.1f}ms")
+
+
+def check_source(source):
+    """Raise for a source that is neither an existing path nor a URL; it would be retried as a stream forever."""
+    if "://" not in source and not os.path.exists(source):
+        raise FileNotFoundError(f"{source} is neither an existing file nor a stream URL")
+
+
+class StreamPipeline:
+    """
+    Capture -> inference -> sink pipeline for a live stream, one thread per stage.
+
+    Capture feeds inference through a DropOldestQueue: when inference falls behind,
+    capture keeps reading (so the camera/RTSP buffer never backs up) and the oldest
+    queued frames are dropped before they cost a forward pass. Inference feeds the
+    sink through a blocking bounded queue, so a slow sink holds inference back
+    (and with it the frames it takes) instead of discarding frames already inferred.
+    Latency is recorded per stage and end to end, along with the dropped frames.
+
+    Args:
+        source: Stream URL (rtsp://, http://, ...) or a local video file standing in for one
+        forward: Callable mapping a uint8 Bx3xHxW batch to a list of Nx6 detection arrays
+        sink: Callable receiving (frame, dets) for every frame that made it through
+        batch_size: Maximum frames per forward call; batches only form from frames already queued
+        imgsz: Letterbox size
+        queue_size: Capacity of each inter-stage queue
+        realtime: Pace a local file at its native frame rate, as a camera would deliver it
+        max_frames: Stop after capturing this many frames (None: until the stream ends)
+    """
+
+    def __init__(self, source, forward, sink, batch_size=1, imgsz=IMG_SIZE, queue_size=QUEUE_SIZE,
+                 realtime=True, max_frames=None):
+        self.source = source
+        self.forward = forward
+        self.sink = sink
+        self.batch_size = batch_size
+        self.imgsz = imgsz
+        self.realtime = realtime
+        self.max_frames = max_frames
+        check_source(source)
+        self.is_file = os.path.isfile(source)
+
+        self.frames = DropOldestQueue(queue_size)
+        self.results = queue.Queue(max(queue_size, 1))
+        self.inference_done = threading.Event()
+        self.stop_event = threading.Event()
+        self.errors = []
+        self.captured = 0
+        self.stats = {
+            name: StageStats(name)
+            for name in ("queue_wait", "preprocess", "inference", "sink", "end_to_end")
+        }
+
+    def _open(self):
+        cap = cv2.VideoCapture(self.source)
+        if not self.is_file:
+            cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)  # keep the backend from queueing stale frames
+        return cap
+
+    def _capture(self):
+        cap = self._open()
+        if not cap.isOpened():
+            # Only a stream that opened once is worth reconnecting to
+            cap.release()
+            self.frames.close()
+            raise ValueError(f"Could not open {self.source}")
+        fps = cap.get(cv2.CAP_PROP_FPS) or 0.0
+        start = time.perf_counter()
+        try:
+            while not self.stop_event.is_set():
+                if self.max_frames is not None and self.captured >= self.max_frames:
+                    break
+                if self.is_file and self.realtime and fps:
+                    # Replay at the native rate: frame i is not available before i / fps
+                    delay = start + self.captured / fps - time.perf_counter()
+                    if delay > 0:
+                        time.sleep(delay)
+                ok, image = cap.read()
+                if not ok:
+                    if self.is_file:
+                        break
+                    print(f"Stream {self.source} dropped; reconnecting in {RECONNECT_DELAY:.0f}s")
+                    cap.release()
+                    time.sleep(RECONNECT_DELAY)
+                    cap = self._open()
+                    continue
+                index = self.captured
+                self.captured += 1
+                self.frames.put({
+                    "image": image,
+                    "path": f"frame_{index:08d}.jpg",
+                    "frame_index": index,
+                    "timestamp_ms": round(index * 1000.0 / fps, 3) if self.is_file and fps else round(time.time() * 1000, 3),
+                    "captured_at": time.perf_counter(),
+                })
+        finally:
+            cap.release()
+            self.frames.close()
+
+    def _infer(self):
+        try:
+            while True:
+                frames = self.frames.get_batch(self.batch_size)
+                if not frames:
+                    break
+                started = time.perf_counter()
+                for frame in frames:
+                    self.stats["queue_wait"].record(started - frame["captured_at"])
+
+                items = [prepare_frame(frame, self.imgsz) for frame in frames]
+                prepared = time.perf_counter()
+                self.stats["preprocess"].record((prepared - started) / len(items), len(items))
+
+                outputs = self.forward(collate(items))
+                done = time.perf_counter()
+                self.stats["inference"].record((done - prepared) / len(items), len(items))
+
+                for item, dets in zip(items, outputs):
+                    item.pop("chw")
+                    self._put_result((item, unletterbox(dets, item["gain"], item["pad"], item["width"], item["height"])))
+        finally:
+            self.inference_done.set()
+
+    def _put_result(self, result):
+        # Blocks while the sink is behind; gives up only when the pipeline is stopping
+        while not self.stop_event.is_set():
+            try:
+                self.results.put(result, timeout=0.5)
+                return
+            except queue.Full:
+                continue
+
+    def _sink(self):
+        while True:
+            try:
+                item, dets = self.results.get(timeout=0.5)
+            except queue.Empty:
+                # Results are all put before inference_done is set, so empty after it means drained
+                if self.inference_done.is_set() and self.results.empty():
+                    break
+                continue
+            started = time.perf_counter()
+            self.sink(item, dets)
+            done = time.perf_counter()
+            self.stats["sink"].record(done - started)
+            self.stats["end_to_end"].record(done - item["captured_at"])
+
+    def _run_stage(self, target):
+        try:
+            target()
+        except Exception as e:
+            self.errors.append(e)
+            self.stop_event.set()
+            # Unblock the other stages so the pipeline can shut down
+            self.frames.close()
+            self.inference_done.set()
+
+    def report(self):
+        print(f"Captured {self.captured} frames; dropped {self.frames.dropped} before inference")
+        for stats in self.stats.values():
+            print(f"  {stats.summary()}")
+
+    def run(self, duration=None, report_every=None):
+        """Run until the stream ends, duration seconds pass or Ctrl-C; re-raises a stage's error."""
+        threads = [threading.Thread(target=self._run_stage, args=(target,), daemon=True)
+                   for target in (self._capture, self._infer, self._sink)]
+        for thread in threads:
+            thread.start()
+
+        start = last_report = time.perf_counter()
+        try:
+            while any(thread.is_alive() for thread in threads):
+                threads[-1].join(timeout=0.5)
+                now = time.perf_counter()
+                if duration is not None and now - start >= duration:
+                    self.stop_event.set()
+                if report_every and now - last_report >= report_every:
+                    self.report()
+                    last_report = now
+        except KeyboardInterrupt:
+            print("Stopping stream")
+            self.stop_event.set()
+            for thread in threads:
+                thread.join()
+        if self.errors:
+            raise self.errors[0]
+        self.report()
+
+
+class CocoSink:
+    """Append every processed frame to a COCO file through CocoWriter."""
+
+    def __init__(self, writer):
+        self.writer = writer
+        self.image_id = 0
+        self.annotation_id = 0
+
+    def __call__(self, item, dets):
+        self.writer.add_image({
+            "id": self.image_id,
+            "file_name": item["path"],
+            "width": item["width"],
+            "height": item["height"],
+            "frame_index": item["frame_index"],
+            "timestamp_ms": item["timestamp_ms"]
+        })
+        self.writer.add_annotation_lines(annotation_lines(dets[:, :4], dets[:, 5], self.image_id, self.annotation_id,
+                                                          scores=dets[:, 4]))
+        self.annotation_id += len(dets)
+        self.image_id += 1
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run vehicle detection on a live stream with bounded, frame-dropping queues')
+    parser.add_argument('--source', required=True, help='Stream URL, or a video file replayed at its native frame rate')
+    parser.add_argument('--output_dir', required=True, help='Directory to save the COCO format JSON file')
+    parser.add_argument('--batch_size', type=int, default=1, help='Maximum frames per forward pass')
+    parser.add_argument('--imgsz', type=int, default=IMG_SIZE, help='Inference size of the long image side')
+    parser.add_argument('--queue_size', type=int, default=QUEUE_SIZE, help='Frames buffered between stages')
+    parser.add_argument('--no_realtime', action='store_true', help='Read a local file as fast as possible')
+    parser.add_argument('--max_frames', type=int, default=None, help='Stop after this many captured frames')
+    parser.add_argument('--duration', type=float, default=None, help='Stop after this many seconds')
+    parser.add_argument('--backend', default='torch', choices=BACKENDS, help='Inference backend (onnx*: run export.py first)')
+    parser.add_argument('--report_every', type=float, default=10.0, help='Seconds between latency reports')
+    args = parser.parse_args()
+    try:
+        check_source(args.source)
+    except FileNotFoundError as e:
+        parser.error(str(e))
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    forward = load_forward(args.backend)
+    with CocoWriter(os.path.join(args.output_dir, 'output.json'), CATEGORIES) as writer:
+        pipeline = StreamPipeline(args.source, forward, CocoSink(writer), args.batch_size, args.imgsz,
+                                  args.queue_size, not args.no_realtime, args.max_frames)
+        pipeline.run(args.duration, args.report_every)
+
+
+if __name__ == "__main__":
+    main()
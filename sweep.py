@@ -0,0 +1,344 @@
+"""
+Hyperparameter sweep around train.py with early termination by successive halving.
+
+    python sweep.py --space sweep_space.yaml --max_epochs 9 --cores 24 --memory_gb 96 --cores_per_trial 6
+
+The search space (YAML or JSON) maps train.py / ultralytics train arguments to a
+list of choices or to a {min, max, log} range:
+
+    imgsz: [512, 640]
+    batch: [8, 16]
+    lr0: {min: 0.001, max: 0.02, log: true}
+
+With choices only and no --num_trials every combination runs; otherwise
+--num_trials configurations are sampled. Trials run as `python train.py key=value ...`
+processes, started while their cores and estimated memory fit the budget. Each
+trial's results.csv is read as epochs complete; at the rung epochs min_epochs,
+min_epochs * eta, ... a trial is stopped unless its metric is in the top 1/eta of
+the trials that reached the same rung (asynchronous successive halving, so a free
+slot never waits for a whole rung to finish). leaderboard.csv in --sweep_dir lists
+every trial's best metric against the core-hours it used.
+"""
+import os
+import sys
+import csv
+import json
+import time
+import random
+import signal
+import argparse
+import itertools
+import subprocess
+
+import yaml
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+TRAIN_SCRIPT = os.path.join(ROOT, 'train.py')
+DEFAULT_SWEEP_DIR = 'vehicle_yolov10/sweep'
+METRIC = 'metrics/mAP50-95(B)'
+ETA = 3  # a trial survives a rung when in the top 1/ETA of the trials that reached it
+MIN_EPOCHS = 1  # first rung
+POLL_INTERVAL = 30  # seconds between reads of the trials' results.csv
+TRIAL_MEMORY_GB = 8.0  # memory of one trial at batch 8, imgsz 640; scaled with batch * imgsz^2
+STOP_TIMEOUT = 60  # seconds a stopped trial gets to exit before it is killed
+# POSIX trials run in their own session so stopping one also stops its dataloader workers;
+# Windows has no process groups to signal, so there only the trial process is terminated
+PROCESS_GROUPS = hasattr(os, 'killpg')
+
+
+def load_space(path):
+    with open(path, 'r') as f:
+        return yaml.safe_load(f)
+
+
+def trial_configs(space, num_trials=None, seed=0):
+    """Every combination of a choices-only space, or num_trials random samples of it."""
+    if num_trials is None and all(isinstance(v, list) for v in space.values()):
+        return [dict(zip(space, values)) for values in itertools.product(*space.values())]
+    rng = random.Random(seed)
+
+    def sample(spec):
+        if isinstance(spec, list):
+            return rng.choice(spec)
+        if spec.get('log'):
+            return float(f"{spec['min'] * (spec['max'] / spec['min']) ** rng.random():.4g}")
+        value = rng.uniform(spec['min'], spec['max'])
+        return round(value) if isinstance(spec['min'], int) and isinstance(spec['max'], int) else float(f'{value:.4g}')
+
+    return [{key: sample(spec) for key, spec in space.items()} for _ in range(num_trials or 1)]
+
+
+def rung_epochs(max_epochs, min_epochs=MIN_EPOCHS, eta=ETA):
+    """Epochs at which trials are compared: min_epochs * eta^k below max_epochs."""
+    rungs = []
+    epoch = min_epochs
+    while epoch < max_epochs:
+        rungs.append(epoch)
+        epoch *= eta
+    return rungs
+
+
+def read_results(csv_path):
+    """Rows of an ultralytics results.csv written so far, as dicts of floats; [] before the first epoch."""
+    if not os.path.exists(csv_path):
+        return []
+    with open(csv_path, 'r', newline='') as f:
+        text = f.read()
+    lines = text.splitlines()
+    if not text.endswith('\n'):
+        lines = lines[:-1]  # the epoch being appended right now
+    rows = []
+    for row in csv.DictReader(lines):
+        try:
+            rows.append({key.strip(): float(value) for key, value in row.items()})
+        except (TypeError, ValueError):
+            continue
+    return rows
+
+
+def estimate_memory_gb(config, base_gb=TRIAL_MEMORY_GB):
+    """Rough peak memory of a trial: base_gb at batch 8 and imgsz 640, scaled with the pixels per batch."""
+    from train import BATCH_SIZE, IMG_SIZE
+
+    batch = config.get('batch', BATCH_SIZE)
+    imgsz = config.get('imgsz', IMG_SIZE)
+    return base_gb * (batch / 8) * (imgsz / 640) ** 2
+
+
+class SuccessiveHalving:
+    """
+    Asynchronous successive halving.
+
+    Each trial reaching a rung records its metric there. It continues while it
+    ranks in the top max(1, n // eta) of the n trials recorded at that rung so far;
+    the first trials at a rung (n < eta) always continue, as there is nothing to
+    compare them with yet.
+
+    Args:
+        rungs: Epochs at which trials are compared
+        eta: Reduction factor
+        mode: "max" or "min", the direction in which the metric improves
+    """
+
+    def __init__(self, rungs, eta=ETA, mode="max"):
+        self.rungs = rungs
+        self.eta = eta
+        self.sign = 1 if mode == "max" else -1
+        self.recorded = {rung: {} for rung in rungs}
+
+    def should_continue(self, trial, epoch, value):
+        """Record a trial's metric after `epoch`; False when it falls out at this rung."""
+        if epoch not in self.recorded:
+            return True
+        at_rung = self.recorded[epoch]
+        at_rung[trial] = self.sign * value
+        if len(at_rung) < self.eta:
+            return True
+        keep = max(1, len(at_rung) // self.eta)
+        return sorted(at_rung.values(), reverse=True).index(self.sign * value) < keep
+
+
+class Trial:
+    """One train.py run of the sweep, in its own process group so stop() also ends its data loader workers."""
+
+    def __init__(self, index, config, sweep_dir, cores, memory_gb):
+        self.index = index
+        self.config = config
+        self.name = f'trial_{index:03d}'
+        self.dir = os.path.join(sweep_dir, self.name)
+        self.cores = cores
+        self.memory_gb = memory_gb
+        self.status = 'pending'
+        self.process = None
+        self.started = None
+        self.finished = None
+        self.rows = []
+
+    def start(self, max_epochs, metric, extra_args):
+        os.makedirs(self.dir, exist_ok=True)
+        args = dict(extra_args, project=os.path.dirname(self.dir), name=self.name, exist_ok=True,
+                    epochs=max_epochs, workers=self.cores)
+        if metric.startswith('metrics/'):
+            args['val'] = True  # the metric only exists in results.csv for validated epochs
+        args.update(self.config)
+        env = dict(os.environ, OMP_NUM_THREADS=str(self.cores), MKL_NUM_THREADS=str(self.cores))
+        with open(os.path.join(self.dir, 'train.log'), 'w') as log:
+            argv = [f'{k}={v if isinstance(v, str) else json.dumps(v)}' for k, v in args.items()]
+            group = dict(start_new_session=True) if PROCESS_GROUPS else \
+                dict(creationflags=subprocess.CREATE_NEW_PROCESS_GROUP)
+            self.process = subprocess.Popen([sys.executable, TRAIN_SCRIPT] + argv,
+                                            stdout=log, stderr=subprocess.STDOUT, env=env, **group)
+        self.started = time.time()
+        self.status = 'running'
+
+    def poll(self):
+        """Refresh the epochs read from results.csv; returns the newly completed rows."""
+        exited = self.status == 'running' and self.process.poll() is not None
+        rows = read_results(os.path.join(self.dir, 'results.csv'))  # after the exit check, to get the last epoch
+        new, self.rows = rows[len(self.rows):], rows
+        if exited:
+            self.finished = time.time()
+            self.status = 'completed' if self.process.returncode == 0 else f'failed ({self.process.returncode})'
+        return new
+
+    def _signal(self, sig):
+        if PROCESS_GROUPS:
+            os.killpg(self.process.pid, sig)
+        elif sig == signal.SIGTERM:
+            self.process.terminate()
+        else:
+            self.process.kill()
+
+    def stop(self):
+        try:
+            self._signal(signal.SIGTERM)
+            self.process.wait(STOP_TIMEOUT)
+        except subprocess.TimeoutExpired:
+            self._signal(getattr(signal, 'SIGKILL', None))
+            self.process.wait()
+        except ProcessLookupError:
+            pass
+        self.finished = time.time()
+        self.status = 'stopped'
+
+    @property
+    def wall_seconds(self):
+        if self.started is None:
+            return 0.0
+        return (self.finished or time.time()) - self.started
+
+    def best(self, metric, mode):
+        values = [row[metric] for row in self.rows if metric in row]
+        if not values:
+            return None
+        return max(values) if mode == 'max' else min(values)
+
+
+def write_leaderboard(trials, path, metric, mode):
+    """Trials ranked by their best metric, with the epochs, wall time and core-hours each used."""
+    def rank_key(trial):
+        best = trial.best(metric, mode)
+        return best is None, 0 if best is None else -best if mode == 'max' else best
+
+    scored = sorted(trials, key=rank_key)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['rank', 'trial', 'status', 'epochs', metric, 'wall_s', 'train_s', 'core_hours', 'config'])
+        for rank, trial in enumerate(scored, start=1):
+            best = trial.best(metric, mode)
+            train_s = trial.rows[-1].get('time', 0.0) if trial.rows else 0.0
+            writer.writerow([rank, trial.name, trial.status, len(trial.rows), '' if best is None else f'{best:.5g}',
+                             f'{trial.wall_seconds:.0f}', f'{train_s:.0f}',
+                             f'{trial.wall_seconds * trial.cores / 3600:.3f}', json.dumps(trial.config)])
+    os.replace(tmp_path, path)
+    return scored
+
+
+def run_sweep(configs, sweep_dir=DEFAULT_SWEEP_DIR, max_epochs=9, cores=None, memory_gb=None, cores_per_trial=None,
+              metric=METRIC, mode='max', eta=ETA, min_epochs=MIN_EPOCHS, trial_memory_gb=TRIAL_MEMORY_GB,
+              extra_args=None, poll_interval=POLL_INTERVAL):
+    """
+    Run trials concurrently within a core and memory budget, stopping the weak ones early.
+
+    Args:
+        configs: One dict of train arguments per trial (see trial_configs)
+        sweep_dir: Directory holding a subdirectory per trial and leaderboard.csv
+        max_epochs: Epochs of a trial that is never stopped
+        cores: CPU cores shared by all trials (defaults to the CPU count)
+        memory_gb: Memory shared by all trials, compared with estimate_memory_gb (None: unbounded)
+        cores_per_trial: Threads and data loader workers of each trial (defaults to all cores)
+        metric: results.csv column to rank trials by
+        mode: "max" or "min", the direction in which the metric improves
+        eta: Successive halving reduction factor
+        min_epochs: First rung
+        trial_memory_gb: Memory of one trial at batch 8 and imgsz 640
+        extra_args: Train arguments given to every trial, e.g. {"data": ..., "model": ...}
+        poll_interval: Seconds between reads of the trials' results.csv
+    """
+    sweep_dir = os.path.abspath(sweep_dir)  # ultralytics puts relative projects under its runs directory
+    os.makedirs(sweep_dir, exist_ok=True)
+    cores = cores or os.cpu_count() or 1
+    cores_per_trial = min(cores_per_trial or cores, cores)
+    halving = SuccessiveHalving(rung_epochs(max_epochs, min_epochs, eta), eta, mode)
+    trials = [Trial(i, config, sweep_dir, cores_per_trial, estimate_memory_gb(config, trial_memory_gb))
+              for i, config in enumerate(configs)]
+    with open(os.path.join(sweep_dir, 'sweep.json'), 'w') as f:
+        json.dump({"metric": metric, "mode": mode, "max_epochs": max_epochs, "rungs": halving.rungs, "eta": eta,
+                   "extra_args": extra_args or {}, "trials": {t.name: t.config for t in trials}}, f, indent=2)
+    print(f"{len(trials)} trials, {cores_per_trial} cores each within {cores} cores"
+          f"{f' and {memory_gb:g} GB' if memory_gb else ''}; rungs at epochs {halving.rungs}")
+    leaderboard = os.path.join(sweep_dir, 'leaderboard.csv')
+
+    try:
+        while True:
+            running = [t for t in trials if t.status == 'running']
+            for trial in running:
+                for row in trial.poll():
+                    if metric not in row:
+                        continue
+                    epoch = int(row['epoch'])
+                    # Epochs of finished trials still count at their rungs
+                    if not halving.should_continue(trial.name, epoch, row[metric]) and trial.status == 'running':
+                        trial.stop()
+                        print(f"Stopped {trial.name} after epoch {epoch}: {metric} {row[metric]:.4g}")
+                if trial.status not in ('running', 'stopped'):
+                    print(f"{trial.name} {trial.status} after {len(trial.rows)} epochs")
+
+            running = [t for t in trials if t.status == 'running']
+            used_cores = sum(t.cores for t in running)
+            used_memory = sum(t.memory_gb for t in running)
+            for trial in trials:
+                if trial.status != 'pending':
+                    continue
+                fits_memory = memory_gb is None or used_memory + trial.memory_gb <= memory_gb
+                if used_cores + trial.cores > cores or (running and not fits_memory):
+                    break  # start trials in order; a trial that never fits alone still runs alone
+                trial.start(max_epochs, metric, extra_args or {})
+                running.append(trial)
+                used_cores += trial.cores
+                used_memory += trial.memory_gb
+                print(f"Started {trial.name} ({trial.cores} cores, ~{trial.memory_gb:.1f} GB): {trial.config}")
+
+            write_leaderboard(trials, leaderboard, metric, mode)
+            if not running:
+                break
+            time.sleep(poll_interval)
+    finally:
+        for trial in trials:
+            if trial.status == 'running':
+                trial.stop()
+        scored = write_leaderboard(trials, leaderboard, metric, mode)
+
+    print(f"Leaderboard ({metric}, {mode}) in {leaderboard}:")
+    for rank, trial in enumerate(scored[:10], start=1):
+        best = trial.best(metric, mode)
+        print(f"  {rank:2d}. {trial.name} {'-' if best is None else f'{best:.4g}':>8}  {trial.status:<10} "
+              f"{len(trial.rows):3d} epochs  {trial.wall_seconds * trial.cores / 3600:7.2f} core-h  {trial.config}")
+    return scored
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--space', required=True, help='YAML/JSON search space')
+    parser.add_argument('--sweep_dir', default=DEFAULT_SWEEP_DIR, help='Directory of the trial runs and leaderboard')
+    parser.add_argument('--num_trials', type=int, default=None, help='Sample this many configurations (default: grid)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--max_epochs', type=int, default=9, help='Epochs of a trial that is never stopped')
+    parser.add_argument('--min_epochs', type=int, default=MIN_EPOCHS, help='First successive halving rung')
+    parser.add_argument('--eta', type=int, default=ETA, help='Keep the top 1/eta of the trials at each rung')
+    parser.add_argument('--metric', default=METRIC, help='results.csv column to rank trials by')
+    parser.add_argument('--mode', default='max', choices=('max', 'min'), help='Whether higher or lower is better')
+    parser.add_argument('--cores', type=int, default=None, help='Cores shared by all trials (default: CPU count)')
+    parser.add_argument('--memory_gb', type=float, default=None, help='Memory shared by all trials')
+    parser.add_argument('--cores_per_trial', type=int, default=None, help='Threads and loader workers per trial')
+    parser.add_argument('--trial_memory_gb', type=float, default=TRIAL_MEMORY_GB,
+                        help='Memory of one trial at batch 8, imgsz 640 (scaled for other settings)')
+    parser.add_argument('--poll_interval', type=float, default=POLL_INTERVAL, help='Seconds between results.csv reads')
+    parser.add_argument('train_args', nargs='*', help='key=value train arguments shared by all trials')
+    args = parser.parse_args()
+
+    extra_args = {key: yaml.safe_load(value) for key, value in (arg.split('=', 1) for arg in args.train_args)}
+    configs = trial_configs(load_space(args.space), args.num_trials, args.seed)
+    run_sweep(configs, args.sweep_dir, args.max_epochs, args.cores, args.memory_gb, args.cores_per_trial, args.metric,
+              args.mode, args.eta, args.min_epochs, args.trial_memory_gb, extra_args, args.poll_interval)
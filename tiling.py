@@ -0,0 +1,196 @@
+import time
+from collections import deque
+
+import cv2
+import numpy as np
+
+from inference import IMG_SIZE, box_iou, collate, iter_prepared, letterbox, nms, prepare_frame, unletterbox
+
+TILE_SIZE = 640  # tile side in frame pixels; equal to imgsz, tiles run at native resolution
+TILE_OVERLAP = 0.2  # minimum overlap between neighbouring tiles, as a fraction of TILE_SIZE
+MERGE_IOS = 0.5  # full-frame and tile boxes overlapping more than this (IoS) are merged
+TILE_MODES = ("off", "on", "auto")
+CALIBRATION_FRAMES = 8  # tiled frames the auto mode averages its decision over
+RECHECK_EVERY = 200  # with tiling off, still tile every Nth frame to notice a change of scene
+MIN_GAIN_PER_COST = 0.1  # extra detections per frame needed per extra full-frame pass of compute
+
+
+def tile_grid(width, height, tile_size=TILE_SIZE, overlap=TILE_OVERLAP):
+    """Tx4 [x0, y0, x1, y1] windows of tile_size covering the frame, neighbours overlapping by at least overlap."""
+    def starts(length):
+        if length <= tile_size:
+            return np.zeros(1, dtype=np.int64)
+        step = tile_size * (1 - overlap)
+        count = int(np.ceil((length - tile_size) / step)) + 1
+        return np.linspace(0, length - tile_size, count).round().astype(np.int64)
+
+    x0, y0 = (a.ravel() for a in np.meshgrid(starts(width), starts(height)))
+    return np.stack([x0, y0, np.minimum(x0 + tile_size, width), np.minimum(y0 + tile_size, height)], axis=1)
+
+
+def prepare_tiled(source, imgsz=IMG_SIZE):
+    """Like prepare_image / prepare_frame, but keeps the decoded pixels in item["image"] for tiling."""
+    if isinstance(source, dict):
+        image = source["image"]
+        item = prepare_frame(source, imgsz)
+    else:
+        image = cv2.imread(source, cv2.IMREAD_COLOR)
+        if image is None:
+            raise ValueError(f"Could not decode image: {source}")
+        item = prepare_frame({"path": source, "image": image}, imgsz)
+    item["image"] = image
+    return item
+
+
+def tile_detections(forward, image, imgsz=IMG_SIZE, tile_size=TILE_SIZE, overlap=TILE_OVERLAP):
+    """Run all tiles of one frame through a single forward call; Nx6 detections in frame coordinates."""
+    height, width = image.shape[:2]
+    windows = tile_grid(width, height, tile_size, overlap)
+    tiles = []
+    for x0, y0, x1, y1 in windows.tolist():
+        chw, gain, pad = letterbox(image[y0:y1, x0:x1], imgsz)
+        tiles.append({"chw": chw, "gain": gain, "pad": pad, "width": x1 - x0, "height": y1 - y0})
+
+    outputs = forward(collate(tiles))
+    dets = [unletterbox(d, t["gain"], t["pad"], t["width"], t["height"]) for d, t in zip(outputs, tiles)]
+    counts = [len(d) for d in dets]
+    dets = np.concatenate(dets) if dets else np.empty((0, 6), dtype=np.float32)
+    # Shift every box by the origin of its tile in one go
+    dets[:, :4] += np.tile(np.repeat(windows[:, :2], counts, axis=0), 2)
+    return dets
+
+
+def merge_detections(full_dets, tile_dets, ios_threshold=MERGE_IOS):
+    """
+    Merge full-frame and tile detections with class-aware NMS by IoS.
+
+    IoS rather than IoU also removes the partial boxes of vehicles cut by a tile
+    border, which lie inside the full-frame or neighbouring tile's box.
+    """
+    return nms(np.concatenate([full_dets, tile_dets]), ios_threshold, smaller=True)
+
+
+def extra_detections(full_dets, merged_dets, iou_threshold=0.5):
+    """Number of merged detections no full-frame detection of the same class matches."""
+    if not len(full_dets):
+        return len(merged_dets)
+    iou = box_iou(merged_dets[:, :4], full_dets[:, :4])
+    iou[merged_dets[:, None, 5] != full_dets[None, :, 5]] = 0
+    return int((iou.max(axis=1) < iou_threshold).sum()) if len(merged_dets) else 0
+
+
+class TilingCostModel:
+    """
+    Decide per frame whether tiling is worth its compute.
+
+    "on" and "off" are fixed. In "auto" mode the first frames are tiled to
+    calibrate; each tiled frame also has its full-frame pass, so it measures both
+    the gain (detections only the tiles found) and the cost (tile time in units of
+    full-frame passes). Tiling stays on while the recent gain per unit of extra
+    cost is at least min_gain_per_cost; while it is off, every recheck_every-th
+    frame is still tiled so a change of scene (e.g. a busier junction) is noticed.
+
+    Args:
+        mode: "off", "on" or "auto"
+        min_gain_per_cost: Extra detections per frame required per extra full-frame pass
+        calibration_frames: Tiled frames averaged per decision
+        recheck_every: Sampling interval while tiling is off
+    """
+
+    def __init__(self, mode="auto", min_gain_per_cost=MIN_GAIN_PER_COST, calibration_frames=CALIBRATION_FRAMES,
+                 recheck_every=RECHECK_EVERY):
+        if mode not in TILE_MODES:
+            raise ValueError(f"Unknown tiling mode '{mode}', expected one of {TILE_MODES}")
+        self.mode = mode
+        self.min_gain_per_cost = min_gain_per_cost
+        self.calibration_frames = calibration_frames
+        self.recheck_every = recheck_every
+        self.samples = deque(maxlen=calibration_frames)
+        self.enabled = mode != "off"
+        self.frames = 0
+        self.tiled = 0
+        self.extra = 0
+
+    def should_tile(self):
+        if self.mode != "auto":
+            return self.enabled
+        calibrating = len(self.samples) < self.calibration_frames
+        return calibrating or self.enabled or self.frames % self.recheck_every == 0
+
+    def observe(self, full_dets, merged_dets, full_seconds, tile_seconds):
+        """Record one tiled frame: its detections with and without tiles and the time of each pass."""
+        gain = extra_detections(full_dets, merged_dets)
+        self.tiled += 1
+        self.extra += gain
+        self.samples.append((gain, tile_seconds / max(full_seconds, 1e-6)))
+        if self.mode == "auto" and len(self.samples) == self.calibration_frames:
+            enabled = self.gain_per_cost() >= self.min_gain_per_cost
+            if enabled != self.enabled:
+                print(f"Tiling {'on' if enabled else 'off'} at frame {self.frames}: "
+                      f"{self.gain_per_cost():.3f} extra detections per extra full-frame pass")
+            self.enabled = enabled
+
+    def gain_per_cost(self):
+        gains, costs = zip(*self.samples)
+        return np.mean(gains) / max(np.mean(costs), 1e-6)
+
+    def step(self):
+        self.frames += 1
+
+    def report(self):
+        if self.mode == "off":
+            return
+        summary = f"Tiled {self.tiled}/{self.frames} frames, {self.extra} extra detections"
+        if self.samples:
+            summary += f", {self.gain_per_cost():.3f} extra detections per extra full-frame pass"
+        print(summary)
+
+
+def detect_tiled(sources, forward, batch_size=8, imgsz=IMG_SIZE, workers=None, tile_size=TILE_SIZE,
+                 overlap=TILE_OVERLAP, cost_model=None):
+    """
+    inference.detect with sliced inference for small objects.
+
+    Full frames are batched across frames as in detect. Frames the cost model picks
+    also get all their overlapping tiles through one more forward call, and the
+    tile detections are merged into the full-frame ones.
+
+    Args:
+        sources: Image paths or decoded frame dicts (see video.iter_video_frames)
+        forward: Callable mapping a uint8 Bx3xHxW batch to a list of Nx6 detection arrays
+        batch_size: Full frames per forward call
+        imgsz: Letterbox size, of full frames and tiles
+        workers: Decode threads
+        tile_size: Tile side in frame pixels
+        overlap: Minimum overlap of neighbouring tiles
+        cost_model: TilingCostModel deciding which frames to tile (default: tile all)
+
+    Yields:
+        (item, dets) as inference.detect does
+    """
+    cost_model = cost_model or TilingCostModel("on")
+    items = []
+
+    def flush():
+        start = time.perf_counter()
+        outputs = forward(collate(items))
+        full_seconds = (time.perf_counter() - start) / len(items)
+        for item, dets in zip(items, outputs):
+            item.pop("chw")
+            image = item.pop("image")
+            dets = unletterbox(dets, item["gain"], item["pad"], item["width"], item["height"])
+            if cost_model.should_tile():
+                start = time.perf_counter()
+                merged = merge_detections(dets, tile_detections(forward, image, imgsz, tile_size, overlap))
+                cost_model.observe(dets, merged, full_seconds, time.perf_counter() - start)
+                dets = merged
+            cost_model.step()
+            yield item, dets
+        items.clear()
+
+    for item in iter_prepared(sources, imgsz, workers, 2 * batch_size, prepare_tiled):
+        items.append(item)
+        if len(items) == batch_size:
+            yield from flush()
+    if items:
+        yield from flush()
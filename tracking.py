@@ -0,0 +1,281 @@
+import os
+import csv
+import argparse
+
+import numpy as np
+
+from inference import BACKENDS, CATEGORIES, IMG_SIZE, box_iou, detect, load_forward, prepare_frame
+from video import is_video, iter_video_frames, video_fps
+
+IOU_THRESHOLD = 0.3  # minimum IoU for a detection to continue a track
+MAX_CENTER_DISTANCE = 1.0  # centroid fallback, in units of the track's box diagonal
+MAX_AGE = 15  # frames a track survives without a matching detection
+COUNT_INTERVAL = 60.0  # seconds per counts row
+DIRECTIONS = ("in", "out")
+
+
+def associate(track_boxes, det_boxes, iou_threshold=IOU_THRESHOLD, max_distance=MAX_CENTER_DISTANCE):
+    """
+    Greedily match tracks to detections, best pairs first.
+
+    IoU matches take priority; boxes that moved too far to overlap (fast vehicles,
+    dropped frames) can still match on centroid distance. IoU and distance are
+    computed as full tracks x detections matrices in one vectorized pass; only the
+    candidate (non-zero score) pairs are then sorted and visited in Python.
+
+    Returns:
+        (track_idx, det_idx): index arrays of the matched pairs
+    """
+    if not len(track_boxes) or not len(det_boxes):
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+
+    iou = box_iou(track_boxes, det_boxes)
+    track_centers = (track_boxes[:, :2] + track_boxes[:, 2:]) / 2
+    det_centers = (det_boxes[:, :2] + det_boxes[:, 2:]) / 2
+    diag = np.hypot(*(track_boxes[:, 2:] - track_boxes[:, :2]).T).clip(1e-6)
+    dist = np.linalg.norm(track_centers[:, None] - det_centers[None], axis=2) / diag[:, None]
+
+    # IoU matches score in [1, 2], centroid-only matches in (0, 1)
+    score = np.where(iou >= iou_threshold, 1 + iou, np.where(dist < max_distance, 1 - dist / max_distance, 0))
+    rows, cols = np.nonzero(score)
+    order = np.argsort(-score[rows, cols], kind='stable')
+
+    used_tracks = np.zeros(len(track_boxes), dtype=bool)
+    used_dets = np.zeros(len(det_boxes), dtype=bool)
+    matched_tracks, matched_dets = [], []
+    for t, d in zip(rows[order].tolist(), cols[order].tolist()):
+        if used_tracks[t] or used_dets[d]:
+            continue
+        used_tracks[t] = used_dets[d] = True
+        matched_tracks.append(t)
+        matched_dets.append(d)
+    return np.array(matched_tracks, dtype=np.int64), np.array(matched_dets, dtype=np.int64)
+
+
+class Tracker:
+    """
+    Multi-object tracker over per-frame Nx6 [x1, y1, x2, y2, conf, cls] detections.
+
+    Track state is a handful of parallel arrays (boxes, ids, misses, class votes)
+    rather than one object per track, so updating a frame is a few array operations.
+    A track's category is the class it was detected as most often, which keeps a
+    vehicle from being counted twice when the detector flips between similar classes.
+
+    Args:
+        iou_threshold: Minimum IoU for a detection to continue a track
+        max_distance: Centroid distance fallback, in track box diagonals
+        max_age: Frames a track survives without a matching detection
+        num_classes: Number of detector classes
+    """
+
+    def __init__(self, iou_threshold=IOU_THRESHOLD, max_distance=MAX_CENTER_DISTANCE, max_age=MAX_AGE,
+                 num_classes=len(CATEGORIES)):
+        self.iou_threshold = iou_threshold
+        self.max_distance = max_distance
+        self.max_age = max_age
+        self.num_classes = num_classes
+        self.boxes = np.empty((0, 4), dtype=np.float32)
+        self.ids = np.empty(0, dtype=np.int64)
+        self.misses = np.empty(0, dtype=np.int32)
+        self.votes = np.empty((0, num_classes), dtype=np.int32)
+        self.next_id = 0
+
+    def update(self, dets):
+        """
+        Advance all tracks by one frame.
+
+        Returns:
+            (ids, categories, prev_centers, centers), one entry per detection:
+            track ids, 0-based class of each track, the track's centre in the
+            previous frame it was seen (NaN for new tracks) and its centre now
+        """
+        dets = np.asarray(dets, dtype=np.float32).reshape(-1, 6)
+        boxes = dets[:, :4]
+        classes = dets[:, 5].astype(np.int64).clip(0, self.num_classes - 1)
+        track_idx, det_idx = associate(self.boxes, boxes, self.iou_threshold, self.max_distance)
+
+        # Start tracks for unmatched detections
+        new = np.ones(len(dets), dtype=bool)
+        new[det_idx] = False
+        n_new = int(new.sum())
+        first_new = len(self.ids)
+        self.boxes = np.concatenate([self.boxes, boxes[new]])
+        self.ids = np.concatenate([self.ids, np.arange(self.next_id, self.next_id + n_new)])
+        self.misses = np.concatenate([self.misses, np.zeros(n_new, dtype=np.int32)])
+        self.votes = np.concatenate([self.votes, np.zeros((n_new, self.num_classes), dtype=np.int32)])
+        self.next_id += n_new
+
+        det_tracks = np.empty(len(dets), dtype=np.int64)
+        det_tracks[det_idx] = track_idx
+        det_tracks[new] = np.arange(first_new, first_new + n_new)
+
+        prev_centers = (self.boxes[det_tracks, :2] + self.boxes[det_tracks, 2:]) / 2
+        prev_centers[new] = np.nan
+        self.boxes[det_tracks] = boxes
+        self.misses += 1
+        self.misses[det_tracks] = 0
+        np.add.at(self.votes, (det_tracks, classes), 1)
+
+        ids = self.ids[det_tracks]
+        categories = self.votes[det_tracks].argmax(axis=1)
+
+        # Drop tracks that have not been seen for too long
+        alive = self.misses <= self.max_age
+        if not alive.all():
+            self.boxes, self.ids, self.misses, self.votes = (
+                self.boxes[alive], self.ids[alive], self.misses[alive], self.votes[alive])
+
+        return ids, categories, prev_centers, (boxes[:, :2] + boxes[:, 2:]) / 2
+
+
+def parse_lines(spec):
+    """Parse counting lines given as "x1,y1,x2,y2;x1,y1,x2,y2" (pixels of the original frame)."""
+    return np.array([[float(v) for v in line.split(',')] for line in spec.split(';') if line.strip()],
+                    dtype=np.float32).reshape(-1, 4)
+
+
+def _cross(origin, direction, points):
+    """z component of direction x (points - origin) for every (line, point) pair."""
+    rel = points[None, :, :] - origin[:, None, :]
+    return direction[:, None, 0] * rel[..., 1] - direction[:, None, 1] * rel[..., 0]
+
+
+class LineCounter:
+    """
+    Per-line, per-category crossing counts for tracked centroids.
+
+    A track is counted when the segment from its previous to its current centre
+    intersects a counting line (one per lane). "in" means crossing from the left to
+    the right of the line as drawn from (x1, y1) to (x2, y2), in image coordinates.
+
+    Args:
+        lines: Lx4 array of [x1, y1, x2, y2] counting lines
+        num_classes: Number of detector classes
+    """
+
+    def __init__(self, lines, num_classes=len(CATEGORIES)):
+        self.lines = np.asarray(lines, dtype=np.float32).reshape(-1, 4)
+        self.num_classes = num_classes
+        self.counts = np.zeros((len(self.lines), num_classes, len(DIRECTIONS)), dtype=np.int64)
+
+    def update(self, categories, prev_centers, centers):
+        """Count crossings for one frame of Tracker.update output."""
+        moved = ~np.isnan(prev_centers).any(axis=1)
+        if not moved.any() or not len(self.lines):
+            return
+        categories, prev_centers, centers = categories[moved], prev_centers[moved], centers[moved]
+
+        starts, ends = self.lines[:, :2], self.lines[:, 2:]
+        line_dir = ends - starts
+        before = _cross(starts, line_dir, prev_centers)
+        after = _cross(starts, line_dir, centers)
+
+        # The line's endpoints must also lie on opposite sides of the movement segment
+        move_dir = centers - prev_centers
+        side_start = move_dir[None, :, 0] * (starts[:, None, 1] - prev_centers[None, :, 1]) - \
+            move_dir[None, :, 1] * (starts[:, None, 0] - prev_centers[None, :, 0])
+        side_end = move_dir[None, :, 0] * (ends[:, None, 1] - prev_centers[None, :, 1]) - \
+            move_dir[None, :, 1] * (ends[:, None, 0] - prev_centers[None, :, 0])
+
+        # Points exactly on the line belong to the left side, so touching it counts once
+        right = after > 0  # y points down, so the right of the line is > 0
+        crossed = ((before > 0) != right) & (side_start * side_end <= 0)
+        line_idx, det_idx = np.nonzero(crossed)
+        direction = (~right[line_idx, det_idx]).astype(np.int64)
+        np.add.at(self.counts, (line_idx, categories[det_idx], direction), 1)
+
+    def reset(self):
+        counts = self.counts
+        self.counts = np.zeros_like(counts)
+        return counts
+
+
+class IntervalCounts:
+    """
+    Tracker, line counter and a CSV of counts per fixed time interval.
+
+    Only non-zero (line, category) rows are written, one block per interval, which
+    is all downstream traffic analysis needs instead of per-frame COCO dumps. Can
+    be used as a StreamPipeline sink.
+
+    Args:
+        output_csv: CSV to append counts to
+        lines: Lx4 counting lines, one per lane
+        interval: Seconds per interval, in the frames' timestamp_ms clock
+        tracker: Tracker instance (defaults to Tracker())
+    """
+
+    def __init__(self, output_csv, lines, interval=COUNT_INTERVAL, tracker=None):
+        self.tracker = tracker or Tracker()
+        self.counter = LineCounter(lines, self.tracker.num_classes)
+        self.interval_ms = interval * 1000
+        self.bucket = None
+        os.makedirs(os.path.dirname(output_csv) or '.', exist_ok=True)
+        self.file = open(output_csv, 'w', newline='')
+        self.writer = csv.writer(self.file)
+        self.writer.writerow(["interval_start_s", "interval_end_s", "line", "category", *DIRECTIONS])
+
+    def __call__(self, item, dets):
+        if item["timestamp_ms"] is None:
+            raise ValueError(f"Frame {item.get('frame_index')} has no timestamp; pass the video's frame rate (--fps)")
+        bucket = int(item["timestamp_ms"] // self.interval_ms)
+        if self.bucket is None:
+            self.bucket = bucket
+        elif bucket != self.bucket:
+            self.flush()
+            self.bucket = bucket
+        self.counter.update(*self.tracker.update(dets)[1:])
+
+    def flush(self):
+        if self.bucket is None:
+            return
+        counts = self.counter.reset()
+        start = self.bucket * self.interval_ms / 1000
+        end = start + self.interval_ms / 1000
+        for line, category in zip(*np.nonzero(counts.sum(axis=2))):
+            self.writer.writerow([start, end, int(line), CATEGORIES[category]["name"], *counts[line, category].tolist()])
+        self.file.flush()
+
+    def close(self):
+        self.flush()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Track vehicles and count line crossings per category and interval')
+    parser.add_argument('--source', required=True, help='Video file, or a stream URL (run live through stream.py)')
+    parser.add_argument('--lines', required=True, help='Counting lines "x1,y1,x2,y2;..." in frame pixels, one per lane')
+    parser.add_argument('--output', required=True, help='CSV to write per-interval counts to')
+    parser.add_argument('--interval', type=float, default=COUNT_INTERVAL, help='Seconds per counts row')
+    parser.add_argument('--batch_size', type=int, default=8, help='Frames per forward pass')
+    parser.add_argument('--imgsz', type=int, default=IMG_SIZE, help='Inference size of the long image side')
+    parser.add_argument('--backend', default='torch', choices=BACKENDS, help='Inference backend (onnx*: run export.py first)')
+    parser.add_argument('--video_stride', type=int, default=1, help='Track on every Nth frame of a video')
+    parser.add_argument('--fps', type=float, default=None,
+                        help="Frame rate of a video file, for containers that do not report one")
+    args = parser.parse_args()
+    if is_video(args.source) and not args.fps and not video_fps(args.source):
+        # Intervals are timed by frame_index / fps; without a rate the counts cannot be bucketed
+        parser.error(f"{args.source} reports no frame rate; pass it with --fps")
+
+    forward = load_forward(args.backend)
+    with IntervalCounts(args.output, parse_lines(args.lines), args.interval) as counts:
+        if is_video(args.source):
+            frames = iter_video_frames(args.source, args.video_stride, fps=args.fps)
+            for item, dets in detect(frames, forward, args.batch_size, args.imgsz, prepare=prepare_frame):
+                counts(item, dets)
+        else:
+            from stream import StreamPipeline
+
+            StreamPipeline(args.source, forward, counts, args.batch_size, args.imgsz).run()
+    print(f"Counts written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
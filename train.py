@@ -1,5 +1,3 @@
-from ultralytics import YOLO
-
 # Define hyperparameters and paths
 DATASET_YAML = r"C:\Users\Rohit\Videos\testing\data\dataset.yaml"
 MODEL = 'yolov10m.pt'
@@ -9,13 +7,24 @@ BATCH_SIZE = 8  # Increased batch size to utilize the A6000's memory
 PROJECT = 'vehicle_yolov10'
 NAME = 'yolov10m'
 CHECKPOINT_INTERVAL = 1  # Save every epoch
+# Resized images and labels prebuilt by train_cache.py (built on first use otherwise);
+# None decodes every JPEG and parses every label file again each epoch
+TRAIN_CACHE_DIR = 'data/train_cache'
+# COCO ground truth (e.g. from csvtojson.py) and its images, scored with evaluate.py
+# after every saved checkpoint; None skips the evaluation
+EVAL_GT_JSON = None
+EVAL_IMAGE_DIR = None
 
 if __name__ == '__main__':
-    # Initialize the YOLO model
-    model = YOLO(MODEL)
+    import sys
 
-    # Train the model
-    model.train(
+    import yaml
+
+    # Imported here so importing this module for its settings does not load torch
+    from ultralytics import YOLO
+    from train_cache import cached_trainer
+
+    train_args = dict(
         data=DATASET_YAML,
         epochs=EPOCHS,
         imgsz=IMG_SIZE,
@@ -26,4 +35,26 @@ if __name__ == '__main__':
         save_period=CHECKPOINT_INTERVAL,
         val=False  # Disable validation during training
     )
+    # key=value arguments override the settings above or set any other ultralytics
+    # train argument, as sweep.py does: python train.py epochs=3 imgsz=512 lr0=0.005
+    overrides = {key: yaml.safe_load(value) for key, value in (arg.split('=', 1) for arg in sys.argv[1:])}
+    model_cfg = overrides.pop('model', MODEL)
+    train_args.update(overrides)
+
+    # Initialize the YOLO model
+    model = YOLO(model_cfg)
+
+    if EVAL_GT_JSON:
+        from evaluate import evaluate_weights, print_report
+
+        def evaluate_checkpoint(trainer):
+            print(f"Evaluating {trainer.last} (epoch {trainer.epoch + 1})")
+            # Stay within the workers budget (sweep.py sets it to the trial's cores)
+            print_report(evaluate_weights(trainer.last, EVAL_IMAGE_DIR, EVAL_GT_JSON, train_args['batch'],
+                                          train_args.get('workers')))
+
+        model.add_callback("on_model_save", evaluate_checkpoint)
+
+    # Train the model
+    model.train(trainer=cached_trainer(TRAIN_CACHE_DIR) if TRAIN_CACHE_DIR else None, **train_args)
 
@@ -0,0 +1,329 @@
+"""
+Decoded-image cache and consolidated label index for train.py.
+
+Every epoch of plain ultralytics training decodes every JPEG and resizes it to
+imgsz again. The cache stores each image of a split once, already resized the
+way ultralytics would (long side to imgsz, INTER_LINEAR), in one flat uint8
+file read through a memory map. It also stores every YOLO label file of the
+split (as written by coco2yolo.py) in a single index of boxes and classes.
+Training then needs no decoding and no label parsing.
+
+A cache lives in <cache_dir>/<key>. The key hashes imgsz and the bytes of every
+image and label file, so any edit to the data produces a new cache. File
+digests are memoized on (path, size, mtime), so checking an unchanged dataset
+only stats its files. Caches are built in a temporary directory and renamed
+into place, so concurrent jobs (e.g. a hyperparameter sweep) can share them.
+
+    python train_cache.py --data data/dataset.yaml --imgsz 640
+"""
+import os
+import glob
+import json
+import math
+import shutil
+import hashlib
+import argparse
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+from detection_cache import file_digest
+from inference import iter_prepared
+
+CACHE_VERSION = 2  # bump when the layout, the resize rule or the label checks change
+DEFAULT_CACHE_DIR = os.path.join('data', 'train_cache')
+DIGESTS_FILE = 'digests.json'
+IMAGES_FILE = 'images.bin'
+INDEX_FILE = 'index.npz'
+
+
+def label_path(image_path):
+    """YOLO label file of an image: the last /images/ directory replaced by /labels/, as ultralytics does."""
+    sa, sb = f"{os.sep}images{os.sep}", f"{os.sep}labels{os.sep}"
+    return sb.join(image_path.rsplit(sa, 1)).rsplit(".", 1)[0] + ".txt"
+
+
+def resize_long_side(image, imgsz):
+    """Resize so the long side is imgsz, exactly like ultralytics' BaseDataset.load_image in rect mode."""
+    h0, w0 = image.shape[:2]
+    r = imgsz / max(h0, w0)
+    if r != 1:
+        w, h = min(math.ceil(w0 * r), imgsz), min(math.ceil(h0 * r), imgsz)
+        image = cv2.resize(image, (w, h), interpolation=cv2.INTER_LINEAR)
+    return image
+
+
+def read_labels(path, num_cls=None):
+    """
+    Nx5 [cls, x, y, w, h] float32 rows of a YOLO label file with duplicate rows removed; None if malformed.
+
+    Rejects what ultralytics' verify_image_label rejects: rows without 5 fields,
+    coordinates outside [0, 1] (with its 0.01 tolerance), non-integer classes and
+    classes of num_cls or higher (None skips that check, as single_cls does).
+    """
+    if not os.path.exists(path):
+        return np.zeros((0, 5), dtype=np.float32)
+    with open(path) as f:
+        rows = [line.split() for line in f.read().strip().splitlines() if line.strip()]
+    if any(len(row) != 5 for row in rows):
+        return None
+    labels = np.array(rows, dtype=np.float32).reshape(-1, 5)
+    if len(labels) and (labels.min() < -0.01 or labels[:, 1:].max() > 1.01 or (labels[:, 0] % 1 != 0).any()
+                        or (num_cls is not None and labels[:, 0].max() >= num_cls)):
+        return None
+    _, keep = np.unique(labels, axis=0, return_index=True)
+    return labels[np.sort(keep)]
+
+
+class DigestMemo:
+    """SHA-256 of files memoized on (size, mtime) in a JSON file, so unchanged files are never re-read."""
+
+    def __init__(self, path):
+        self.path = path
+        try:
+            with open(path) as f:
+                self.entries = json.load(f)
+        except (OSError, ValueError):
+            self.entries = {}
+
+    def digest(self, path):
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            return None
+        key = os.path.abspath(path)
+        entry = self.entries.get(key)
+        if entry is None or entry[:2] != [st.st_size, st.st_mtime_ns]:
+            entry = [st.st_size, st.st_mtime_ns, file_digest(path)]
+            self.entries[key] = entry
+        return entry[2]
+
+    def save(self):
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(self.entries, f)
+        os.replace(tmp_path, self.path)
+
+
+def content_key(image_files, imgsz, memo, workers=None, cv2_flag=cv2.IMREAD_COLOR, num_cls=None):
+    """Cache key over imgsz, read flag, class count and the content of every image and label file, in dataset order."""
+    files = [p for image in image_files for p in (image, label_path(image))]
+    with ThreadPoolExecutor(max_workers=workers or os.cpu_count() or 1) as pool:
+        digests = list(pool.map(memo.digest, files))
+    payload = json.dumps([CACHE_VERSION, imgsz, cv2_flag, num_cls, digests])
+    return hashlib.sha256(payload.encode()).hexdigest()[:16]
+
+
+def _load(image_file, imgsz, cv2_flag, num_cls):
+    image = cv2.imread(image_file, cv2_flag)
+    labels = read_labels(label_path(image_file), num_cls)
+    if image is None or labels is None:
+        return None, None, labels
+    resized = resize_long_side(image, imgsz)
+    if resized.ndim == 2:
+        resized = resized[..., None]  # grayscale stays HxWx1, as ultralytics loads it
+    return resized, image.shape[:2], labels
+
+
+def build_cache(image_files, path, imgsz, workers=None, cv2_flag=cv2.IMREAD_COLOR, num_cls=None):
+    """Decode, resize and append every image to images.bin and write the index; unreadable images are marked invalid."""
+    n = len(image_files)
+    workers = workers or os.cpu_count() or 1
+    offsets = np.zeros(n, dtype=np.int64)
+    shapes = np.zeros((n, 3), dtype=np.int32)  # resized (h, w, channels)
+    original_shapes = np.zeros((n, 2), dtype=np.int32)
+    valid = np.zeros(n, dtype=bool)
+    label_counts = np.zeros(n, dtype=np.int64)
+    labels = []
+    offset = 0
+    # In input order, with only a few decoded images in flight behind a slow one
+    loaded = iter_prepared(image_files, imgsz, workers, 2 * workers,
+                           lambda f, imgsz: _load(f, imgsz, cv2_flag, num_cls))
+    with open(os.path.join(path, IMAGES_FILE), 'wb') as out:
+        for i, (image, hw0, lb) in enumerate(loaded):
+            if image is None:
+                continue
+            out.write(np.ascontiguousarray(image).tobytes())
+            offsets[i], shapes[i], original_shapes[i], valid[i] = offset, image.shape, hw0, True
+            offset += image.nbytes
+            label_counts[i] = len(lb)
+            labels.append(lb)
+    labels = np.concatenate(labels) if labels else np.zeros((0, 5), dtype=np.float32)
+    np.savez(os.path.join(path, INDEX_FILE), offsets=offsets, shapes=shapes, original_shapes=original_shapes,
+             valid=valid, label_offsets=np.concatenate([[0], np.cumsum(label_counts)]), labels=labels)
+    return int(valid.sum()), offset
+
+
+def open_or_build(image_files, cache_dir=DEFAULT_CACHE_DIR, imgsz=640, workers=None, cv2_flag=cv2.IMREAD_COLOR,
+                  num_cls=None):
+    """
+    TrainCache for image_files at imgsz, building it when no cache with the current content key exists.
+
+    Args:
+        image_files: Images of one split, in dataset order
+        cache_dir: Directory holding all caches and the digest memo
+        imgsz: Training image size
+        workers: Threads hashing and decoding
+        cv2_flag: cv2.imread flag for the dataset's channels (the dataset's cv2_flag)
+        num_cls: Class count labels must stay below; None skips the check (single_cls)
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    memo = DigestMemo(os.path.join(cache_dir, DIGESTS_FILE))
+    key = content_key(image_files, imgsz, memo, workers, cv2_flag, num_cls)
+    memo.save()
+    path = os.path.join(cache_dir, key)
+    if not os.path.exists(os.path.join(path, INDEX_FILE)):
+        tmp_path = tempfile.mkdtemp(prefix=f'.{key}-', dir=cache_dir)
+        count, size = build_cache(image_files, tmp_path, imgsz, workers, cv2_flag, num_cls)
+        try:
+            os.rename(tmp_path, path)
+            print(f"Cached {count}/{len(image_files)} images ({size / 1e9:.2f} GB) at imgsz {imgsz} in {path}")
+        except OSError:  # another job finished the same cache first
+            shutil.rmtree(tmp_path, ignore_errors=True)
+    return TrainCache(path)
+
+
+class TrainCache:
+    """
+    Read side of a cache: resized images from the memory-mapped images.bin and labels from the index.
+
+    The memory map is opened lazily and not pickled, so dataloader workers each
+    map the file themselves and share its pages through the OS page cache.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with np.load(os.path.join(path, INDEX_FILE)) as index:
+            self.offsets = index['offsets']
+            self.shapes = index['shapes']
+            self.original_shapes = index['original_shapes']
+            self.valid = index['valid']
+            self.label_offsets = index['label_offsets']
+            self.labels = index['labels']
+        self._images = None
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def image(self, i):
+        """(resized HxWxC image, original (h, w)); the image is a copy, safe to augment in place."""
+        if self._images is None:
+            self._images = np.memmap(os.path.join(self.path, IMAGES_FILE), dtype=np.uint8, mode='r')
+        h, w, c = self.shapes[i]
+        start = self.offsets[i]
+        image = np.array(self._images[start:start + h * w * c]).reshape(h, w, c)
+        return image, tuple(int(v) for v in self.original_shapes[i])
+
+    def image_labels(self, i):
+        """(Nx1 classes, Nx4 normalized xywh boxes) of image i."""
+        rows = self.labels[self.label_offsets[i]:self.label_offsets[i + 1]]
+        return rows[:, 0:1].copy(), rows[:, 1:].copy()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_images'] = None
+        return state
+
+
+def cached_trainer(cache_dir=DEFAULT_CACHE_DIR, workers=None):
+    """
+    DetectionTrainer subclass whose detection datasets read images and labels from train caches.
+
+    Pass it as model.train(trainer=cached_trainer()). Augmentation is unchanged:
+    the cache only replaces the decode + resize and the label parsing. Other
+    tasks and non-rect image loading fall back to ultralytics' own code.
+    """
+    from ultralytics.data.dataset import YOLODataset
+    from ultralytics.data.utils import get_split_fraction
+    from ultralytics.models.yolo.detect import DetectionTrainer
+    from ultralytics.utils import colorstr
+    from ultralytics.utils.torch_utils import unwrap_model
+
+    class CachedYOLODataset(YOLODataset):
+        def get_labels(self):
+            # The class count verify_image_label checks against; single_cls accepts any class
+            num_cls = None if self.single_cls else self.data.get("bg_class_idx") or len(self.data["names"])
+            self.train_cache = open_or_build(self.im_files, cache_dir, self.imgsz, workers,
+                                             cv2_flag=self.cv2_flag, num_cls=num_cls)
+            rows = np.flatnonzero(self.train_cache.valid)
+            if not len(rows):
+                raise RuntimeError(f"No valid images found in {self.train_cache.path}")
+            if len(rows) < len(self.im_files):
+                print(f"{self.prefix}Skipping {len(self.im_files) - len(rows)} unreadable images or invalid labels")
+            self.cache_rows = rows
+            self.im_files = [self.im_files[i] for i in rows]
+            self.label_files = [label_path(f) for f in self.im_files]
+            labels = []
+            for im_file, i in zip(self.im_files, rows):
+                cls, bboxes = self.train_cache.image_labels(i)
+                labels.append({"im_file": im_file, "shape": tuple(self.train_cache.original_shapes[i]), "cls": cls,
+                               "bboxes": bboxes, "segments": [], "keypoints": None, "normalized": True,
+                               "bbox_format": "xywh"})
+            return labels
+
+        def load_image(self, i, rect_mode=True, resize_short=False):
+            if not rect_mode or resize_short or self.cache == "ram":
+                return super().load_image(i, rect_mode, resize_short)
+            image, hw0 = self.train_cache.image(self.cache_rows[i])
+            if self.augment:
+                # Mosaic draws its partner images from this buffer, as with uncached loading
+                self.buffer.append(i)
+                if 1 < len(self.buffer) >= self.max_buffer_length:
+                    self.buffer.pop(0)
+            return image, hw0, image.shape[:2]
+
+    class CachedDetectionTrainer(DetectionTrainer):
+        def build_dataset(self, img_path, mode="train", batch=None):
+            if self.args.task != "detect":
+                return super().build_dataset(img_path, mode, batch)
+            # The arguments ultralytics.data.build_yolo_dataset passes to a detection dataset
+            cfg = self.args
+            fraction = 1.0 if self.data.get("complete") else get_split_fraction(
+                cfg.fraction, "train" if mode == "train" else cfg.split)
+            return CachedYOLODataset(
+                img_path=img_path, imgsz=cfg.imgsz, batch_size=batch, augment=mode == "train", hyp=cfg,
+                rect=cfg.rect or mode == "val", cache=cfg.cache or None, single_cls=cfg.single_cls or False,
+                stride=max(int(unwrap_model(self.model).stride.max()), 32), pad=0.0 if mode == "train" else 0.5,
+                prefix=colorstr(f"{mode}: "), task=cfg.task, classes=cfg.classes, data=self.data, fraction=fraction)
+
+    return CachedDetectionTrainer
+
+
+def split_images(path):
+    """Image files of a dataset split (directory or list file), listed and sorted the way ultralytics does."""
+    from ultralytics.data.utils import IMG_FORMATS
+
+    files = []
+    for p in path if isinstance(path, list) else [path]:
+        if os.path.isdir(p):
+            files += glob.glob(os.path.join(glob.escape(p), '**', '*.*'), recursive=True)
+        else:
+            with open(p, encoding='utf-8') as f:
+                parent = os.path.dirname(p) + os.sep
+                files += [x.replace('./', parent, 1) if x.startswith('./') else x
+                          for x in f.read().strip().splitlines()]
+    return sorted(x.replace('/', os.sep) for x in files if x.rpartition('.')[-1].lower() in IMG_FORMATS)
+
+
+if __name__ == "__main__":
+    from train import DATASET_YAML, IMG_SIZE
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--data', default=DATASET_YAML, help='Dataset YAML used by train.py')
+    parser.add_argument('--splits', nargs='+', default=['train'], help='Splits of the YAML to cache')
+    parser.add_argument('--imgsz', type=int, default=IMG_SIZE)
+    parser.add_argument('--cache_dir', default=DEFAULT_CACHE_DIR)
+    parser.add_argument('--workers', type=int, default=None, help='Hash and decode threads')
+    args = parser.parse_args()
+
+    from ultralytics.data.utils import check_det_dataset
+
+    data = check_det_dataset(args.data)
+    # Same read flag and class check as the training datasets, so they find this cache
+    cv2_flag = {1: cv2.IMREAD_GRAYSCALE, 3: cv2.IMREAD_COLOR}.get(data.get('channels', 3), cv2.IMREAD_UNCHANGED)
+    num_cls = data.get('bg_class_idx') or len(data['names'])
+    for split in args.splits:
+        cache = open_or_build(split_images(data[split]), args.cache_dir, args.imgsz, args.workers, cv2_flag, num_cls)
+        print(f"{split}: {int(cache.valid.sum())} images, {len(cache.labels)} boxes in {cache.path}")
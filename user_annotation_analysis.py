@@ -1,6 +1,262 @@
+import os
+import json
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
 import pandas as pd
 
-def export_high_agreement_to_coco(annotations_df, images_df, output_json, agreement_matrix, user_ids, agreement_threshold=0.8):
+MISSING = -1  # matrix value of a user who did not label a bbox
+IOU_THRESHOLD = 0.5  # new boxes from different users overlapping this much are the same bbox
+IMAGES_PER_TASK = 256
+
+COCO_CATEGORIES = [
+    {"id": i+1, "name": name} for i, name in enumerate([
+        "Hatchback", "Sedan", "SUV", "MUV", "Bus", "Truck", "Three-wheeler",
+        "Two-wheeler", "LCV", "Mini-bus", "Mini-truck", "tempo-traveller",
+        "bicycle", "people", "white-swift-dzire"
+    ])
+]
+
+def iou_matrix(a, b):
+    """Pairwise IoU of Nx4 and Mx4 xywh boxes as an NxM array."""
+    a = np.asarray(a, dtype=np.float64).reshape(-1, 4)
+    b = np.asarray(b, dtype=np.float64).reshape(-1, 4)
+    ix1 = np.maximum(a[:, None, 0], b[None, :, 0])
+    iy1 = np.maximum(a[:, None, 1], b[None, :, 1])
+    ix2 = np.minimum(a[:, None, 0] + a[:, None, 2], b[None, :, 0] + b[None, :, 2])
+    iy2 = np.minimum(a[:, None, 1] + a[:, None, 3], b[None, :, 1] + b[None, :, 3])
+    inter = (ix2 - ix1).clip(0) * (iy2 - iy1).clip(0)
+    union = (a[:, 2] * a[:, 3])[:, None] + (b[:, 2] * b[:, 3])[None, :] - inter
+    return np.divide(inter, union, out=np.zeros_like(inter), where=union > 0)
+
+def _match_new_boxes(users, boxes, iou_threshold):
+    """
+    Group user-drawn boxes of one image into bboxes: each box joins the best-overlapping
+    existing bbox that this user has not voted on yet, otherwise it starts a new one.
+
+    Returns:
+        Per-box cluster index and the box index anchoring each cluster
+    """
+    ious = iou_matrix(boxes, boxes)  # computed once, the greedy pass only indexes it
+    cluster = np.full(len(boxes), -1, dtype=np.int64)
+    anchors = []
+    voters = []
+    for i in range(len(boxes)):
+        if anchors:
+            overlap = ious[i, anchors]
+            overlap[[users[i] in v for v in voters]] = 0
+            best = int(overlap.argmax())
+            if overlap[best] >= iou_threshold:
+                cluster[i] = best
+                voters[best].add(users[i])
+                continue
+        cluster[i] = len(anchors)
+        anchors.append(i)
+        voters.append({users[i]})
+    return cluster, np.array(anchors, dtype=np.int64)
+
+def image_agreement_matrix(users, baseline_ids, record_ids, boxes, categories, iou_threshold=IOU_THRESHOLD):
+    """
+    Build the user x bbox matrix for one image.
+
+    Baseline boxes are identified by baseline_annotation_id; boxes users drew themselves
+    (no baseline id) are matched across users by IoU. Cells hold the category the user
+    gave the bbox, or MISSING.
+
+    Args:
+        users, baseline_ids, record_ids, boxes, categories: Per-annotation arrays of one image
+            (baseline_ids and categories are float with NaN for missing)
+        iou_threshold: Minimum IoU for two new boxes to be the same bbox
+
+    Returns:
+        (matrix, user_ids, columns, cell_rows): the users x bboxes int matrix, its user ids,
+        the "bbox=<baseline id>" / "bbox=new_<record id>" column names, and the
+        annotation index behind each cell (-1 where MISSING; user-drawn bboxes only
+        point at the annotation anchoring them, the record named in the column)
+    """
+    user_ids, user_row = np.unique(users, return_inverse=True)
+    is_new = np.isnan(baseline_ids)
+
+    base_ids, base_col = np.unique(baseline_ids[~is_new], return_inverse=True)
+    cluster, anchors = _match_new_boxes(users[is_new], boxes[is_new], iou_threshold)
+    columns = [f"bbox={int(b)}" for b in base_ids] + [f"bbox=new_{int(r)}" for r in record_ids[is_new][anchors]]
+
+    col = np.empty(len(users), dtype=np.int64)
+    col[~is_new] = base_col
+    col[is_new] = len(base_ids) + cluster
+
+    matrix = np.full((len(user_ids), len(columns)), MISSING, dtype=np.int64)
+    cell_rows = np.full(matrix.shape, -1, dtype=np.int64)
+    voted = ~np.isnan(categories)
+    # Reverse order so the first annotation of a user wins when one cell gets several
+    rows = np.flatnonzero(voted)[::-1]
+    matrix[user_row[rows], col[rows]] = categories[rows].astype(np.int64)
+    rows = rows[~is_new[rows] | np.isin(rows, np.flatnonzero(is_new)[anchors])]
+    cell_rows[user_row[rows], col[rows]] = rows
+    return matrix, user_ids, columns, cell_rows
+
+def column_agreement(matrix, agreement_threshold=0.8):
+    """
+    Per-bbox majority label and whether it is agreed on.
+
+    A bbox is agreed when at least two users labelled it and the majority label holds
+    at least agreement_threshold of their votes (1.0 requires unanimity).
+
+    Returns:
+        (agreed, majority) boolean and int arrays over the matrix columns
+    """
+    votes = matrix != MISSING
+    n_votes = votes.sum(axis=0)
+    labels = np.unique(matrix[votes])
+    if len(labels) == 0:
+        return np.zeros(matrix.shape[1], dtype=bool), np.full(matrix.shape[1], MISSING)
+    counts = (matrix[None, :, :] == labels[:, None, None]).sum(axis=1)  # labels x bboxes
+    majority = labels[counts.argmax(axis=0)]
+    share = counts.max(axis=0) / np.maximum(n_votes, 1)
+    return (n_votes > 1) & (share >= agreement_threshold), majority
+
+def _agreed_rows(matrix, columns, cell_rows, agreement_threshold):
+    """
+    Annotation indices exported for agreed bboxes: the majority votes on a baseline
+    bbox, and the anchoring record of a user-drawn one.
+    """
+    agreed, majority = column_agreement(matrix, agreement_threshold)
+    is_new = np.array([c.startswith('bbox=new_') for c in columns], dtype=bool)
+    keep = ((matrix == majority[None, :]) | is_new[None, :]) & agreed[None, :] & (cell_rows >= 0)
+    return np.sort(cell_rows[keep])
+
+def _agreement_task(task):
+    """Worker: agreed annotation positions for a batch of images."""
+    groups, users, baseline_ids, record_ids, boxes, categories, iou_threshold, agreement_threshold = task
+    kept = []
+    for start, stop in groups:
+        matrix, _, columns, cell_rows = image_agreement_matrix(
+            users[start:stop], baseline_ids[start:stop], record_ids[start:stop],
+            boxes[start:stop], categories[start:stop], iou_threshold
+        )
+        kept.append(start + _agreed_rows(matrix, columns, cell_rows, agreement_threshold))
+    return np.concatenate(kept) if kept else np.empty(0, dtype=np.int64)
+
+def build_id_index(annotations_df):
+    """Prebuilt lookups from annotation id and baseline_annotation_id to row positions."""
+    return {
+        "id": pd.Index(annotations_df['id']),
+        "baseline": annotations_df.groupby('baseline_annotation_id', sort=False).indices
+    }
+
+def process_image_annotations(image_id, data, logger=None, iou_threshold=IOU_THRESHOLD):
+    """
+    Agreement matrix of one image, as consumed by export_high_agreement_to_coco.
+
+    Args:
+        image_id: Image to analyse
+        data: dict with 'annotations_df'; the per-image row index is cached in it as 'image_rows'
+        logger: Optional logger for a one-line summary
+
+    Returns:
+        (matrix DataFrame of users x bbox columns, user_ids list)
+    """
+    df = data['annotations_df']
+    if 'image_rows' not in data:
+        data['image_rows'] = df.groupby('image_id', sort=False).indices
+    rows = data['image_rows'].get(image_id, np.empty(0, dtype=np.int64))
+    sub = df.iloc[rows]
+    matrix, user_ids, columns, _ = image_agreement_matrix(
+        sub['user_id'].to_numpy(),
+        sub['baseline_annotation_id'].to_numpy(dtype=np.float64),
+        sub['id'].to_numpy(),
+        sub[['x', 'y', 'width', 'height']].to_numpy(dtype=np.float64),
+        sub['user_submitted_category_id'].to_numpy(dtype=np.float64),
+        iou_threshold
+    )
+    if logger is not None:
+        logger.info(f"Image {image_id}: {len(user_ids)} users x {len(columns)} bboxes")
+    return pd.DataFrame(matrix, index=user_ids, columns=columns), list(user_ids)
+
+def dataset_agreement(annotations_df, agreement_threshold=0.8, iou_threshold=IOU_THRESHOLD, workers=None):
+    """
+    Row positions of high-agreement annotations across every image, computed in parallel.
+
+    Images are grouped into tasks of IMAGES_PER_TASK and handed to a process pool
+    together with just the columns the matrices need.
+
+    Returns:
+        Sorted positional indices into annotations_df
+    """
+    order = np.argsort(annotations_df['image_id'].to_numpy(), kind='stable')
+    df = annotations_df.iloc[order]
+    image_ids = df['image_id'].to_numpy()
+    bounds = np.flatnonzero(np.r_[True, image_ids[1:] != image_ids[:-1], True]) if len(df) else np.array([0])
+    groups = list(zip(bounds[:-1].tolist(), bounds[1:].tolist()))
+
+    users = df['user_id'].to_numpy()
+    baseline_ids = df['baseline_annotation_id'].to_numpy(dtype=np.float64)
+    record_ids = df['id'].to_numpy()
+    boxes = df[['x', 'y', 'width', 'height']].to_numpy(dtype=np.float64)
+    categories = df['user_submitted_category_id'].to_numpy(dtype=np.float64)
+
+    tasks = []
+    for i in range(0, len(groups), IMAGES_PER_TASK):
+        batch = groups[i:i + IMAGES_PER_TASK]
+        start, stop = batch[0][0], batch[-1][1]
+        local = [(a - start, b - start) for a, b in batch]
+        tasks.append((local, users[start:stop], baseline_ids[start:stop], record_ids[start:stop],
+                      boxes[start:stop], categories[start:stop], iou_threshold, agreement_threshold))
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        results = list(pool.map(_agreement_task, tasks))
+    # Task results are relative to the first row of their batch
+    kept = [r + groups[i * IMAGES_PER_TASK][0] for i, r in enumerate(results) if len(r)]
+    return np.sort(order[np.concatenate(kept)]) if kept else np.empty(0, dtype=np.int64)
+
+def process_dataframe_to_coco(df, image_list):
+    coco = {
+        "images": [],
+        "annotations": [],
+        "categories": COCO_CATEGORIES
+    }
+    for img_id, image_name in enumerate(image_list, start=1):
+        image_info = {
+            "id": img_id,
+            "file_name": image_name,
+            "width": 1920,
+            "height": 1080
+        }
+        coco['images'].append(image_info)
+    # Whole-column conversion instead of iterrows
+    cat_ids = df['user_submitted_category_id']
+    kept = df[cat_ids.notna().to_numpy()]
+    image_ids = pd.Categorical(kept['image_name'], categories=image_list).codes + 1
+    area = kept['width'] * kept['height']
+    coco['annotations'] = [
+        {
+            "id": ann_id,
+            "image_id": image_id,
+            "category_id": cat_id,
+            "bbox": [x, y, width, height],
+            "area": a,
+            "iscrowd": 0,
+            "segmentation": []
+        }
+        for ann_id, image_id, cat_id, x, y, width, height, a in zip(
+            range(1, len(kept) + 1), image_ids.tolist(),
+            kept['user_submitted_category_id'].astype(int).tolist(),
+            kept['x'].tolist(), kept['y'].tolist(), kept['width'].tolist(), kept['height'].tolist(),
+            area.tolist()
+        )
+    ]
+    return coco
+
+def _write_coco(filtered_df, output_json):
+    images = list(filtered_df['image_name'].unique())
+    coco = process_dataframe_to_coco(filtered_df, images)
+    os.makedirs(os.path.dirname(output_json), exist_ok=True)
+    with open(output_json, 'w') as f:
+        json.dump(coco, f, indent=2)
+    print(f"High-agreement COCO JSON created at {output_json}")
+
+def export_high_agreement_to_coco(annotations_df, images_df, output_json, agreement_matrix, user_ids,
+                                  agreement_threshold=0.8, id_index=None):
     """
     Export only high-agreement annotations to COCO format for training.
     Args:
@@ -10,89 +266,49 @@ def export_high_agreement_to_coco(annotations_df, images_df, output_json, agreem
         agreement_matrix (DataFrame): Matrix of user agreement per bbox
         user_ids (list): List of user IDs in the matrix
         agreement_threshold (float): Minimum agreement rate to keep a bbox
+        id_index (dict): build_id_index(annotations_df), to reuse across calls
     """
-    import json, os
-    # Find bbox columns with agreement above threshold
-    high_agreement_bboxes = []
-    for col in agreement_matrix.columns:
-        non_missing = agreement_matrix[col][agreement_matrix[col] != -1]
-        if len(non_missing) > 1:
-            agreement = len(set(non_missing)) == 1
-            if agreement:
-                high_agreement_bboxes.append(col)
-    # Filter annotations_df to only those bbox_ids
-    filtered_annots = []
-    for bbox_col in high_agreement_bboxes:
+    id_index = id_index or build_id_index(annotations_df)
+    matrix = agreement_matrix.to_numpy(dtype=np.int64)
+    agreed, majority = column_agreement(matrix, agreement_threshold)
+
+    # Look the agreed bboxes up through the prebuilt index instead of scanning annotations_df per bbox
+    positions = []
+    categories = annotations_df['user_submitted_category_id'].to_numpy(dtype=np.float64)
+    for bbox_col, label in zip(agreement_matrix.columns[agreed], majority[agreed]):
         bbox_id = bbox_col.split('=')[1]
-        # Find all rows in annotations_df with this baseline_annotation_id or new id
         if bbox_id.startswith('new_'):
-            record_id = int(bbox_id.replace('new_', ''))
-            filtered_annots.append(annotations_df[annotations_df['id'] == record_id])
+            rows = id_index['id'].get_indexer([int(bbox_id.replace('new_', ''))])
+            rows = rows[rows >= 0]
         else:
-            filtered_annots.append(annotations_df[annotations_df['baseline_annotation_id'] == int(bbox_id)])
-    if filtered_annots:
-        filtered_df = pd.concat(filtered_annots)
-    else:
-        filtered_df = pd.DataFrame(columns=annotations_df.columns)
-    # Use your previous COCO export logic here
-    images = list(filtered_df['image_name'].unique())
-    def process_dataframe_to_coco(df, image_list):
-        # (You can copy your previous process_dataframe_to_coco function here)
-        coco = {
-            "images": [],
-            "annotations": [],
-            "categories": [
-                {"id": i+1, "name": name} for i, name in enumerate([
-                    "Hatchback", "Sedan", "SUV", "MUV", "Bus", "Truck", "Three-wheeler", 
-                    "Two-wheeler", "LCV", "Mini-bus", "Mini-truck", "tempo-traveller", 
-                    "bicycle", "people", "white-swift-dzire"
-                ])
-            ]
-        }
-        image_id_map = {}
-        ann_id = 1
-        img_id = 1
-        for image_name in image_list:
-            image_info = {
-                "id": img_id,
-                "file_name": image_name,
-                "width": 1920,
-                "height": 1080
-            }
-            coco['images'].append(image_info)
-            image_id_map[image_name] = img_id
-            img_id += 1
-        for _, row in df.iterrows():
-            image_name = row['image_name']
-            cat_id = row['user_submitted_category_id']
-            if pd.isna(cat_id):
-                continue
-            x = row['x']
-            y = row['y']
-            width = row['width']
-            height = row['height']
-            coco['annotations'].append({
-                "id": ann_id,
-                "image_id": image_id_map[image_name],
-                "category_id": int(cat_id),
-                "bbox": [x, y, width, height],
-                "area": width * height,
-                "iscrowd": 0,
-                "segmentation": []
-            })
-            ann_id += 1
-        return coco
-    coco = process_dataframe_to_coco(filtered_df, images)
-    os.makedirs(os.path.dirname(output_json), exist_ok=True)
-    with open(output_json, 'w') as f:
-        json.dump(coco, f, indent=2)
-    print(f"High-agreement COCO JSON created at {output_json}")
+            rows = id_index['baseline'].get(float(bbox_id), np.empty(0, dtype=np.int64))
+            rows = rows[categories[rows] == label]  # only the majority votes
+        positions.append(rows)
+    positions = np.concatenate(positions) if positions else np.empty(0, dtype=np.int64)
+    _write_coco(annotations_df.iloc[positions], output_json)
+
+def export_dataset_high_agreement_to_coco(annotations_df, images_df, output_json, agreement_threshold=0.8,
+                                          iou_threshold=IOU_THRESHOLD, workers=None):
+    """
+    Export the high-agreement annotations of every image, with the per-image matrices built in parallel.
+    Args:
+        annotations_df (DataFrame): All user annotations
+        images_df (DataFrame): Image metadata
+        output_json (str): Path to output COCO JSON
+        agreement_threshold (float): Minimum agreement rate to keep a bbox
+        iou_threshold (float): Minimum IoU for user-drawn boxes to count as the same bbox
+        workers (int): Worker processes (defaults to the CPU count)
+    """
+    positions = dataset_agreement(annotations_df, agreement_threshold, iou_threshold, workers)
+    _write_coco(annotations_df.iloc[positions], output_json)
 
 # Example usage after your analysis:
 if __name__ == "__main__":
     # ... after your analysis code ...
-    # Suppose you have run process_image_annotations for a specific image_id:
+    # Agreement matrix for a specific image_id:
     # matrix, user_ids = process_image_annotations(image_id, data, logger)
     # To export high-agreement bboxes for this image:
     # export_high_agreement_to_coco(data['annotations_df'], data['images_df'], 'output/high_agreement.json', matrix, user_ids, agreement_threshold=0.8)
-    pass
\ No newline at end of file
+    # Or for the whole dataset, in parallel across images:
+    # export_dataset_high_agreement_to_coco(data['annotations_df'], data['images_df'], 'output/high_agreement.json')
+    pass
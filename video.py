@@ -0,0 +1,151 @@
+import os
+import queue
+import threading
+
+import cv2
+
+VIDEO_EXTENSIONS = ('.mp4', '.avi', '.mov', '.mkv', '.m4v', '.ts')
+_END = object()
+
+
+def is_video(path):
+    return os.path.isfile(path) and path.lower().endswith(VIDEO_EXTENSIONS)
+
+
+def frame_file_name(video_path, frame_index):
+    """Name a frame is recorded under in COCO, as if it had been extracted to JPEG."""
+    stem = os.path.splitext(os.path.basename(video_path))[0]
+    return f"{stem}_{frame_index:06d}.jpg"
+
+
+def keyframe_indices(video_path):
+    """
+    Indices of the keyframes of a video, found by demuxing packets without decoding them.
+
+    Needs OpenCV's FFmpeg backend; returns None when keyframe flags are not available.
+    """
+    if not hasattr(cv2, 'CAP_PROP_LRF_HAS_KEY_FRAME'):
+        return None
+    cap = cv2.VideoCapture(video_path, cv2.CAP_FFMPEG)
+    try:
+        if not cap.isOpened() or not cap.set(cv2.CAP_PROP_FORMAT, -1):  # -1: raw packets, no decode
+            return None
+        indices = []
+        index = 0
+        while cap.grab():
+            if cap.get(cv2.CAP_PROP_LRF_HAS_KEY_FRAME):
+                indices.append(index)
+            index += 1
+        return indices
+    finally:
+        cap.release()
+
+
+def _put(out, item, stop):
+    """Queue item unless the consumer has gone away."""
+    while not stop.is_set():
+        try:
+            out.put(item, timeout=0.1)
+            return
+        except queue.Full:
+            continue
+
+
+def video_fps(video_path):
+    """Frame rate the container reports, or 0.0 when it reports none (some containers and streams)."""
+    cap = cv2.VideoCapture(video_path)
+    try:
+        return (cap.get(cv2.CAP_PROP_FPS) or 0.0) if cap.isOpened() else 0.0
+    finally:
+        cap.release()
+
+
+def _decode(video_path, stride, keyframes, out, stop, fps=None):
+    cap = cv2.VideoCapture(video_path)
+    try:
+        if not cap.isOpened():
+            raise ValueError(f"Could not open video: {video_path}")
+        fps = fps or cap.get(cv2.CAP_PROP_FPS) or 0.0
+
+        def timestamp_ms(index):
+            if fps:
+                return round(index * 1000.0 / fps, 3)
+            # No frame rate: the decoder's presentation time of the frame just read, if it has one
+            position = cap.get(cv2.CAP_PROP_POS_MSEC)
+            return round(position, 3) if position > 0 or index == 0 else None
+
+        def emit(index, image):
+            _put(out, {
+                "image": image,
+                "path": frame_file_name(video_path, index),
+                "frame_index": index,
+                "timestamp_ms": timestamp_ms(index),
+            }, stop)
+
+        if keyframes is not None:
+            position = 0
+            for index in keyframes[::stride]:
+                if index != position:
+                    cap.set(cv2.CAP_PROP_POS_FRAMES, index)  # jump straight to the keyframe
+                ok, image = cap.read()
+                if not ok or stop.is_set():
+                    break
+                emit(index, image)
+                position = index + 1
+            return
+
+        index = 0
+        while not stop.is_set():
+            if index % stride:
+                # grab() demuxes and decodes but skips the colour conversion and copy of retrieve()
+                if not cap.grab():
+                    break
+            else:
+                ok, image = cap.read()
+                if not ok:
+                    break
+                emit(index, image)
+            index += 1
+    except Exception as e:
+        _put(out, e, stop)
+    finally:
+        cap.release()
+        _put(out, _END, stop)
+
+
+def iter_video_frames(video_path, stride=1, keyframes_only=False, queue_size=32, fps=None):
+    """
+    Decode video frames on a background thread and yield them as frame dicts.
+
+    Args:
+        video_path: Video file (anything OpenCV can open)
+        stride: Keep every stride-th frame (or keyframe, with keyframes_only)
+        keyframes_only: Only decode keyframes, seeking between them; falls back to
+            stride sampling when the backend cannot report keyframes
+        queue_size: Decoded frames buffered ahead of the consumer
+        fps: Frame rate to time frames by, overriding the container's; without either,
+            timestamps come from the decoder's position and are None where it has none
+
+    Yields:
+        {"image": BGR array, "path": frame file name, "frame_index", "timestamp_ms"}
+    """
+    keyframes = keyframe_indices(video_path) if keyframes_only else None
+    if keyframes_only and keyframes is None:
+        print("Keyframe flags are not available for this video; sampling by stride instead")
+
+    out = queue.Queue(maxsize=queue_size)
+    stop = threading.Event()
+    thread = threading.Thread(target=_decode, args=(video_path, max(stride, 1), keyframes, out, stop, fps),
+                              daemon=True)
+    thread.start()
+    try:
+        while True:
+            frame = out.get()
+            if frame is _END:
+                break
+            if isinstance(frame, Exception):
+                raise frame
+            yield frame
+    finally:
+        stop.set()
+        thread.join()
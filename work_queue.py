@@ -0,0 +1,370 @@
+"""
+Multi-node inference over a shared directory.
+
+The images of a directory are chunked into tasks listed in a manifest. Workers
+on any node claim tasks one at a time by renaming them out of todo/, so faster
+nodes simply claim more of them. A worker renews its lease by touching its claim
+while it runs; claims not renewed for --lease_timeout seconds (a dead worker or
+node) are moved back to todo/ by the next worker that looks. The reducer writes
+the per-task results as one COCO file, with the ids a single main.py run assigns.
+A task that raises (e.g. on a corrupt image) is recorded in failed/ with its
+error instead of taking its worker down; move it back to todo/ to retry it.
+
+    python work_queue.py init --image_dir data/images --queue_dir /shared/queue
+    python work_queue.py work --queue_dir /shared/queue       # on every node, as often as you like
+    python work_queue.py status --queue_dir /shared/queue
+    python work_queue.py reduce --queue_dir /shared/queue --output_dir results/
+
+Layout of queue_dir:
+
+    manifest.json                 image list, chunking, inference settings and weights digest
+    todo/<task>.json              unclaimed tasks
+    claimed/<task>.<owner>.json   tasks being run; the file's mtime is the lease
+    results/<task>.npz            finished tasks
+    failed/<task>.json            tasks that raised, with the error and the worker
+"""
+import os
+import json
+import time
+import socket
+import argparse
+
+import numpy as np
+
+from coco_writer import CocoWriter
+from detection_cache import weights_digest
+from detection_store import annotation_lines
+from inference import BACKENDS, CATEGORIES, IMG_SIZE, MODEL_PATH, backend_model_path, detect, list_images, load_forward
+
+CHUNK_SIZE = 256  # images per task
+LEASE_TIMEOUT = 600  # seconds without renewal after which a claimed task is re-queued
+POLL_INTERVAL = 10  # seconds between looks at the queue while other workers hold the last tasks
+MANIFEST_FILE = 'manifest.json'
+
+
+def task_name(task):
+    return f'{task:06d}'
+
+
+def _write_json_atomic(path, data):
+    tmp_path = f'{path}.{worker_id()}.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+
+def worker_id():
+    """Name of this worker, unique across the nodes sharing the queue."""
+    return f'{socket.gethostname()}-{os.getpid()}'
+
+
+def create_queue(image_dir, queue_dir, chunk_size=CHUNK_SIZE, batch_size=8, imgsz=IMG_SIZE, backend="torch",
+                 model_path=MODEL_PATH):
+    """
+    Write the manifest and one todo file per chunk of images.
+
+    The manifest is written last, so workers never see a partial queue. An
+    existing queue is left as it is, which makes init safe to repeat.
+
+    Args:
+        image_dir: Directory of the images; must be readable at the same path on every node
+        queue_dir: Shared directory holding the queue
+        chunk_size: Images per task
+        batch_size: Images per forward pass inside a worker
+        imgsz: Inference size of the long image side
+        backend: Inference backend every worker loads (see inference.load_forward)
+        model_path: Weights every worker loads
+    """
+    manifest_path = os.path.join(queue_dir, MANIFEST_FILE)
+    if os.path.exists(manifest_path):
+        print(f"{queue_dir} already has a manifest; leaving it unchanged")
+        return load_manifest(queue_dir)
+
+    for sub in ('todo', 'claimed', 'results', 'failed'):
+        os.makedirs(os.path.join(queue_dir, sub), exist_ok=True)
+    images = list_images(image_dir)
+    num_tasks = (len(images) + chunk_size - 1) // chunk_size
+    for task in range(num_tasks):
+        _write_json_atomic(os.path.join(queue_dir, 'todo', f'{task_name(task)}.json'),
+                           {"task": task, "start": task * chunk_size, "end": min((task + 1) * chunk_size, len(images))})
+    manifest = {
+        "image_dir": os.path.abspath(image_dir),
+        "images": images,
+        "num_tasks": num_tasks,
+        "chunk_size": chunk_size,
+        "model_path": model_path,
+        "weights_digest": weights_digest(backend_model_path(backend, model_path)),
+        "settings": {"batch_size": batch_size, "imgsz": imgsz, "backend": backend},
+    }
+    _write_json_atomic(manifest_path, manifest)
+    print(f"Queued {len(images)} images as {num_tasks} tasks in {queue_dir}")
+    return manifest
+
+
+def load_manifest(queue_dir):
+    with open(os.path.join(queue_dir, MANIFEST_FILE), 'r') as f:
+        return json.load(f)
+
+
+def result_path(queue_dir, task):
+    return os.path.join(queue_dir, 'results', f'{task_name(task)}.npz')
+
+
+def failed_path(queue_dir, task):
+    return os.path.join(queue_dir, 'failed', f'{task_name(task)}.json')
+
+
+def failed_tasks(queue_dir):
+    """Failure records of the tasks in failed/, by task number."""
+    failed_dir = os.path.join(queue_dir, 'failed')
+    if not os.path.isdir(failed_dir):  # queues created before failures were recorded
+        return []
+    records = []
+    for name in sorted(os.listdir(failed_dir)):
+        if name.endswith('.json'):
+            try:
+                with open(os.path.join(failed_dir, name), 'r') as f:
+                    records.append(json.load(f))
+            except FileNotFoundError:
+                pass  # moved back to todo/ meanwhile
+    return records
+
+
+def requeue_expired(queue_dir, lease_timeout=LEASE_TIMEOUT):
+    """Move claims not renewed within lease_timeout back to todo/; returns the number re-queued."""
+    claimed_dir = os.path.join(queue_dir, 'claimed')
+    now = time.time()
+    requeued = 0
+    for name in os.listdir(claimed_dir):
+        path = os.path.join(claimed_dir, name)
+        try:
+            if now - os.path.getmtime(path) <= lease_timeout:
+                continue
+            task = int(name.split('.')[0])
+            if os.path.exists(result_path(queue_dir, task)) or os.path.exists(failed_path(queue_dir, task)):
+                os.remove(path)  # finished or failed, but the worker died before releasing its claim
+            else:
+                os.rename(path, os.path.join(queue_dir, 'todo', f'{task_name(task)}.json'))
+                print(f"Re-queued task {task} from expired claim {name}")
+                requeued += 1
+        except FileNotFoundError:
+            pass  # another worker got there first
+    return requeued
+
+
+class Lease:
+    """
+    A claimed task. rename() is atomic on POSIX filesystems (NFS and Lustre
+    included), so of several workers renaming the same todo file exactly one wins.
+
+    Args:
+        queue_dir: Shared directory holding the queue
+        name: Task file name in todo/
+        owner: worker_id() of the claiming worker
+    """
+
+    def __init__(self, queue_dir, name, owner):
+        self.owner = owner
+        self.path = os.path.join(queue_dir, 'claimed', f'{name[:-len(".json")]}.{owner}.json')
+        os.rename(os.path.join(queue_dir, 'todo', name), self.path)
+        # rename keeps the mtime of the todo file, which would make the new lease look expired;
+        # if another worker re-queued it in between, this raises FileNotFoundError like a lost race
+        os.utime(self.path)
+        self.renewed = time.time()
+        with open(self.path, 'r') as f:
+            self.task = json.load(f)
+
+    def renew(self, every=0):
+        """Touch the claim if more than `every` seconds passed; False once the lease was lost to a re-queue."""
+        if time.time() - self.renewed < every:
+            return True
+        try:
+            os.utime(self.path)
+        except FileNotFoundError:
+            return False
+        self.renewed = time.time()
+        return True
+
+    def fail(self, queue_dir, error):
+        """Record the task in failed/ with its error, then release the claim so no one retries it."""
+        os.makedirs(os.path.join(queue_dir, 'failed'), exist_ok=True)
+        _write_json_atomic(failed_path(queue_dir, self.task["task"]),
+                           dict(self.task, error=error, worker=self.owner))
+        self.release()
+
+    def release(self):
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+
+def claim_task(queue_dir, owner):
+    """Claim the lowest-numbered unclaimed task; None when todo/ is empty."""
+    for name in sorted(os.listdir(os.path.join(queue_dir, 'todo'))):
+        if not name.endswith('.json'):
+            continue
+        try:
+            return Lease(queue_dir, name, owner)
+        except FileNotFoundError:
+            continue  # claimed by another worker between listdir and rename
+    return None
+
+
+def save_result(path, sizes, dets):
+    """Write one task's image sizes and concatenated detections, atomically."""
+    counts = np.array([len(d) for d in dets], dtype=np.int64)
+    dets = np.concatenate(dets) if dets else np.zeros((0, 6), dtype=np.float32)
+    tmp_path = f'{path}.{worker_id()}.tmp'
+    with open(tmp_path, 'wb') as f:
+        np.savez(f, sizes=np.asarray(sizes, dtype=np.int64).reshape(-1, 2), counts=counts,
+                 dets=dets.astype(np.float32))
+    os.replace(tmp_path, path)
+
+
+def load_result(path):
+    """(sizes, per-image detections) of one finished task."""
+    with np.load(path) as data:
+        sizes, counts, dets = data["sizes"], data["counts"], data["dets"]
+    return sizes, np.split(dets, np.cumsum(counts)[:-1])
+
+
+def run_worker(queue_dir, workers=None, lease_timeout=LEASE_TIMEOUT, poll_interval=POLL_INTERVAL, max_tasks=None):
+    """
+    Claim and run tasks until every task has a result.
+
+    The model is loaded once. While the remaining tasks are claimed by others
+    the worker keeps polling, so it can take over a task whose lease expires.
+    A task that raises is recorded in failed/ and the worker moves on.
+
+    Args:
+        queue_dir: Shared directory holding the queue
+        workers: Image decode threads
+        lease_timeout: Seconds without renewal after which other workers re-queue a claim
+        poll_interval: Seconds between looks at the queue while waiting
+        max_tasks: Stop after this many tasks, failed ones included (None: run until the queue is finished)
+    """
+    manifest = load_manifest(queue_dir)
+    settings = manifest["settings"]
+    weights = backend_model_path(settings["backend"], manifest["model_path"])
+    if weights_digest(weights) != manifest["weights_digest"]:
+        raise RuntimeError(f"{weights} differs from the weights the queue was created with")
+    forward = load_forward(settings["backend"], manifest["model_path"])
+    owner = worker_id()
+    done = 0
+    failed = 0
+
+    while max_tasks is None or done + failed < max_tasks:
+        requeue_expired(queue_dir, lease_timeout)
+        lease = claim_task(queue_dir, owner)
+        if lease is None:
+            if not os.listdir(os.path.join(queue_dir, 'claimed')):
+                break
+            time.sleep(poll_interval)
+            continue
+
+        task = lease.task["task"]
+        paths = [os.path.join(manifest["image_dir"], f)
+                 for f in manifest["images"][lease.task["start"]:lease.task["end"]]]
+        start = time.perf_counter()
+        sizes, dets = [], []
+        try:
+            for item, item_dets in detect(paths, forward, settings["batch_size"], settings["imgsz"], workers):
+                sizes.append((item["width"], item["height"]))
+                dets.append(item_dets)
+                if not lease.renew(every=lease_timeout / 4):
+                    break
+            else:
+                save_result(result_path(queue_dir, task), sizes, dets)
+                lease.release()
+                done += 1
+                print(f"[{owner}] task {task}: {len(paths)} images in {time.perf_counter() - start:.1f}s")
+                continue
+        except Exception as e:
+            # Re-queueing would only hand the same bad input to the next worker
+            lease.fail(queue_dir, f"{type(e).__name__}: {e}")
+            failed += 1
+            print(f"[{owner}] task {task} failed: {type(e).__name__}: {e}")
+            continue
+        print(f"[{owner}] lost the lease on task {task}; leaving it to its new owner")
+    print(f"[{owner}] finished {done} tasks" + (f", {failed} failed" if failed else ""))
+
+
+def queue_status(queue_dir):
+    """(todo, claimed, finished, failed, total) task counts."""
+    manifest = load_manifest(queue_dir)
+    finished = sum(os.path.exists(result_path(queue_dir, t)) for t in range(manifest["num_tasks"]))
+    todo = len([n for n in os.listdir(os.path.join(queue_dir, 'todo')) if n.endswith('.json')])
+    claimed = len([n for n in os.listdir(os.path.join(queue_dir, 'claimed')) if n.endswith('.json')])
+    return todo, claimed, finished, len(failed_tasks(queue_dir)), manifest["num_tasks"]
+
+
+def reduce_queue(queue_dir, output_json, compact=False):
+    """
+    Combine the per-task results into one COCO file, laid out as a single main.py run would write it.
+
+    Args:
+        queue_dir: Shared directory holding the queue
+        output_json: Path of the COCO file to write
+        compact: Write output_json without indentation
+    """
+    from main import image_record
+
+    manifest = load_manifest(queue_dir)
+    missing = [t for t in range(manifest["num_tasks"]) if not os.path.exists(result_path(queue_dir, t))]
+    failed = [record for record in failed_tasks(queue_dir) if record["task"] in missing]
+    if failed:
+        raise RuntimeError(f"{len(failed)} tasks failed, e.g. task {failed[0]['task']}: {failed[0]['error']}; "
+                           f"fix the input and move failed/*.json back to todo/ to retry")
+    if missing:
+        raise RuntimeError(f"{len(missing)} of {manifest['num_tasks']} tasks are not finished, e.g. task {missing[0]}")
+
+    chunk_size = manifest["chunk_size"]
+    image_id = 0
+    annotation_id = 0
+    with CocoWriter(output_json, CATEGORIES, indent=None if compact else 2) as writer:
+        for task in range(manifest["num_tasks"]):
+            sizes, dets_per_image = load_result(result_path(queue_dir, task))
+            names = manifest["images"][task * chunk_size:(task + 1) * chunk_size]
+            for name, (width, height), dets in zip(names, sizes.tolist(), dets_per_image):
+                writer.add_image(image_record({"path": name, "width": width, "height": height}, image_id))
+                writer.add_annotation_lines(annotation_lines(dets[:, :4], dets[:, 5], image_id, annotation_id))
+                annotation_id += len(dets)
+                image_id += 1
+    print(f"Wrote {image_id} images and {annotation_id} annotations from {manifest['num_tasks']} tasks to {output_json}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('command', choices=('init', 'work', 'status', 'reduce'))
+    parser.add_argument('--queue_dir', required=True, help='Shared directory holding the queue')
+    parser.add_argument('--image_dir', help='init: directory of the images, at the same path on every node')
+    parser.add_argument('--chunk_size', type=int, default=CHUNK_SIZE, help='init: images per task')
+    parser.add_argument('--batch_size', type=int, default=8, help='init: images per forward pass')
+    parser.add_argument('--imgsz', type=int, default=IMG_SIZE, help='init: inference size of the long image side')
+    parser.add_argument('--backend', default='torch', choices=BACKENDS, help='init: inference backend')
+    parser.add_argument('--workers', type=int, default=None, help='work: image decode threads')
+    parser.add_argument('--lease_timeout', type=float, default=LEASE_TIMEOUT,
+                        help='work: seconds before the claim of an unresponsive worker is re-queued')
+    parser.add_argument('--poll_interval', type=float, default=POLL_INTERVAL, help='work: seconds between polls')
+    parser.add_argument('--max_tasks', type=int, default=None, help='work: stop after this many tasks')
+    parser.add_argument('--output_dir', help='reduce: directory to write output.json to')
+    parser.add_argument('--compact', action='store_true', help='reduce: write output.json without indentation')
+    args = parser.parse_args()
+
+    if args.command == 'init':
+        if not args.image_dir:
+            parser.error('init needs --image_dir')
+        create_queue(args.image_dir, args.queue_dir, args.chunk_size, args.batch_size, args.imgsz, args.backend)
+    elif args.command == 'work':
+        run_worker(args.queue_dir, args.workers, args.lease_timeout, args.poll_interval, args.max_tasks)
+    elif args.command == 'status':
+        todo, claimed, finished, failed, total = queue_status(args.queue_dir)
+        print(f"{finished}/{total} tasks finished, {claimed} claimed, {todo} waiting, {failed} failed")
+        for record in failed_tasks(args.queue_dir):
+            print(f"  task {record['task']} failed on {record['worker']}: {record['error']}")
+    else:
+        if not args.output_dir:
+            parser.error('reduce needs --output_dir')
+        os.makedirs(args.output_dir, exist_ok=True)
+        reduce_queue(args.queue_dir, os.path.join(args.output_dir, 'output.json'), args.compact)